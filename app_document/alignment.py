@@ -0,0 +1,145 @@
+import re
+from bisect import bisect_left
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Số từ liên tiếp tạo thành một seed và số vị trí tối đa thử cho mỗi seed
+SEED_WORDS = 3
+MAX_SEED_CANDIDATES = 8
+
+# 'seed': engine tuyến tính theo seed hash; 'difflib': SequenceMatcher như trước.
+# Chọn bằng settings.PLAGIARISM_ALIGNMENT_METHOD, không đặt thì dùng DEFAULT_METHOD
+DEFAULT_METHOD = 'seed'
+
+
+def _common_prefix(text1: str, i: int, text2: str, j: int) -> int:
+    """
+    Độ dài đoạn giống nhau bắt đầu tại text1[i] và text2[j].
+    So sánh theo khối với kích thước tăng gấp đôi rồi tìm nhị phân,
+    nên phép so sánh chạy trong C thay vì từng ký tự trong Python.
+    """
+    limit = min(len(text1) - i, len(text2) - j)
+    low, step = 0, 16
+    while low < limit:
+        high = min(low + step, limit)
+        if text1[i + low:i + high] != text2[j + low:j + high]:
+            break
+        low = high
+        step *= 2
+    else:
+        return low
+
+    # Đoạn [low, high) có ký tự khác nhau: tìm nhị phân vị trí khác đầu tiên
+    while high - low > 1:
+        mid = (low + high) // 2
+        if text1[i + low:i + mid] == text2[j + low:j + mid]:
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def _common_suffix(text1: str, i: int, text2: str, j: int, limit: int) -> int:
+    """
+    Độ dài đoạn giống nhau kết thúc ngay trước text1[i] và text2[j], tối đa limit ký tự.
+    """
+    limit = min(limit, i, j)
+    size = 0
+    while size < limit and text1[i - size - 1] == text2[j - size - 1]:
+        size += 1
+    return size
+
+
+def seed_matching_blocks(text1: str, text2: str, threshold: int = 10) -> list[tuple[int, int, int]]:
+    """
+    Tìm các đoạn trùng khớp tối đại giữa text1 và text2 trong thời gian gần O(n + m):
+    1. Băm mọi cụm SEED_WORDS từ liên tiếp của text2 vào một dict.
+    2. Duyệt text1 theo từ, khi cụm từ hiện tại có trong dict thì mở rộng
+       sang hai phía theo ký tự để được đoạn trùng dài nhất.
+    3. Bỏ qua phần text1 đã nằm trong một đoạn trùng.
+    Trả về các khối (i, j, size) giống SequenceMatcher.get_matching_blocks(),
+    sắp theo i, không chồng lấn trên text1, chỉ giữ khối có size >= threshold.
+    """
+    words1 = [(m.start(), m.end()) for m in WORD_PATTERN.finditer(text1)]
+    words2 = [(m.start(), m.end()) for m in WORD_PATTERN.finditer(text2)]
+    if len(words1) < SEED_WORDS or len(words2) < SEED_WORDS:
+        return []
+
+    seeds: dict[tuple[str, ...], list[int]] = {}
+    for w in range(len(words2) - SEED_WORDS + 1):
+        key = tuple(text2[start:end] for start, end in words2[w:w + SEED_WORDS])
+        positions = seeds.setdefault(key, [])
+        if len(positions) < MAX_SEED_CANDIDATES:
+            positions.append(w)
+
+    word_starts1 = [start for start, _ in words1]
+    blocks = []
+    covered_until = 0
+    w = 0
+    while w <= len(words1) - SEED_WORDS:
+        start1 = words1[w][0]
+        key = tuple(text1[start:end] for start, end in words1[w:w + SEED_WORDS])
+        best = None
+        for w2 in seeds.get(key, ()):
+            start2 = words2[w2][0]
+            forward = _common_prefix(text1, start1, text2, start2)
+            backward = _common_suffix(text1, start1, text2, start2, limit=start1 - covered_until)
+            if best is None or backward + forward > best[2]:
+                best = (start1 - backward, start2 - backward, backward + forward)
+
+        if best is not None and best[2] >= threshold:
+            blocks.append(best)
+            covered_until = best[0] + best[2]
+            w = max(w + 1, bisect_left(word_starts1, covered_until))
+        else:
+            w += 1
+    return blocks
+
+
+def difflib_matching_blocks(text1: str, text2: str, threshold: int = 10) -> list[tuple[int, int, int]]:
+    matcher = SequenceMatcher(None, text1, text2)
+    return [tuple(block) for block in matcher.get_matching_blocks() if block.size >= threshold]
+
+
+def get_matching_blocks(
+    text1: str,
+    text2: str,
+    threshold: int = 10,
+    method: str = None,
+) -> list[tuple[int, int, int]]:
+    """
+    Các khối (i, j, size) trùng nhau giữa text1 và text2 với size >= threshold.
+    method: 'seed' hoặc 'difflib' để so sánh với cách cũ;
+    không truyền thì theo settings.PLAGIARISM_ALIGNMENT_METHOD (mặc định 'seed').
+    """
+    method = method or getattr(settings, 'PLAGIARISM_ALIGNMENT_METHOD', DEFAULT_METHOD)
+    if method == 'seed':
+        return seed_matching_blocks(text1, text2, threshold)
+    if method == 'difflib':
+        return difflib_matching_blocks(text1, text2, threshold)
+    raise ValueError(f"Unknown alignment method: {method}")
+
+
+def merge_intervals(intervals) -> list[tuple[int, int]]:
+    """
+    Gộp các khoảng [start, end) chồng lấn hoặc liền kề, trả về danh sách đã sắp xếp.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def coverage(intervals) -> int:
+    """
+    Tổng số ký tự được phủ bởi các khoảng (đã tính phần chồng lấn một lần).
+    """
+    return sum(end - start for start, end in merge_intervals(intervals))
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppDocumentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_document'
+
+    def ready(self):
+        # Đăng ký signal xoá document khỏi segment index và xoá báo cáo / PDF đã cache
+        from . import export, reports, segments  # noqa: F401
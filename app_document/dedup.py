@@ -0,0 +1,68 @@
+import hashlib
+
+from django.core.cache import cache
+
+from .models import PlagiarismCheck
+from .tokens import decode_tokens, encode_tokens
+
+
+# Thời gian giữ kết quả trong cache (giây)
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def file_sha256(uploaded_file) -> str:
+    """
+    SHA-256 của nội dung file upload, đọc theo chunk rồi đưa con trỏ về đầu file.
+    """
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def _key(kind: str, content_hash: str) -> str:
+    return f"plagiarism:{kind}:{content_hash}"
+
+
+def cache_extraction(content_hash: str, text: str, tokens: list[str]):
+    cache.set_many({
+        _key('text', content_hash): text,
+        _key('tokens', content_hash): encode_tokens(tokens),
+    }, CACHE_TIMEOUT)
+
+
+def cached_extraction(content_hash: str) -> tuple[str, list[str]] | None:
+    """
+    (text, tokens) đã trích xuất trước đó cho cùng nội dung file, None nếu chưa có.
+    """
+    cached = cache.get_many([_key('text', content_hash), _key('tokens', content_hash)])
+    if len(cached) < 2:
+        return None
+    return cached[_key('text', content_hash)], decode_tokens(cached[_key('tokens', content_hash)])
+
+
+def cache_latest_check(content_hash: str, check_id: int):
+    cache.set(_key('check', content_hash), check_id, CACHE_TIMEOUT)
+
+
+def find_latest_check(content_hash: str) -> PlagiarismCheck | None:
+    """
+    PlagiarismCheck mới nhất của một Document có cùng nội dung file.
+    Tra cache trước, không có thì tra cột Document.content_hash (có index).
+    """
+    check_id = cache.get(_key('check', content_hash))
+    if check_id is not None:
+        check = PlagiarismCheck.objects.select_related('document').filter(id=check_id).first()
+        if check is not None:
+            return check
+
+    check = (
+        PlagiarismCheck.objects.select_related('document')
+        .filter(document__content_hash=content_hash)
+        .order_by('-checked_at')
+        .first()
+    )
+    if check is not None:
+        cache_latest_check(content_hash, check.id)
+    return check
@@ -0,0 +1,308 @@
+import math
+import threading
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from .idf import idf_cache
+from .models import CorpusVersion, Document, Posting, Term
+
+
+# Dựng lại toàn bộ ma trận khi số cột bị tắt / thay đổi vượt tỉ lệ này (vd. sau reweight_index)
+REBUILD_FRACTION = 0.25
+# Nạp Posting của nhiều document hơn ngưỡng này thì đọc cả bảng thay vì document_id IN (...)
+ENGINE_IN_QUERY_LIMIT = 5000
+
+
+class TfidfEngine:
+    """
+    Ma trận TF–IDF thưa của toàn bộ corpus, giữ trong bộ nhớ của từng worker process.
+    - normalized: CSR kích thước (số term × số cột), ô (t, d) = Posting.weight / Document.vector_norm,
+      dot với query cho thẳng cosine.
+    - doc_ids: document của từng cột; live: cột còn dùng (document bị xoá hoặc index lại
+      thì cột cũ bị tắt và bị xoá trắng, bản mới được nối thêm ở cuối).
+    - term_bounds: |trọng số chuẩn hoá| lớn nhất của từng term (cận trên cho MaxScore);
+      term_mins, term_maxs: trọng số nhỏ nhất / lớn nhất (xem _has_negative_terms).
+    Trọng số và norm được lưu lúc index_document / reweight_index nên chỉ cần nạp lên;
+    IDF của query lấy từ idf_cache (N, DF hiện tại).
+    Khi CorpusVersion đổi, refresh() chỉ nạp Posting của các document có
+    Document.index_version mới hơn engine; dựng lại toàn bộ khi quá nhiều cột thay đổi.
+    """
+
+    def __init__(self, version, term_generation, term_index, term_rows, doc_ids, live, normalized):
+        self.version = version
+        self.term_generation = term_generation
+        self.term_index = term_index
+        self.term_rows = term_rows
+        self.doc_ids = doc_ids
+        self.live = live
+        self.normalized = normalized
+        self.normalized.sort_indices()
+        if self.normalized.shape[1]:
+            self.term_bounds = np.asarray(abs(self.normalized).max(axis=1).todense()).ravel()
+            self.term_mins = np.asarray(self.normalized.min(axis=1).todense()).ravel()
+            self.term_maxs = np.asarray(self.normalized.max(axis=1).todense()).ravel()
+        else:
+            self.term_bounds = self.term_mins = self.term_maxs = np.zeros(self.normalized.shape[0])
+
+    @staticmethod
+    def _load_columns(documents, term_index: dict, term_rows: dict):
+        """
+        Cột chuẩn hoá của các document [(doc_id, vector_norm)]: trả về (doc_ids, rows, cols, values).
+        Term chưa có trong term_index được thêm dòng mới (cập nhật term_index/term_rows tại chỗ).
+        """
+        doc_ids = [doc_id for doc_id, _ in documents]
+        doc_index = {doc_id: col for col, doc_id in enumerate(doc_ids)}
+        inverse_norms = [1.0 / norm if norm > 0 else 0.0 for _, norm in documents]
+
+        postings = Posting.objects.values_list('term_id', 'document_id', 'weight')
+        if len(doc_ids) < ENGINE_IN_QUERY_LIMIT:
+            postings = postings.filter(document_id__in=doc_ids)
+
+        rows, cols, values = [], [], []
+        unknown = []
+        for term_id, doc_id, weight in postings.iterator(chunk_size=10000):
+            col = doc_index.get(doc_id)
+            if col is None:
+                continue
+            row = term_rows.get(term_id)
+            if row is None:
+                unknown.append(len(rows))
+                row = -term_id  # đổi sang dòng thật sau khi tra text của term
+            rows.append(row)
+            cols.append(col)
+            values.append(weight * inverse_norms[col])
+
+        if unknown:
+            new_ids = {-rows[i] for i in unknown}
+            for term_id, term_text in Term.objects.filter(id__in=new_ids).values_list('id', 'text'):
+                row = term_index.setdefault(term_text, len(term_index))
+                term_rows[term_id] = row
+            for i in unknown:
+                rows[i] = term_rows[-rows[i]]
+        return doc_ids, rows, cols, values
+
+    @classmethod
+    def build(cls, version=None, term_generation=None) -> "TfidfEngine":
+        """
+        Đọc Term, Document, Posting từ database và dựng ma trận CSR.
+        """
+        term_index: dict[str, int] = {}
+        term_rows: dict[int, int] = {}
+        for term_id, term_text in Term.objects.values_list('id', 'text').iterator(chunk_size=10000):
+            term_index[term_text] = term_rows[term_id] = len(term_index)
+
+        documents = list(Document.objects.filter(doc_length__gt=0).values_list('id', 'vector_norm'))
+        doc_ids, rows, cols, values = cls._load_columns(documents, term_index, term_rows)
+        normalized = _csr(rows, cols, values, (len(term_index), len(doc_ids)))
+        return cls(
+            version=version,
+            term_generation=term_generation,
+            term_index=term_index,
+            term_rows=term_rows,
+            doc_ids=np.asarray(doc_ids, dtype=np.int64),
+            live=np.ones(len(doc_ids), dtype=bool),
+            normalized=normalized,
+        )
+
+    def refresh(self, version, term_generation) -> "TfidfEngine":
+        """
+        Engine mới cho CorpusVersion version, dùng lại ma trận hiện tại:
+        tắt cột của document đã xoá / index lại và nối cột mới cho document index sau self.version.
+        """
+        if term_generation != self.term_generation:
+            return self.build(version, term_generation)
+
+        indexed = Document.objects.filter(doc_length__gt=0)
+        changed = list(indexed.filter(index_version__gt=self.version).values_list('id', 'vector_norm'))
+        live_ids = np.fromiter(indexed.values_list('id', flat=True).iterator(), dtype=np.int64)
+
+        live = self.live & np.isin(self.doc_ids, live_ids)
+        live &= ~np.isin(self.doc_ids, np.asarray([doc_id for doc_id, _ in changed], dtype=np.int64))
+        dead = len(live) - int(live.sum()) + len(changed)
+        if dead > REBUILD_FRACTION * max(len(live) + len(changed), 1):
+            return self.build(version, term_generation)
+
+        term_index, term_rows = dict(self.term_index), dict(self.term_rows)
+        doc_ids, rows, cols, values = self._load_columns(changed, term_index, term_rows)
+        shape = (len(term_index), self.normalized.shape[1])
+        old = sparse.csr_matrix(self.normalized @ sparse.diags(live.astype(np.float64)))
+        if shape[0] > old.shape[0]:
+            old = sparse.vstack([old, sparse.csr_matrix((shape[0] - old.shape[0], shape[1]))], format='csr')
+        normalized = sparse.hstack([old, _csr(rows, cols, values, (shape[0], len(doc_ids)))], format='csr')
+        normalized.eliminate_zeros()
+        return TfidfEngine(
+            version=version,
+            term_generation=term_generation,
+            term_index=term_index,
+            term_rows=term_rows,
+            doc_ids=np.concatenate([self.doc_ids, np.asarray(doc_ids, dtype=np.int64)]),
+            live=np.concatenate([live, np.ones(len(doc_ids), dtype=bool)]),
+            normalized=normalized,
+        )
+
+    def query_vector(self, tokens: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+        """
+        Trả về (chỉ số dòng, trọng số, IDF) của các term trong query có mặt trong corpus
+        và độ dài của toàn bộ vector query (kể cả term chưa từng xuất hiện).
+        """
+        q_tf = Counter(tokens)
+        q_len = len(tokens)
+        idf = idf_cache.bulk_idf(q_tf)
+
+        rows, weights, idfs = [], [], []
+        norm_sq = 0.0
+        for term_text, freq in q_tf.items():
+            weight = freq / q_len * idf[term_text]
+            norm_sq += weight * weight
+            row = self.term_index.get(term_text)
+            if row is not None:
+                rows.append(row)
+                weights.append(weight)
+                idfs.append(idf[term_text])
+        return (
+            np.asarray(rows, dtype=np.int64),
+            np.asarray(weights, dtype=np.float64),
+            np.asarray(idfs, dtype=np.float64),
+            math.sqrt(norm_sq),
+        )
+
+    def search(
+        self,
+        tokens: list[str],
+        top_n: int = 5,
+        exclude_doc_id: int = None,
+        strategy: str = 'maxscore',
+    ) -> list[tuple[int, float]]:
+        """
+        Tính cosine similarity giữa query và corpus, trả về top_n cặp (doc_id, score)
+        có score > 0, giảm dần theo score.
+        - strategy='exhaustive': một phép nhân ma trận thưa × vector trên toàn corpus.
+        - strategy='maxscore': duyệt từng posting list theo IDF giảm dần, dừng mở rộng
+          tập ứng viên khi không document mới nào còn có thể lọt vào top_n.
+        Hai chiến lược cho cùng kết quả.
+        """
+        if not tokens or not len(self.doc_ids) or top_n <= 0:
+            return []
+        rows, weights, idfs, q_norm = self.query_vector(tokens)
+        if not len(rows) or q_norm == 0:
+            return []
+
+        # Cột của document bị loại trừ (có thể có cả cột cũ đã tắt của nó)
+        exclude_cols = np.flatnonzero(self.doc_ids == exclude_doc_id) if exclude_doc_id is not None \
+            else np.empty(0, dtype=np.int64)
+
+        if strategy == 'exhaustive':
+            cols, dots = self._score_exhaustive(rows, weights, exclude_cols)
+        elif strategy == 'maxscore':
+            if self._has_negative_terms(rows, weights):
+                cols, dots = self._score_exhaustive(rows, weights, exclude_cols)
+            else:
+                cols, dots = self._score_maxscore(rows, weights, idfs, top_n, exclude_cols)
+        else:
+            raise ValueError(f"Unknown search strategy: {strategy}")
+
+        scores = dots / q_norm
+        positive = np.flatnonzero(scores > 0)
+        if len(positive) > top_n:
+            positive = positive[np.argpartition(-scores[positive], top_n - 1)[:top_n]]
+        positive = positive[np.argsort(-scores[positive], kind='stable')]
+        return [(int(self.doc_ids[cols[i]]), float(scores[i])) for i in positive]
+
+    def _score_exhaustive(self, rows, weights, exclude_cols):
+        dots = self.normalized[rows].T @ weights
+        dots[exclude_cols] = 0.0
+        return np.arange(len(dots)), dots
+
+    def _has_negative_terms(self, rows, weights) -> bool:
+        """
+        Có term làm giảm score của một document nào đó: IDF âm (df + 1 > N) và trọng số đã lưu
+        khác dấu với IDF hiện tại (vd. index lúc N còn nhỏ). Khi đó cận trên của MaxScore
+        không còn đúng (score có thể giảm), phải tính exhaustive.
+        """
+        return bool(np.any(
+            ((weights > 0) & (self.term_mins[rows] < 0)) | ((weights < 0) & (self.term_maxs[rows] > 0))
+        ))
+
+    def _posting_list(self, row):
+        start, end = self.normalized.indptr[row], self.normalized.indptr[row + 1]
+        return self.normalized.indices[start:end], self.normalized.data[start:end]
+
+    def _score_maxscore(self, rows, weights, idfs, top_n, exclude_cols):
+        """
+        Term-at-a-time với cận trên MaxScore, chỉ đúng khi mọi term đều cộng thêm
+        (không trừ bớt) vào score (xem _has_negative_terms).
+        remaining[i] = tổng cận trên đóng góp của các term từ vị trí i trở đi;
+        một document chưa gặp chỉ có thể đạt tối đa remaining[i], nên khi ngưỡng top_n
+        hiện tại >= remaining[i] thì ngừng nhận ứng viên mới và chỉ cộng nốt điểm
+        cho các ứng viên còn khả năng lọt top_n (tra cứu bằng tìm kiếm nhị phân).
+        """
+        order = np.argsort(-idfs, kind='stable')
+        rows, weights = rows[order], weights[order]
+        bounds = np.abs(weights) * self.term_bounds[rows]
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0)
+
+        accumulator = np.zeros(len(self.doc_ids))
+        seen = np.zeros(len(self.doc_ids), dtype=bool)
+        seen[exclude_cols] = True  # không bao giờ trở thành ứng viên
+        candidates = np.empty(0, dtype=np.int64)
+
+        def threshold():
+            if len(candidates) < top_n:
+                return -np.inf
+            return np.partition(accumulator[candidates], len(candidates) - top_n)[len(candidates) - top_n]
+
+        i = 0
+        # Pha 1: hợp các posting list, mọi document gặp được đều là ứng viên
+        while i < len(rows):
+            indices, data = self._posting_list(rows[i])
+            accumulator[indices] += data * weights[i]
+            new_docs = indices[~seen[indices]]
+            seen[new_docs] = True
+            candidates = np.concatenate([candidates, new_docs])
+            i += 1
+            if threshold() >= remaining[i]:
+                break
+
+        # Pha 2: chỉ cập nhật ứng viên còn có thể vượt ngưỡng
+        while i < len(rows) and len(candidates):
+            candidates = candidates[accumulator[candidates] + remaining[i] >= threshold()]
+            indices, data = self._posting_list(rows[i])
+            if len(indices):
+                positions = np.minimum(np.searchsorted(indices, candidates), len(indices) - 1)
+                matched = indices[positions] == candidates
+                accumulator[candidates[matched]] += data[positions[matched]] * weights[i]
+            i += 1
+
+        return candidates, accumulator[candidates]
+
+
+def _csr(rows, cols, values, shape) -> sparse.csr_matrix:
+    return sparse.csr_matrix(
+        (
+            np.asarray(values, dtype=np.float64),
+            (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)),
+        ),
+        shape=shape,
+    )
+
+
+_engine: TfidfEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> TfidfEngine:
+    """
+    Lấy engine của worker hiện tại; khi CorpusVersion đã thay đổi thì cập nhật phần thay đổi
+    (TfidfEngine.refresh), không đọc lại toàn bộ Posting.
+    """
+    global _engine
+    version, term_generation = CorpusVersion.objects.filter(pk=CorpusVersion.SINGLETON_ID) \
+        .values_list('version', 'term_generation').first() or (0, 0)
+    with _engine_lock:
+        if _engine is None:
+            _engine = TfidfEngine.build(version, term_generation)
+        elif _engine.version != version:
+            _engine = _engine.refresh(version, term_generation)
+        return _engine
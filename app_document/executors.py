@@ -0,0 +1,70 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+
+
+class InlineExecutor:
+    """
+    Executor chạy ngay trong process hiện tại, dùng khi chỉ có một việc
+    hoặc PLAGIARISM_WORKERS = 1 (không tốn chi phí tạo process).
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def completed_future(value) -> Future:
+    """
+    Future đã có sẵn kết quả (vd. lấy từ cache), dùng lẫn với future của executor.
+    """
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def in_worker_process() -> bool:
+    """
+    True nếu đang chạy trong process con của một pool (không tạo pool lồng nhau).
+    """
+    return multiprocessing.parent_process() is not None
+
+
+def get_executor(max_workers: int):
+    """
+    Process pool cho các bước nặng CPU (pypdf, ViTokenizer, alignment),
+    giới hạn bởi PLAGIARISM_WORKERS; chỉ một việc thì chạy ngay trong process hiện tại.
+    Dùng fork để process con kế thừa Django đã setup; process con không chạm database.
+    """
+    max_workers = min(max_workers, getattr(settings, 'PLAGIARISM_WORKERS', 1))
+    if max_workers <= 1 or in_worker_process():
+        return InlineExecutor()
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def terminate_executor(executor):
+    """
+    Dừng executor ngay: huỷ các việc chưa chạy và kill các process con (kể cả process
+    đang bị treo giữa chừng), không chờ chúng kết thúc.
+    """
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
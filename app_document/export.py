@@ -0,0 +1,294 @@
+import logging
+import os
+import zlib
+from html import escape
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab import rl_config
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFDictionary, PDFName, PDFStream
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+from .highlight import check_highlights, check_is_stale, highlight_color, iter_highlight_segments, iter_paragraphs
+from .models import CheckJob, Document, PlagiarismCheck
+
+
+logger = logging.getLogger(__name__)
+
+# Font TTF có đủ dấu tiếng Việt, thử lần lượt nếu settings.PDF_EXPORT_FONT không được đặt
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+]
+FONT_NAME = 'ExportUnicode'
+FALLBACK_FONT_NAME = 'Helvetica'  # Không có font TTF nào: chữ có dấu sẽ bị lỗi
+
+# Đoạn văn dài hơn ngưỡng này được chia nhỏ (ký tự): Paragraph rất dài ngắt trang chậm
+MAX_PARAGRAPH_CHARS = 4000
+# Số flowable (Paragraph) được dựng sẵn trước khi reportlab cần tới
+FLOWABLE_BUFFER = 64
+# Document dài hơn ngưỡng này (ký tự) được xuất PDF trong run_check_worker thay vì trong request
+EXPORT_INLINE_MAX_CHARS = 100_000
+
+EXPORT_DIR = 'exports'
+
+_font_name = None
+
+
+def export_font() -> str:
+    """
+    Tên font đã đăng ký với reportlab, đăng ký lần đầu khi được gọi.
+    """
+    global _font_name
+    if _font_name is None:
+        configured = getattr(settings, 'PDF_EXPORT_FONT', '')
+        if configured and not os.path.exists(configured):
+            raise ImproperlyConfigured(f"PDF_EXPORT_FONT does not exist: {configured}")
+        candidates = [configured] if configured else FONT_CANDIDATES
+        _font_name = FALLBACK_FONT_NAME
+        for path in candidates:
+            if os.path.exists(path):
+                pdfmetrics.registerFont(TTFont(FONT_NAME, path))
+                _font_name = FONT_NAME
+                break
+        else:
+            logger.warning(
+                "No Unicode TTF font found for PDF export (tried %s); falling back to %s, "
+                "Vietnamese diacritics will not render. Set PDF_EXPORT_FONT.",
+                ", ".join(candidates), FALLBACK_FONT_NAME,
+            )
+    return _font_name
+
+
+def export_name(document_id: int, check_id: int | None) -> str:
+    return f"{EXPORT_DIR}/{document_id}/{check_id or 0}.pdf"
+
+
+def _split_paragraph(start: int, end: int, text: str):
+    """
+    Chia khoảng [start, end) thành các khoảng không quá MAX_PARAGRAPH_CHARS, cắt ở khoảng trắng.
+    """
+    while end - start > MAX_PARAGRAPH_CHARS:
+        cut = text.rfind(' ', start + 1, start + MAX_PARAGRAPH_CHARS)
+        if cut == -1:
+            cut = start + MAX_PARAGRAPH_CHARS
+        yield start, cut
+        start = cut
+    yield start, end
+
+
+def _paragraph_markup(text: str, highlights, start: int, end: int) -> str:
+    """
+    Markup của reportlab cho text[start:end]: đoạn trùng được tô nền theo % matched.
+    """
+    parts = []
+    for segment, highlight in iter_highlight_segments(text, highlights, start, end):
+        segment = escape(segment, quote=False)
+        if highlight is None:
+            parts.append(segment)
+        else:
+            parts.append(f'<font backColor="{highlight_color(highlight[3])}">{segment}</font>')
+    return "".join(parts)
+
+
+def iter_flowables(document: Document, check: PlagiarismCheck | None):
+    font = export_font()
+    title_style = ParagraphStyle('ExportTitle', fontName=font, fontSize=16, leading=20, spaceAfter=4 * mm)
+    info_style = ParagraphStyle('ExportInfo', fontName=font, fontSize=10, leading=14, spaceAfter=6 * mm)
+    body_style = ParagraphStyle('ExportBody', fontName=font, fontSize=11, leading=15, spaceAfter=2 * mm)
+
+    text = document.content or ""
+    yield Paragraph(escape(document.title or 'document', quote=False), title_style)
+    if check is not None:
+        info = (
+            f"Tỷ lệ trùng lặp: {check.plagiarism_percentage}% "
+            f"(kiểm tra lúc {timezone.localtime(check.checked_at):%d/%m/%Y %H:%M})"
+        )
+        if check_is_stale(check):
+            info += " — nội dung đã được sửa sau lần kiểm tra này, không hiển thị đoạn trùng"
+        yield Paragraph(info, info_style)
+        highlights = check_highlights(check)
+    else:
+        yield Spacer(1, 4 * mm)
+        highlights = []
+
+    for _, paragraph_start, paragraph_end in iter_paragraphs(text):
+        for start, end in _split_paragraph(paragraph_start, paragraph_end, text):
+            if text[start:end].strip():
+                yield Paragraph(_paragraph_markup(text, highlights, start, end), body_style)
+
+
+class LazyFlowables(list):
+    """
+    Danh sách flowable cho SimpleDocTemplate.build được nạp dần từ generator:
+    build() chỉ dùng len(), flowables[0], del và chèn lại phần bị tách ở đầu danh sách,
+    nên mỗi lần gọi len() chỉ cần giữ sẵn tối đa buffer_size flowable chưa vẽ.
+    Paragraph đã vẽ được giải phóng, bộ nhớ không tăng theo độ dài document.
+    """
+
+    def __init__(self, flowables, buffer_size: int = FLOWABLE_BUFFER):
+        super().__init__()
+        self._source = iter(flowables)
+        self._buffer_size = buffer_size
+
+    def __len__(self):
+        size = super().__len__()
+        if self._source is not None and size < self._buffer_size:
+            for flowable in self._source:
+                self.append(flowable)
+                size += 1
+                if size >= self._buffer_size:
+                    break
+            else:
+                self._source = None
+        return size
+
+
+class CompressingCanvas(Canvas):
+    """
+    Canvas nén nội dung mỗi trang (FlateDecode, giống lúc reportlab nén khi lưu file) ngay khi
+    trang vẽ xong, thay vì giữ chuỗi lệnh chưa nén của mọi trang trong bộ nhớ đến cuối.
+    """
+
+    def showPage(self):
+        super().showPage()
+        page = self._doc.Pages.pages[-1]
+        if page.compression and page.stream and not page.Contents and not rl_config.useA85:
+            page.Contents = PDFStream(
+                PDFDictionary({"Filter": PDFArray([PDFName("FlateDecode")])}),
+                zlib.compress(page.stream.encode('utf-8')),
+            )
+            page.Contents.__Comment__ = "page stream"
+            page.stream = None
+
+
+def build_document_pdf(document: Document, check: PlagiarismCheck | None, output):
+    """
+    Ghi PDF của document (chữ tự xuống dòng, ngắt trang) vào output, kèm highlight của check.
+    Paragraph được dựng dần trong lúc vẽ (LazyFlowables), không dựng trước cả document,
+    và trang vẽ xong được nén ngay (CompressingCanvas).
+    """
+    pdf = SimpleDocTemplate(
+        output,
+        pagesize=A4,
+        leftMargin=20 * mm,
+        rightMargin=20 * mm,
+        topMargin=20 * mm,
+        bottomMargin=20 * mm,
+        title=document.title or 'document',
+    )
+    pdf.build(LazyFlowables(iter_flowables(document, check)), canvasmaker=CompressingCanvas)
+
+
+def write_document_pdf(document: Document) -> str:
+    """
+    Dựng PDF của document với highlight của lần kiểm tra mới nhất vào MEDIA_ROOT/exports,
+    trả về tên file trong storage. PDF được ghi vào file tạm cùng thư mục rồi đổi tên (os.replace),
+    nên request khác không bao giờ đọc phải file đang ghi dở.
+    """
+    name = export_name(document.id, document.latest_check_id)
+    path = Path(default_storage.path(name))
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    check = document.latest_check
+    if check is not None:
+        check.document = document
+    with NamedTemporaryFile(dir=path.parent, prefix='.tmp-', suffix='.pdf', delete=False) as output:
+        try:
+            build_document_pdf(document, check, output)
+            output.flush()
+            os.fsync(output.fileno())
+        except BaseException:
+            os.unlink(output.name)
+            raise
+    os.replace(output.name, path)
+    return name
+
+
+def exported_pdf(document: Document):
+    """
+    File PDF đã xuất (đã mở) của document với lần kiểm tra mới nhất, None nếu chưa có.
+    """
+    try:
+        return default_storage.open(export_name(document.id, document.latest_check_id), 'rb')
+    except FileNotFoundError:
+        return None
+
+
+def export_document_pdf(document: Document):
+    """
+    File PDF (đã mở, ở đầu file) của document với highlight của lần kiểm tra mới nhất.
+    Kết quả được lưu theo (document, check) trong MEDIA_ROOT/exports nên tải lại không phải dựng lại.
+    """
+    return exported_pdf(document) or default_storage.open(write_document_pdf(document), 'rb')
+
+
+def submit_export_job(document: Document, user=None) -> CheckJob:
+    """
+    Đưa việc xuất PDF của document vào hàng đợi của run_check_worker
+    (dùng lại job đang chờ / đang chạy nếu có).
+    """
+    pending = CheckJob.objects.filter(
+        document=document,
+        kind=CheckJob.KIND_EXPORT,
+        status__in=[CheckJob.STATUS_PENDING, CheckJob.STATUS_RUNNING],
+    ).first()
+    return pending or CheckJob.objects.create(
+        user=user,
+        document=document,
+        kind=CheckJob.KIND_EXPORT,
+        file_name=f"{document.title or 'document'}.pdf",
+    )
+
+
+def run_export_job(job: CheckJob):
+    document = Document.objects.select_related('latest_check').get(pk=job.document_id)
+    write_document_pdf(document)
+    return {"file_name": job.file_name, "document_id": document.id, "check_id": document.latest_check_id}
+
+
+def _delete_exports(document_id: int):
+    directory = f"{EXPORT_DIR}/{document_id}"
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for file_name in files:
+        if not file_name.startswith('.tmp-'):  # PDF đang được ghi dở
+            default_storage.delete(f"{directory}/{file_name}")
+
+
+def expire_document_exports(document):
+    """
+    Xoá các PDF đã xuất của document (sau khi transaction commit), dùng khi content thay đổi.
+    """
+    document_id = document.id
+    transaction.on_commit(lambda: _delete_exports(document_id))
+
+
+@receiver(post_delete, sender=Document)
+def delete_exports_on_document_delete(sender, instance, **kwargs):
+    expire_document_exports(instance)
+
+
+@receiver(post_delete, sender=PlagiarismCheck)
+def delete_export_on_check_delete(sender, instance, **kwargs):
+    name = export_name(instance.document_id, instance.id)
+    transaction.on_commit(lambda: default_storage.delete(name))
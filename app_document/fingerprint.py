@@ -0,0 +1,106 @@
+import hashlib
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Document, Fingerprint
+
+
+# Số token trong một k-gram và kích thước cửa sổ winnowing.
+# Mọi đoạn trùng dài ít nhất WINDOW_SIZE + KGRAM_SIZE - 1 token chắc chắn có chung fingerprint.
+KGRAM_SIZE = 5
+WINDOW_SIZE = 4
+
+# Số bản ghi tối đa trong một câu lệnh INSERT khi bulk_create
+BULK_BATCH_SIZE = 5000
+
+
+def kgram_hashes(tokens: list[str], k: int = KGRAM_SIZE) -> list[int]:
+    """
+    Băm từng k-gram token liên tiếp thành số nguyên 64-bit có dấu (vừa BigIntegerField).
+    Dùng blake2b thay vì hash() để giá trị ổn định giữa các process.
+    """
+    hashes = []
+    for i in range(len(tokens) - k + 1):
+        digest = hashlib.blake2b(" ".join(tokens[i:i + k]).encode('utf-8'), digest_size=8).digest()
+        hashes.append(int.from_bytes(digest, 'big', signed=True))
+    return hashes
+
+
+def winnow(hashes: list[int], window: int = WINDOW_SIZE) -> list[tuple[int, int]]:
+    """
+    Winnowing (Schleimer et al., 2003): trong mỗi cửa sổ `window` hash liên tiếp
+    chọn hash nhỏ nhất (lấy vị trí bên phải nhất nếu bằng nhau), bỏ các lần chọn trùng.
+    Trả về danh sách (hash, vị trí k-gram).
+    """
+    if not hashes:
+        return []
+    if len(hashes) <= window:
+        position = min(range(len(hashes)), key=lambda i: (hashes[i], -i))
+        return [(hashes[position], position)]
+
+    fingerprints = []
+    selected = -1
+    for start in range(len(hashes) - window + 1):
+        if selected < start:
+            # Vị trí được chọn đã trượt khỏi cửa sổ: quét lại cả cửa sổ
+            selected = start
+            for i in range(start + 1, start + window):
+                if hashes[i] <= hashes[selected]:
+                    selected = i
+            fingerprints.append((hashes[selected], selected))
+        else:
+            # Chỉ cần so với phần tử mới vào cửa sổ
+            new = start + window - 1
+            if hashes[new] <= hashes[selected]:
+                selected = new
+                fingerprints.append((hashes[selected], selected))
+    return fingerprints
+
+
+def fingerprint_tokens(tokens: list[str]) -> list[tuple[int, int]]:
+    return winnow(kgram_hashes(tokens))
+
+
+@transaction.atomic
+def index_fingerprints(document: Document, tokens: list[str]):
+    """
+    Ghi lại toàn bộ fingerprint của document (xoá bản cũ nếu index lại).
+    """
+    Fingerprint.objects.filter(document=document).delete()
+    Fingerprint.objects.bulk_create(
+        [
+            Fingerprint(hash=fingerprint_hash, document=document, position=position)
+            for fingerprint_hash, position in fingerprint_tokens(tokens)
+        ],
+        batch_size=BULK_BATCH_SIZE,
+    )
+
+
+def find_candidate_sources(
+    tokens: list[str],
+    top_n: int = 5,
+    exclude_doc_id: int = None,
+    doc_ids=None,
+) -> list[tuple[int, int]]:
+    """
+    Tra các fingerprint của query trong bảng Fingerprint (index theo hash),
+    trả về top_n cặp (doc_id, số hash trùng) giảm dần theo số hash trùng.
+    Chi phí tỉ lệ với độ dài query và số lần hash trùng, không phụ thuộc kích thước corpus.
+    doc_ids: chỉ xét các document này (vd. ứng viên từ TF–IDF).
+    """
+    hashes = {fingerprint_hash for fingerprint_hash, _ in fingerprint_tokens(tokens)}
+    if not hashes:
+        return []
+
+    matches = Fingerprint.objects.filter(hash__in=hashes)
+    if doc_ids is not None:
+        matches = matches.filter(document_id__in=doc_ids)
+    if exclude_doc_id is not None:
+        matches = matches.exclude(document_id=exclude_doc_id)
+    matches = (
+        matches.values('document_id')
+        .annotate(matched=Count('hash', distinct=True))
+        .order_by('-matched', 'document_id')[:top_n]
+    )
+    return [(row['document_id'], row['matched']) for row in matches]
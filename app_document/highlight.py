@@ -0,0 +1,234 @@
+import hashlib
+import sys
+from array import array
+from bisect import bisect_right
+from html import escape
+
+
+# Highlight là tuple (start, end, source, percent):
+# - start, end: khoảng [start, end) trong text
+# - source: id của document nguồn (None nếu không rõ)
+# - percent: matched_percent dùng để chọn màu
+#
+# PlagiarismCheck.highlight_spans lưu (start, end, source) dạng mảng uint32 little-endian,
+# mỗi highlight 3 số; source = 0 khi không rõ nguồn.
+UNKNOWN_SOURCE = 0
+
+# Kích thước (ký tự) mỗi khối HTML khi stream báo cáo
+STREAM_CHUNK_CHARS = 16 * 1024
+
+
+def highlight_color(percent: float) -> str:
+    """
+    Màu nền của một đoạn trùng theo % matched.
+    """
+    percent = max(0, min(percent, 100))  # Clamp từ 0 → 100
+    if percent < 20:
+        return '#ccffcc'  # xanh nhạt
+    elif percent < 50:
+        return '#ffff99'  # vàng
+    elif percent < 80:
+        return '#ff6666'  # đỏ
+    else:
+        return 'yellow'  # cam
+
+
+def pack_spans(highlights) -> bytes:
+    """
+    Mã hoá các highlight (chỉ lấy start, end, source) thành bytes để lưu vào database.
+    """
+    spans = array('I')
+    for start, end, source, *_ in sorted(highlights, key=lambda hl: (hl[0], hl[1])):
+        spans.extend((start, end, source or UNKNOWN_SOURCE))
+    if sys.byteorder == 'big':
+        spans.byteswap()
+    return spans.tobytes()
+
+
+def unpack_spans(data: bytes) -> list[tuple[int, int, int | None]]:
+    """
+    Ngược lại của pack_spans: danh sách (start, end, source).
+    """
+    spans = array('I')
+    spans.frombytes(bytes(data or b''))
+    if sys.byteorder == 'big':
+        spans.byteswap()
+    return [
+        (spans[i], spans[i + 1], spans[i + 2] or None)
+        for i in range(0, len(spans) - 2, 3)
+    ]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+
+def check_is_stale(check) -> bool:
+    """
+    Content của document đã bị sửa sau lần kiểm tra: offset trong highlight_spans trỏ sai chỗ.
+    """
+    return bool(check.text_hash) and check.text_hash != text_hash(check.document.content)
+
+
+def check_highlights(check) -> list[tuple]:
+    """
+    Highlight đã gộp của một PlagiarismCheck, đọc thẳng từ offset đã lưu.
+    Màu của mỗi đoạn theo matched_percent của nguồn tương ứng trong duplicate_sources.
+    Check đã cũ (check_is_stale) không có highlight.
+    """
+    if check_is_stale(check):
+        return []
+    source_percents = {
+        src.get('source_id'): src.get('matched_percent') or 0
+        for src in check.duplicate_sources or []
+    }
+    highlights = [
+        (start, end, source, source_percents.get(source, check.max_matched_percent))
+        for start, end, source in unpack_spans(check.highlight_spans)
+    ]
+    return merge_highlights(highlights, len(check.document.content or ""))
+
+
+def locate_snippets(text: str, snippets: list[str], source=None, percent: float = 0) -> list[tuple]:
+    """
+    Tìm vị trí các đoạn trùng (đã lưu dạng chuỗi, theo thứ tự xuất hiện) trong text.
+    Mỗi lần tìm bắt đầu từ cuối đoạn trước nên tổng chi phí là một lượt qua text.
+    """
+    highlights = []
+    last_idx = 0
+    for snippet in snippets:
+        if not snippet:
+            continue
+        start_idx = text.find(snippet, last_idx)
+        if start_idx != -1:
+            last_idx = start_idx + len(snippet)
+            highlights.append((start_idx, last_idx, source, percent))
+    return highlights
+
+
+def merge_highlights(highlights, text_length: int = None) -> list[tuple]:
+    """
+    Sắp xếp và gộp các highlight chồng lấn hoặc liền kề trong một lượt, kết quả
+    không có khoảng lồng nhau. Khoảng gộp mang source/percent của highlight có percent cao nhất.
+    Khoảng nằm ngoài [0, text_length) bị cắt bớt, khoảng rỗng bị bỏ.
+    """
+    merged = []
+    for start, end, source, percent in sorted(highlights, key=lambda hl: (hl[0], hl[1])):
+        start = max(start, 0)
+        if text_length is not None:
+            end = min(end, text_length)
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            last_start, last_end, last_source, last_percent = merged[-1]
+            if percent > last_percent:
+                last_source, last_percent = source, percent
+            merged[-1] = (last_start, max(last_end, end), last_source, last_percent)
+        else:
+            merged.append((start, end, source, percent))
+    return merged
+
+
+def iter_highlight_segments(text: str, highlights, start: int = 0, end: int = None):
+    """
+    Chia text[start:end] thành các đoạn liên tiếp (chuỗi, highlight hoặc None).
+    highlights phải đã qua merge_highlights (đã sắp xếp, không chồng lấn); phần nằm ngoài
+    [start, end) bị cắt bỏ.
+    """
+    end = len(text) if end is None else end
+    last_idx = start
+    for highlight in highlights:
+        hl_start, hl_end = max(highlight[0], start), min(highlight[1], end)
+        if hl_start >= hl_end:
+            continue
+        if hl_start > last_idx:
+            yield text[last_idx:hl_start], None
+        yield text[hl_start:hl_end], highlight
+        last_idx = hl_end
+    if last_idx < end:
+        yield text[last_idx:end], None
+
+
+def iter_highlight_html(text: str, highlights, start: int = 0, end: int = None):
+    """
+    Sinh HTML của text[start:end] theo từng mảnh: đoạn thường và thẻ <span> tô màu cho mỗi highlight.
+    """
+    for segment, highlight in iter_highlight_segments(text, highlights, start, end):
+        if highlight is None:
+            yield escape(segment, quote=False)
+            continue
+        _, _, source, percent = highlight
+        source_attr = f' data-source="{source}"' if source is not None else ''
+        yield (
+            f'<span style="background-color: {highlight_color(percent)};"{source_attr}>'
+            f'{escape(segment, quote=False)}</span>'
+        )
+
+
+def iter_paragraphs(text: str, first: int = 0, count: int = None):
+    """
+    Các đoạn (index, start, end) của text, phân tách bởi "\n", bắt đầu từ đoạn thứ first.
+    """
+    index, pos = 0, 0
+    while count is None or index < first + count:
+        newline = text.find("\n", pos)
+        end = len(text) if newline == -1 else newline
+        if index >= first:
+            yield index, pos, end
+        if newline == -1:
+            return
+        index, pos = index + 1, newline + 1
+
+
+def count_paragraphs(text: str) -> int:
+    return text.count("\n") + 1
+
+
+def iter_paragraph_html(text: str, highlights, first: int = 0, count: int = None):
+    """
+    HTML của từng đoạn (<p data-paragraph="i">...</p>), đoạn rỗng bị bỏ qua.
+    highlights đã gộp; highlight kéo dài qua nhiều đoạn được cắt theo từng đoạn.
+    """
+    ends = [hl[1] for hl in highlights]
+    current = None
+    for index, start, end in iter_paragraphs(text, first, count):
+        if current is None:
+            current = bisect_right(ends, start)
+        while current < len(highlights) and highlights[current][1] <= start:
+            current += 1
+        if start == end:
+            continue
+        last = current
+        while last < len(highlights) and highlights[last][0] < end:
+            last += 1
+        body = "".join(iter_highlight_html(text, highlights[current:last], start, end))
+        yield f'<p data-paragraph="{index}">{body}</p>\n'
+
+
+def iter_chunks(pieces, chunk_chars: int = STREAM_CHUNK_CHARS):
+    """
+    Ghép các mảnh HTML nhỏ thành khối khoảng chunk_chars ký tự trước khi gửi đi.
+    """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_chars:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def render_highlight_html(text: str, highlights) -> str:
+    """
+    Gộp highlight rồi ghép HTML một lần bằng "".join (không cộng chuỗi lặp lại).
+    """
+    return "".join(iter_highlight_html(text, merge_highlights(highlights, len(text))))
+
+
+def highlight_ranges(highlights) -> list[dict]:
+    """
+    Danh sách {"start", "end"} trả về cho frontend.
+    """
+    return [{"start": start, "end": end} for start, end, _, _ in highlights]
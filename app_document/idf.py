@@ -0,0 +1,80 @@
+import math
+import threading
+import time
+
+from .models import CorpusVersion, Document, Term
+
+
+# Khoảng thời gian (giây) tối thiểu giữa hai lần kiểm tra CorpusVersion
+VERSION_CHECK_INTERVAL = 1.0
+
+
+def idf_value(total_docs: int, doc_freq: int) -> float:
+    """
+    IDF = log10( N / (1 + df(term) ) )
+    """
+    # +1 để tránh chia cho 0
+    return math.log((total_docs / (1 + doc_freq) + 1e-9), 10)
+
+
+class IdfCache:
+    """
+    Cache IDF trong bộ nhớ của worker process:
+    - total_docs: N (số document trong corpus).
+    - doc_freqs: map term → df, nạp dần theo lô khi cần.
+    - version: CorpusVersion tương ứng với dữ liệu đang giữ.
+    Khi CorpusVersion thay đổi (index hoặc xoá document), cache được nạp lại.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.total_docs = 0
+        self.doc_freqs: dict[str, int] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def expire(self):
+        """
+        Buộc lần truy cập tiếp theo kiểm tra lại CorpusVersion.
+        """
+        self._checked_at = 0.0
+
+    def sync(self):
+        """
+        Làm mới cache nếu CorpusVersion đã thay đổi.
+        Chỉ kiểm tra tối đa một lần mỗi VERSION_CHECK_INTERVAL giây.
+        """
+        now = time.monotonic()
+        if self.version is not None and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        version = CorpusVersion.current()
+        with self._lock:
+            if version != self.version:
+                self.total_docs = Document.objects.count()
+                self.doc_freqs = {}
+                self.version = version
+            self._checked_at = now
+
+    def bulk_idf(self, terms) -> dict[str, float]:
+        """
+        IDF cho cả danh sách term, các df chưa có trong cache được lấy bằng một câu query.
+        IDF = log10( N / (1 + df(term) ) )
+        """
+        self.sync()
+        # Giữ tham chiếu cục bộ phòng khi thread khác nạp lại cache giữa chừng
+        doc_freqs, total_docs = self.doc_freqs, self.total_docs
+
+        terms = set(terms)
+        missing = [term_text for term_text in terms if term_text not in doc_freqs]
+        if missing:
+            found = dict(Term.objects.filter(text__in=missing).values_list('text', 'doc_freq'))
+            for term_text in missing:
+                doc_freqs[term_text] = found.get(term_text, 0)
+
+        return {term_text: idf_value(total_docs, doc_freqs[term_text]) for term_text in terms}
+
+    def idf(self, term_text: str) -> float:
+        return self.bulk_idf([term_text])[term_text]
+
+
+idf_cache = IdfCache()
@@ -0,0 +1,255 @@
+import io
+import random
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.pdfgen.canvas import Canvas
+
+from app_document import export
+from app_document.highlight import highlight_ranges, iter_highlight_html, locate_snippets, merge_highlights
+from app_document.models import Document
+from app_document.plagiarism import index_document
+from app_document.utils import extract_text_from_file
+
+
+# Bảng chữ cái dùng để sinh từ giả lập tiếng Việt cho benchmark
+VIETNAMESE_LETTERS = "abcdeghiklmnopqrstuvxyàáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễđìíịòóọôồốộơờớợùúụưừứựỳý"
+
+
+def generate_text(word_count: int, vocabulary_size: int, seed: int = 0) -> str:
+    """
+    Sinh văn bản giả lập gồm word_count từ, lấy ngẫu nhiên từ một từ điển vocabulary_size từ.
+    Cứ khoảng 15 từ thì ngắt câu để ViTokenizer xử lý giống văn bản thật.
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choice(VIETNAMESE_LETTERS) for _ in range(rng.randint(2, 7)))
+        for _ in range(vocabulary_size)
+    ]
+    words = []
+    for i in range(word_count):
+        words.append(rng.choice(vocabulary))
+        if i % 15 == 14:
+            words.append(".")
+    return " ".join(words)
+
+
+def generate_pdf(page_count: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """
+    Sinh file PDF nhiều trang (chữ không dấu vì font Helvetica mặc định).
+    """
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    _, height = A4
+    words = ["".join(rng.choice("abcdeghiklmnopqrstuvxy") for _ in range(rng.randint(2, 7))) for _ in range(2000)]
+    for _ in range(page_count):
+        y = height - 50
+        for _ in range(lines_per_page):
+            pdf.drawString(50, y, " ".join(rng.choice(words) for _ in range(12)))
+            y -= 16
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def legacy_highlight_html(text: str, snippets: list[str]) -> str:
+    """
+    Cách render cũ của PlagiarismCheckDetailAPIView: text.find từ đầu cho mỗi đoạn,
+    không gộp khoảng chồng lấn, ghép HTML bằng +=. Chỉ giữ lại để so sánh.
+    """
+    highlighted_ranges = []
+    for match in snippets:
+        start_idx = text.find(match)
+        if start_idx != -1:
+            highlighted_ranges.append({"start": start_idx, "end": start_idx + len(match)})
+    highlighted_ranges.sort(key=lambda x: x['start'])
+
+    last_idx = 0
+    html_content = ""
+    for hl in highlighted_ranges:
+        html_content += text[last_idx:hl['start']]
+        html_content += f'<span style="background-color: yellow;">{text[hl["start"]:hl["end"]]}</span>'
+        last_idx = hl['end']
+    html_content += text[last_idx:]
+    return html_content
+
+
+class Command(BaseCommand):
+    help = "Đo hiệu năng các thành phần kiểm tra đạo văn (index, pdf, export, ...)"
+
+    default_sizes = {
+        'index': '1000,5000,20000,50000',
+        'pdf': '100,300,600',
+        'highlight': '1024',
+        'export': '100,500,2000',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['index', 'pdf', 'highlight', 'export'], help="Thành phần cần đo")
+        parser.add_argument(
+            '--sizes',
+            help="Danh sách kích thước, phân tách bằng dấu phẩy "
+                 "(index: số từ, mặc định 1000,5000,20000,50000; pdf: số trang, mặc định 100,300,600; "
+                 "highlight: KB văn bản, mặc định 1024; export: KB văn bản, mặc định 100,500,2000)",
+        )
+        parser.add_argument('--repeat', type=int, default=3, help="Số lần chạy mỗi kích thước")
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'] or self.default_sizes[options['target']]
+        sizes = [int(size) for size in sizes.split(',') if size.strip()]
+        getattr(self, f"benchmark_{options['target']}")(sizes, options['repeat'])
+
+    def benchmark_index(self, sizes, repeat):
+        """
+        Đo thời gian index_document theo kích thước văn bản.
+        Mọi thay đổi được rollback nên không ảnh hưởng dữ liệu thật.
+        """
+        self.stdout.write(f"{'words':>8} {'distinct':>9} {'queries':>8} {'best (s)':>10} {'mean (s)':>10}")
+        for size in sizes:
+            text = generate_text(size, vocabulary_size=max(size // 4, 100), seed=size)
+            timings = []
+            query_count = 0
+            for _ in range(repeat):
+                with transaction.atomic():
+                    document = Document.objects.create(title=f"benchmark-{size}", content=text)
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        index_document(document)
+                        timings.append(time.perf_counter() - started)
+                    query_count = len(queries)
+                    distinct = document.postings.count()
+                    transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{size:>8} {distinct:>9} {query_count:>8} "
+                f"{min(timings):>10.3f} {sum(timings) / len(timings):>10.3f}"
+            )
+
+    def benchmark_pdf(self, sizes, repeat):
+        """
+        So sánh trích xuất PDF tuần tự (1 process) với chia trang cho PLAGIARISM_WORKERS process.
+        """
+        workers = getattr(settings, 'PLAGIARISM_WORKERS', 1)
+        self.stdout.write(f"workers={workers}")
+        self.stdout.write(f"{'pages':>8} {'size (KB)':>10} {'sequential (s)':>15} {'parallel (s)':>13} {'speedup':>8}")
+        for page_count in sizes:
+            data = generate_pdf(page_count, seed=page_count)
+            timings = {}
+            for mode, mode_workers in (('sequential', 1), ('parallel', workers)):
+                best = None
+                with override_settings(PLAGIARISM_WORKERS=mode_workers):
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        extract_text_from_file(SimpleUploadedFile('benchmark.pdf', data))
+                        elapsed = time.perf_counter() - started
+                        best = elapsed if best is None else min(best, elapsed)
+                timings[mode] = best
+
+            self.stdout.write(
+                f"{page_count:>8} {len(data) // 1024:>10} {timings['sequential']:>15.3f} "
+                f"{timings['parallel']:>13.3f} {timings['sequential'] / timings['parallel']:>8.2f}"
+            )
+
+    def benchmark_highlight(self, sizes, repeat):
+        """
+        So sánh render HTML highlight cũ (find từ đầu + cộng chuỗi) với highlight.py
+        trên văn bản size KB, cứ khoảng 2 KB có một đoạn trùng 200 ký tự.
+        """
+        self.stdout.write(f"{'KB':>8} {'spans':>7} {'legacy (s)':>11} {'shared (s)':>11} {'speedup':>8}")
+        for size in sizes:
+            text = generate_text(size * 1024 // 5, vocabulary_size=5000, seed=size)[:size * 1024]
+            rng = random.Random(size)
+            snippets = []
+            for start in range(0, len(text) - 200, 2048):
+                start += rng.randrange(0, 1800)
+                snippets.append(text[start:start + 200])
+
+            def legacy():
+                legacy_highlight_html(text, snippets)
+
+            def shared():
+                highlights = merge_highlights(locate_snippets(text, snippets, percent=50), len(text))
+                "".join(iter_highlight_html(text, highlights))
+                highlight_ranges(highlights)
+
+            timings = {}
+            for name, render in (('legacy', legacy), ('shared', shared)):
+                best = None
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    render()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[name] = best
+
+            self.stdout.write(
+                f"{size:>8} {len(snippets):>7} {timings['legacy']:>11.4f} "
+                f"{timings['shared']:>11.4f} {timings['legacy'] / timings['shared']:>8.2f}"
+            )
+
+    def benchmark_export(self, sizes, repeat):
+        """
+        So sánh xuất PDF khi dựng trước mọi Paragraph và giữ trang chưa nén đến cuối (list)
+        với dựng dần trong lúc vẽ (LazyFlowables) và nén từng trang ngay (CompressingCanvas)
+        trên văn bản size KB: thời gian, bộ nhớ cao nhất khi dàn trang (trước canvas.save)
+        và cả lần xuất (gồm lúc reportlab ghép file PDF trong bộ nhớ khi lưu), đo bằng tracemalloc.
+        PDF được ghi ra file tạm như write_document_pdf; Document không được lưu vào database.
+        """
+        self.stdout.write(
+            f"{'KB':>8} {'PDF (KB)':>9} "
+            f"{'list (s)':>9} {'layout (MB)':>12} {'total (MB)':>11} "
+            f"{'lazy (s)':>9} {'layout (MB)':>12} {'total (MB)':>11}"
+        )
+        # Đăng ký font, cache của reportlab... không tính vào lần đo đầu tiên
+        export.build_document_pdf(Document(id=0, title="warmup", content="warmup"), None, io.BytesIO())
+        for size in sizes:
+            paragraphs = []
+            length = 0
+            while length < size * 1024:
+                paragraphs.append(generate_text(80, vocabulary_size=5000, seed=len(paragraphs)))
+                length += len(paragraphs[-1]) + 1
+            document = Document(id=0, title=f"benchmark-{size}", content="\n".join(paragraphs))
+
+            results = {}
+            modes = (
+                ('list', list, Canvas),
+                ('lazy', export.LazyFlowables, export.CompressingCanvas),
+            )
+            for name, flowables, canvas_class in modes:
+                layout_peaks = []
+
+                class MeasuredCanvas(canvas_class):
+                    def save(self):
+                        layout_peaks.append(tracemalloc.get_traced_memory()[1])
+                        super().save()
+
+                best, peak = None, 0
+                with mock.patch.object(export, 'LazyFlowables', flowables), \
+                        mock.patch.object(export, 'CompressingCanvas', MeasuredCanvas):
+                    for _ in range(repeat):
+                        tracemalloc.start()
+                        started = time.perf_counter()
+                        with tempfile.TemporaryFile() as output:
+                            export.build_document_pdf(document, None, output)
+                            pdf_size = output.tell()
+                        elapsed = time.perf_counter() - started
+                        peak = max(peak, tracemalloc.get_traced_memory()[1])
+                        tracemalloc.stop()
+                        best = elapsed if best is None else min(best, elapsed)
+                results[name] = (best, max(layout_peaks) / 2 ** 20, peak / 2 ** 20)
+
+            self.stdout.write(
+                f"{size:>8} {pdf_size // 1024:>9} "
+                f"{results['list'][0]:>9.3f} {results['list'][1]:>12.1f} {results['list'][2]:>11.1f} "
+                f"{results['lazy'][0]:>9.3f} {results['lazy'][1]:>12.1f} {results['lazy'][2]:>11.1f}"
+            )
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_document.segments import segment_index
+
+
+class Command(BaseCommand):
+    help = "Gộp các segment của inverted index trên đĩa (PLAGIARISM_INDEX_BACKEND = 'segments')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Ghi lại toàn bộ segment từ bảng Term/Posting")
+        parser.add_argument('--all', action='store_true', help="Gộp mọi segment thành một")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild'] or not segment_index.exists():
+            segment_index.rebuild()
+            action = "Rebuilt index segments"
+        else:
+            merged = segment_index.merge(full=options['all'])
+            action = f"Merged {merged} segment(s)"
+
+        manifest = segment_index.read_manifest()
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} in {time.perf_counter() - started:.2f}s "
+            f"({len(manifest['segments'])} segment(s) in {segment_index.directory})"
+        ))
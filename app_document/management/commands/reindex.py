@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from app_document.reindex import BATCH_SIZE, Reindexer
+
+
+class Command(BaseCommand):
+    help = (
+        "Dựng lại toàn bộ Term/Posting/Fingerprint từ Document.content "
+        "(vd. sau khi đổi VIETNAMESE_STOPWORDS hoặc tokenizer). Bị dừng giữa chừng thì chạy lại "
+        "để tiếp tục từ checkpoint. Nên chạy lúc ít người dùng: sửa content trong lúc reindex "
+        "sẽ không được phản ánh (document mới tạo thì được index sau khi đổi bảng)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Số process tách từ (mặc định PLAGIARISM_WORKERS)")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Số document mỗi lô")
+        parser.add_argument('--restart', action='store_true', help="Bỏ checkpoint cũ và làm lại từ đầu")
+        parser.add_argument('--discard', action='store_true', help="Chỉ xoá bảng tạm/checkpoint của lần chạy dở")
+
+    def handle(self, *args, **options):
+        reindexer = Reindexer(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        if options['discard']:
+            reindexer.discard()
+            self.stdout.write(self.style.SUCCESS("Discarded reindex checkpoint"))
+            return
+
+        total, elapsed = reindexer.run(restart=options['restart'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reindexed {total} documents in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f} docs/s)"
+        ))
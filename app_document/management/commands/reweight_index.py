@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_document.plagiarism import reweight_index
+
+
+class Command(BaseCommand):
+    help = "Tính lại Posting.weight và Document.vector_norm theo IDF hiện tại (chạy định kỳ, vd. cron)"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        reweight_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Reweighted inverted index in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,45 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from app_document.pipeline import claim_next_job, requeue_stale_jobs, run_job
+from app_document.segments import segment_index, segments_enabled
+
+
+class Command(BaseCommand):
+    help = "Worker xử lý hàng đợi CheckJob (có thể chạy nhiều process song song)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Số giây chờ khi hàng đợi rỗng")
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=1800,
+            help="Job running không báo tiến độ quá số giây này (worker chết giữa chừng) "
+                 "được đưa lại hàng đợi",
+        )
+        parser.add_argument('--once', action='store_true', help="Xử lý hết hàng đợi hiện tại rồi thoát")
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(timedelta(seconds=options['stale_after']))
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                # Hàng đợi rỗng: tranh thủ gộp các segment nhỏ
+                if segments_enabled() and segment_index.exists() and segment_index.merge():
+                    self.stdout.write("Merged small index segments")
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.perf_counter()
+            run_job(job)
+            job.refresh_from_db(fields=['status'])
+            self.stdout.write(
+                f"Job {job.id} ({job.file_name}): {job.status} in {time.perf_counter() - started:.2f}s"
+            )
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:06
+
+from django.db import migrations, models
+
+
+def create_corpus_version(apps, schema_editor):
+    CorpusVersion = apps.get_model('app_document', 'CorpusVersion')
+    CorpusVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0007_document_doc_length_alter_document_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorpusVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_corpus_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:07
+
+from django.db import migrations, models
+
+
+# Backfill trọng số và norm cho các document đã index trước đó
+BACKFILL_WEIGHTS_SQL = """
+UPDATE app_document_posting AS p
+SET weight = (p.term_freq::double precision / d.doc_length)
+    * LN(c.total_docs / (1 + t.doc_freq) + 1e-9) / LN(10)
+FROM app_document_document AS d,
+     app_document_term AS t,
+     (SELECT COUNT(*)::double precision AS total_docs FROM app_document_document) AS c
+WHERE p.document_id = d.id
+  AND p.term_id = t.text
+  AND d.doc_length > 0;
+
+UPDATE app_document_document AS d
+SET vector_norm = COALESCE(s.norm, 0)
+FROM (
+    SELECT document_id, SQRT(SUM(weight * weight)) AS norm
+    FROM app_document_posting
+    GROUP BY document_id
+) AS s
+WHERE d.id = s.document_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0008_corpusversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='vector_norm',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='weight',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL_WEIGHTS_SQL, migrations.RunSQL.noop),
+    ]
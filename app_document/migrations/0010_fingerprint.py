@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0009_document_vector_norm_posting_weight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.BigIntegerField()),
+                ('position', models.IntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprints', to='app_document.document')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hash', 'document'], name='fingerprint_hash_doc_idx')],
+            },
+        ),
+    ]
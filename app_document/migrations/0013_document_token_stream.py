@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0012_document_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='token_stream',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
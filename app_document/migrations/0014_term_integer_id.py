@@ -0,0 +1,88 @@
+from django.db import migrations, models
+
+
+# Term chuyển khoá chính từ text sang id số nguyên; Posting.term_id chuyển từ varchar
+# sang integer. Đổi trực tiếp bằng SQL để chuyển được dữ liệu Term/Posting đang có
+# (ghép theo text), state của Django chỉ cần thêm field id.
+FORWARD_SQL = [
+    "ALTER TABLE app_document_term ADD COLUMN id integer GENERATED BY DEFAULT AS IDENTITY",
+    "ALTER TABLE app_document_posting ADD COLUMN term_int integer",
+    """
+    UPDATE app_document_posting AS p
+    SET term_int = t.id
+    FROM app_document_term AS t
+    WHERE p.term_id = t.text
+    """,
+    # Xoá cột cũ kéo theo FK, unique (term_id, document_id) và các index trên cột đó
+    "ALTER TABLE app_document_posting DROP COLUMN term_id",
+    "ALTER TABLE app_document_posting RENAME COLUMN term_int TO term_id",
+    "ALTER TABLE app_document_posting ALTER COLUMN term_id SET NOT NULL",
+    "ALTER TABLE app_document_term DROP CONSTRAINT app_document_term_pkey",
+    "ALTER TABLE app_document_term ADD CONSTRAINT app_document_term_pkey PRIMARY KEY (id)",
+    "ALTER TABLE app_document_term ADD CONSTRAINT app_document_term_text_key UNIQUE (text)",
+    """
+    ALTER TABLE app_document_posting
+    ADD CONSTRAINT app_document_posting_term_id_document_id_uniq UNIQUE (term_id, document_id)
+    """,
+    """
+    ALTER TABLE app_document_posting
+    ADD CONSTRAINT app_document_posting_term_id_fk_app_document_term_id
+    FOREIGN KEY (term_id) REFERENCES app_document_term (id) DEFERRABLE INITIALLY DEFERRED
+    """,
+    "CREATE INDEX app_document_posting_term_id_idx ON app_document_posting (term_id)",
+]
+
+REVERSE_SQL = [
+    "ALTER TABLE app_document_posting ADD COLUMN term_text varchar(100)",
+    """
+    UPDATE app_document_posting AS p
+    SET term_text = t.text
+    FROM app_document_term AS t
+    WHERE p.term_id = t.id
+    """,
+    "ALTER TABLE app_document_posting DROP COLUMN term_id",
+    "ALTER TABLE app_document_posting RENAME COLUMN term_text TO term_id",
+    "ALTER TABLE app_document_posting ALTER COLUMN term_id SET NOT NULL",
+    "ALTER TABLE app_document_term DROP CONSTRAINT app_document_term_pkey",
+    "ALTER TABLE app_document_term DROP CONSTRAINT app_document_term_text_key",
+    "ALTER TABLE app_document_term DROP COLUMN id",
+    "ALTER TABLE app_document_term ADD CONSTRAINT app_document_term_pkey PRIMARY KEY (text)",
+    """
+    ALTER TABLE app_document_posting
+    ADD CONSTRAINT app_document_posting_term_id_document_id_uniq UNIQUE (term_id, document_id)
+    """,
+    """
+    ALTER TABLE app_document_posting
+    ADD CONSTRAINT app_document_posting_term_id_fk_app_document_term_text
+    FOREIGN KEY (term_id) REFERENCES app_document_term (text) DEFERRABLE INITIALLY DEFERRED
+    """,
+    "CREATE INDEX app_document_posting_term_id_idx ON app_document_posting (term_id)",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0013_document_token_stream'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(FORWARD_SQL, reverse_sql=REVERSE_SQL),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='term',
+                    name='id',
+                    field=models.AutoField(default=None, primary_key=True, serialize=False),
+                    preserve_default=False,
+                ),
+                migrations.AlterField(
+                    model_name='term',
+                    name='text',
+                    field=models.CharField(max_length=100, unique=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Điền các cột mới cho dữ liệu đang có: max_matched_percent lấy từ JSON duplicate_sources,
+# con trỏ latest_check lấy lần kiểm tra mới nhất của từng document.
+BACKFILL_SQL = [
+    """
+    UPDATE app_document_plagiarismcheck AS c
+    SET max_matched_percent = COALESCE((
+        SELECT MAX((src ->> 'matched_percent')::double precision)
+        FROM jsonb_array_elements(c.duplicate_sources) AS src
+    ), 0)
+    WHERE jsonb_typeof(c.duplicate_sources) = 'array'
+    """,
+    """
+    UPDATE app_document_document AS d
+    SET latest_check_id = c.id, latest_plagiarism_percentage = c.plagiarism_percentage
+    FROM (
+        SELECT DISTINCT ON (document_id) id, document_id, plagiarism_percentage
+        FROM app_document_plagiarismcheck
+        ORDER BY document_id, checked_at DESC, id DESC
+    ) AS c
+    WHERE d.id = c.document_id
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0014_term_integer_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='latest_check',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app_document.plagiarismcheck'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='latest_plagiarism_percentage',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='plagiarismcheck',
+            name='max_matched_percent',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,115 @@
+import sys
+from array import array
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+# Cùng định dạng với highlight.pack_spans / unpack_spans (viết lại ở đây để migration
+# không phụ thuộc code có thể thay đổi sau này)
+def _pack(spans):
+    packed = array('I')
+    for start, end, source in sorted(spans):
+        packed.extend((start, end, source or 0))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data):
+    packed = array('I')
+    packed.frombytes(bytes(data or b''))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return [(packed[i], packed[i + 1], packed[i + 2]) for i in range(0, len(packed) - 2, 3)]
+
+
+def _locate(text, snippets, source):
+    """
+    Vị trí các đoạn trùng trong text, tìm tiếp từ cuối đoạn trước,
+    không thấy thì tìm lại từ đầu text.
+    """
+    spans = []
+    last_idx = 0
+    for snippet in snippets or []:
+        if not snippet:
+            continue
+        start = text.find(snippet, last_idx)
+        if start == -1:
+            start = text.find(snippet)
+        if start != -1:
+            last_idx = start + len(snippet)
+            spans.append((start, last_idx, source))
+    return spans
+
+
+def snippets_to_spans(apps, schema_editor):
+    """
+    Đổi đoạn trùng lưu dạng chuỗi thành offset. Ưu tiên highlights của từng nguồn trong
+    duplicate_sources (biết được source_id), không có thì dùng PlagiarismCheck.highlights.
+    """
+    PlagiarismCheck = apps.get_model('app_document', 'PlagiarismCheck')
+    checks = PlagiarismCheck.objects.select_related('document').order_by('id')
+    batch = []
+    for check in checks.iterator(chunk_size=BATCH_SIZE):
+        text = check.document.content or ""
+        spans = []
+        for src in check.duplicate_sources or []:
+            spans.extend(_locate(text, src.pop('highlights', None), src.get('source_id')))
+        if not spans:
+            spans = _locate(text, check.highlights, None)
+        check.highlight_spans = _pack(spans)
+        batch.append(check)
+        if len(batch) >= BATCH_SIZE:
+            PlagiarismCheck.objects.bulk_update(batch, ['highlight_spans', 'duplicate_sources'])
+            batch = []
+    if batch:
+        PlagiarismCheck.objects.bulk_update(batch, ['highlight_spans', 'duplicate_sources'])
+
+
+def spans_to_snippets(apps, schema_editor):
+    PlagiarismCheck = apps.get_model('app_document', 'PlagiarismCheck')
+    checks = PlagiarismCheck.objects.select_related('document').order_by('id')
+    batch = []
+    for check in checks.iterator(chunk_size=BATCH_SIZE):
+        text = check.document.content or ""
+        spans = _unpack(check.highlight_spans)
+        merged = []
+        for start, end, _ in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        check.highlights = [text[start:end] for start, end in merged]
+        for src in check.duplicate_sources or []:
+            src['highlights'] = [
+                text[start:end] for start, end, source in spans if source == src.get('source_id')
+            ]
+        batch.append(check)
+        if len(batch) >= BATCH_SIZE:
+            PlagiarismCheck.objects.bulk_update(batch, ['highlights', 'duplicate_sources'])
+            batch = []
+    if batch:
+        PlagiarismCheck.objects.bulk_update(batch, ['highlights', 'duplicate_sources'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0015_document_latest_check'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plagiarismcheck',
+            name='highlight_spans',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(snippets_to_spans, spans_to_snippets),
+        migrations.RemoveField(
+            model_name='plagiarismcheck',
+            name='highlights',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0016_plagiarismcheck_highlight_spans'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='corpusversion',
+            name='term_generation',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
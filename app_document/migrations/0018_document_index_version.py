@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0017_corpusversion_term_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='index_version',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def hash_checked_text(apps, schema_editor):
+    """
+    Check đã có: coi như content hiện tại là content lúc kiểm tra (không còn cách nào biết hơn).
+    """
+    PlagiarismCheck = apps.get_model('app_document', 'PlagiarismCheck')
+    checks = PlagiarismCheck.objects.select_related('document').only('id', 'document__content').order_by('id')
+    batch = []
+    for check in checks.iterator(chunk_size=BATCH_SIZE):
+        check.text_hash = hashlib.sha256((check.document.content or "").encode('utf-8')).hexdigest()
+        batch.append(check)
+        if len(batch) >= BATCH_SIZE:
+            PlagiarismCheck.objects.bulk_update(batch, ['text_hash'])
+            batch = []
+    if batch:
+        PlagiarismCheck.objects.bulk_update(batch, ['text_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0018_document_index_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plagiarismcheck',
+            name='text_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_checked_text, migrations.RunPython.noop),
+    ]
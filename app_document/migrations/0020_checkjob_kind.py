@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0019_plagiarismcheck_text_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkjob',
+            name='kind',
+            field=models.CharField(choices=[('check', 'Check'), ('export', 'Export PDF')], default='check', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:43
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def heartbeat_from_start(apps, schema_editor):
+    """
+    Job đang chạy: coi lần báo tiến độ cuối là lúc bắt đầu (như cách tính job cũ trước đây).
+    """
+    CheckJob = apps.get_model('app_document', 'CheckJob')
+    CheckJob.objects.filter(started_at__isnull=False).update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_document', '0020_checkjob_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(heartbeat_from_start, migrations.RunPython.noop),
+    ]
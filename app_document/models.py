@@ -1,9 +1,10 @@
 from django.db import models
-from django.db.models import JSONField
-from django.contrib.postgres.fields import ArrayField
+from django.db.models import F, JSONField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from app_auth.models import User
 from django.utils.translation import gettext_lazy as _
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
 
@@ -73,7 +74,22 @@ class Document(models.Model):
     original_filename = models.CharField(max_length=255, blank=True, null=True)
     file_extension = models.CharField(max_length=20, blank=True, null=True)
     content = models.TextField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # SHA-256 của file
+    token_stream = models.BinaryField(blank=True, null=True, editable=False)  # Token đã tách từ (xem tokens.py)
     doc_length = models.IntegerField(default=0)
+    vector_norm = models.FloatField(default=0)  # Độ dài vector TF–IDF, tính lúc index
+    # CorpusVersion.version tại lần index gần nhất làm thay đổi Posting của document (xem engine.refresh)
+    index_version = models.BigIntegerField(default=0, db_index=True, editable=False)
+    # Lần kiểm tra mới nhất, cập nhật mỗi khi PlagiarismCheck được lưu/xoá (xem refresh_latest_check)
+    latest_check = models.ForeignKey(
+        'PlagiarismCheck',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+',
+        editable=False
+    )
+    latest_plagiarism_percentage = models.FloatField(default=0, db_index=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -100,10 +116,12 @@ class Document(models.Model):
 class Term(models.Model):
     """
     A unique term (word) in the corpus.
+    - id: integer term id (4 bytes), referenced by Posting
     - text: the term string (lowercase)
     - doc_freq: number of documents containing this term
     """
-    text = models.CharField(max_length=100, primary_key=True)
+    id = models.AutoField(primary_key=True)
+    text = models.CharField(max_length=100, unique=True)
     doc_freq = models.IntegerField(default=0)
 
     def __str__(self):
@@ -116,6 +134,7 @@ class Posting(models.Model):
     - term: foreign key to Term
     - document: foreign key to Document
     - term_freq: frequency of this term in the document
+    - weight: TF-IDF weight computed at index time (refreshed by reweight_index)
     """
     term = models.ForeignKey(
         Term,
@@ -128,6 +147,7 @@ class Posting(models.Model):
         related_name='postings'
     )
     term_freq = models.IntegerField()
+    weight = models.FloatField(default=0)
 
     class Meta:
         unique_together = ('term', 'document')
@@ -136,6 +156,74 @@ class Posting(models.Model):
         return f"({self.term.text}, Doc {self.document.id}) → tf={self.term_freq}"
 
 
+class Fingerprint(models.Model):
+    """
+    A winnowed k-gram fingerprint of a document (see fingerprint.py).
+    - hash: 64-bit hash of k consecutive tokens from preprocess()
+    - document: foreign key to Document
+    - position: index of the first token of the k-gram in the token stream
+    """
+    hash = models.BigIntegerField()
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='fingerprints'
+    )
+    position = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['hash', 'document'], name='fingerprint_hash_doc_idx'),
+        ]
+
+    def __str__(self):
+        return f"({self.hash}, Doc {self.document_id} @ {self.position})"
+
+
+class CorpusVersion(models.Model):
+    """
+    Version number of the inverted index (a single row, pk=1).
+    Bumped whenever a document is indexed or deleted so that every worker
+    process knows its in-memory IDF cache / TF-IDF engine is stale.
+    term_generation is bumped only when the Term table is replaced (manage.py reindex),
+    telling every process to drop its text → id map (terms.TermDictionary).
+    """
+    version = models.BigIntegerField(default=0)
+    term_generation = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    SINGLETON_ID = 1
+
+    @classmethod
+    def current(cls) -> int:
+        version = cls.objects.filter(pk=cls.SINGLETON_ID).values_list('version', flat=True).first()
+        return version or 0
+
+    @classmethod
+    def current_term_generation(cls) -> int:
+        generation = cls.objects.filter(pk=cls.SINGLETON_ID).values_list('term_generation', flat=True).first()
+        return generation or 0
+
+    @classmethod
+    def bump(cls, terms: bool = False) -> int:
+        """
+        Tăng version (và term_generation nếu terms), trả về version mới.
+        """
+        changes = {'version': F('version') + 1, 'updated_at': timezone.now()}
+        if terms:
+            changes['term_generation'] = F('term_generation') + 1
+        updated = cls.objects.filter(pk=cls.SINGLETON_ID).update(**changes)
+        if not updated:
+            cls.objects.get_or_create(
+                pk=cls.SINGLETON_ID,
+                defaults={'version': 1, 'term_generation': 1 if terms else 0}
+            )
+        return cls.current()
+
+    def __str__(self):
+        return f"Corpus v{self.version}"
+
+
 class PlagiarismCheck(models.Model):
     document = models.ForeignKey(
         Document,
@@ -147,15 +235,142 @@ class PlagiarismCheck(models.Model):
     plagiarism_percentage = models.FloatField()
 
     duplicate_sources = JSONField(blank=True, null=True)
+    # matched_percent lớn nhất trong duplicate_sources, tính lại mỗi lần save()
+    max_matched_percent = models.FloatField(default=0, db_index=True, editable=False)
 
-    highlights = ArrayField(
-        models.TextField(),
-        blank=True,
-        null=True,
-        help_text="List of matched text snippets"
-    )
+    # Vị trí các đoạn trùng (start, end, source) trong document.content, xem highlight.pack_spans
+    highlight_spans = models.BinaryField(blank=True, null=True, editable=False)
+    # SHA-256 của document.content lúc kiểm tra: content bị sửa sau đó thì offset không còn đúng
+    text_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
 
     report_file = models.FileField(upload_to='reports/', null=True, blank=True)
 
     def __str__(self):
         return f"{self.document.title} - {self.plagiarism_percentage}%"
+
+    def save(self, *args, **kwargs):
+        self.max_matched_percent = max(
+            (src.get('matched_percent') or 0 for src in self.duplicate_sources or []),
+            default=0
+        )
+        super().save(*args, **kwargs)
+
+
+class CheckJob(models.Model):
+    """
+    A plagiarism check (or a PDF export of a large document) queued for the background
+    worker (manage.py run_check_worker). Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED,
+    so the queue lives in Postgres and no external broker is needed.
+    """
+    KIND_CHECK = 'check'
+    KIND_EXPORT = 'export'
+    KIND_CHOICES = [
+        (KIND_CHECK, 'Check'),
+        (KIND_EXPORT, 'Export PDF'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    STAGE_EXTRACT = 'extract'
+    STAGE_INDEX = 'index'
+    STAGE_SEARCH = 'search'
+    STAGE_ALIGN = 'align'
+    STAGES = [STAGE_EXTRACT, STAGE_INDEX, STAGE_SEARCH, STAGE_ALIGN]
+    STAGE_CHOICES = [(stage, stage.capitalize()) for stage in STAGES]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='jobs'
+    )
+    file_name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_CHECK)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES, blank=True, null=True)
+    progress = models.PositiveSmallIntegerField(default=0)  # 0 → 100
+    result = JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Lần cuối worker báo còn sống (lúc nhận job và mỗi khi sang bước mới)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='checkjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.file_name}) - {self.status}"
+
+
+@receiver(pre_delete, sender=Document)
+def release_document_terms(sender, instance, **kwargs):
+    """
+    Trước khi Posting của document bị xoá theo cascade: giảm doc_freq của mọi term
+    trong document bằng một câu UPDATE (chạy trong transaction của lệnh xoá).
+    """
+    Term.objects.filter(postings__document=instance).update(doc_freq=F('doc_freq') - 1)
+
+
+@receiver(post_delete, sender=Document)
+def bump_corpus_version_on_document_delete(sender, instance, **kwargs):
+    """
+    Xoá Document làm thay đổi N và DF, các worker phải làm mới cache IDF.
+    """
+    CorpusVersion.bump()
+
+
+def refresh_latest_check(document_id):
+    """
+    Trỏ Document.latest_check / latest_plagiarism_percentage về lần kiểm tra mới nhất
+    (một câu UPDATE với subquery, không đọc dữ liệu lên Python).
+    """
+    latest_check = PlagiarismCheck.objects.filter(document=OuterRef('pk')).order_by('-checked_at', '-id')
+    Document.objects.filter(pk=document_id).update(
+        latest_check=Subquery(latest_check.values('id')[:1]),
+        latest_plagiarism_percentage=Coalesce(
+            Subquery(latest_check.values('plagiarism_percentage')[:1]), Value(0.0)
+        ),
+    )
+
+
+@receiver(post_save, sender=PlagiarismCheck)
+def update_latest_check_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Lần kiểm tra vừa tạo là lần mới nhất của document: ghi thẳng, không cần subquery.
+    Sửa một lần kiểm tra cũ thì tính lại con trỏ.
+    """
+    if raw:
+        return
+    if created:
+        Document.objects.filter(pk=instance.document_id).update(
+            latest_check=instance,
+            latest_plagiarism_percentage=instance.plagiarism_percentage,
+        )
+    else:
+        refresh_latest_check(instance.document_id)
+
+
+@receiver(post_delete, sender=PlagiarismCheck)
+def update_latest_check_on_delete(sender, instance, origin=None, **kwargs):
+    # Xoá theo cascade từ chính Document thì không còn gì để cập nhật
+    if isinstance(origin, Document) or getattr(origin, 'model', None) is Document:
+        return
+    refresh_latest_check(instance.document_id)
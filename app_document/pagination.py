@@ -0,0 +1,119 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class DocumentCursorPagination(CursorPagination):
+    """
+    Phân trang theo cursor (keyset: WHERE (uploaded_at, id) < (..., ...) LIMIT n) thay vì OFFSET,
+    chi phí mỗi trang không tăng theo số trang đã lướt qua.
+    Cursor lưu giá trị của mọi field sắp xếp (luôn kết thúc bằng id) nên mỗi vị trí là duy nhất:
+    sắp theo cột có nhiều giá trị trùng (vd. latest_plagiarism_percentage = 0) vẫn không lặp
+    hay bỏ sót dòng, không phụ thuộc offset_cutoff của CursorPagination.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-uploaded_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Thêm id vào cuối thứ tự sắp xếp để thứ tự giữa các dòng trùng giá trị cố định.
+        """
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(None if value is None else str(value))
+        return json.dumps(values)
+
+    @staticmethod
+    def _after(name: str, value, descending: bool) -> Q:
+        """
+        Điều kiện field đứng sau value. PostgreSQL xếp NULL cuối khi tăng dần, đầu khi giảm dần
+        (vd. publication_year để trống).
+        """
+        if value is None:
+            return Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+        if descending:
+            return Q(**{f'{name}__lt': value})
+        return Q(**{f'{name}__gt': value}) | Q(**{f'{name}__isnull': True})
+
+    def _keyset_filter(self, position: str, reverse: bool) -> Q:
+        """
+        Điều kiện "đứng sau position" theo toàn bộ ordering:
+        (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ... (< với field giảm dần, đảo lại khi reverse).
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition, equal = Q(), Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            condition |= equal & self._after(name, value, field.startswith('-') != reverse)
+            equal &= Q(**{f'{name}__isnull': True} if value is None else {name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Như CursorPagination.paginate_queryset, chỉ khác điều kiện lọc theo cursor (_keyset_filter).
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*[
+                field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self._keyset_filter(current_position, reverse))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
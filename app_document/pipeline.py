@@ -0,0 +1,372 @@
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .alignment import coverage, get_matching_blocks
+from .dedup import cache_extraction, cache_latest_check, cached_extraction, file_sha256, find_latest_check
+from .executors import InlineExecutor, completed_future, get_executor
+from .export import run_export_job
+from .highlight import (
+    check_highlights,
+    check_is_stale,
+    highlight_ranges,
+    iter_highlight_html,
+    merge_highlights,
+    pack_spans,
+    text_hash,
+)
+from .models import CheckJob, Document, PlagiarismCheck
+from .plagiarism import index_document, preprocess_stream, search_copied_sources
+from .utils import PDF_PARALLEL_MIN_PAGES, iter_extract_text, iter_pdf_pages, pdf_page_count, submit_pdf_pages
+
+
+# Số nguồn lấy từ search_copied_sources để đối chiếu và độ dài tối thiểu của một đoạn trùng (ký tự)
+TOP_SOURCES = 5
+MIN_MATCH_CHARS = 10
+
+
+def _no_progress(stage: str):
+    pass
+
+
+def result_from_check(check: PlagiarismCheck) -> dict:
+    """
+    Kết quả dạng dict cho API từ một PlagiarismCheck đã có,
+    dùng khi file upload trùng nội dung với một file đã kiểm tra (cached=True).
+    """
+    text = check.document.content or ""
+    highlights = check_highlights(check)
+    return {
+        "document_id": check.document_id,
+        "plagiarism_check_id": check.id,
+        "plagiarism_percentage": check.plagiarism_percentage,
+        "html_content": "".join(iter_highlight_html(text, highlights)),
+        "highlights": highlight_ranges(highlights),
+        "cached": True
+    }
+
+
+def find_sources(document: Document, text: str, tokens: list[str] = None, report_progress=_no_progress):
+    """
+    Index document rồi tìm TOP_SOURCES document giống nhất trong corpus
+    có chung fingerprint với document (xem search_copied_sources).
+    """
+    report_progress(CheckJob.STAGE_INDEX)
+    index_document(document, tokens=tokens)
+
+    # Search corpus
+    report_progress(CheckJob.STAGE_SEARCH)
+    return search_copied_sources(text, top_n=TOP_SOURCES, exclude_doc_id=document.id, tokens=tokens)
+
+
+def submit_alignments(executor, text: str, matches: list) -> list[Future]:
+    """
+    Gửi việc căn chỉnh text với từng nguồn vào executor để chạy song song.
+    """
+    return [
+        executor.submit(get_matching_blocks, text, matched_doc.content or "", MIN_MATCH_CHARS)
+        for matched_doc, _ in matches
+    ]
+
+
+def save_check(document: Document, text: str, matches: list, source_blocks: list) -> dict:
+    """
+    Gộp các đoạn trùng của mọi nguồn, tạo PlagiarismCheck và trả về kết quả dạng dict cho API.
+    - source_blocks[k]: các khối (i, j, size) giữa text và nguồn matches[k].
+    - plagiarism_percentage: tỉ lệ ký tự của text nằm trong ít nhất một đoạn trùng.
+    - matched_percent của từng nguồn: tỉ lệ text trùng với riêng nguồn đó;
+      similarity: cosine TF–IDF của nguồn đó.
+    """
+    text_length = len(text) or 1
+    duplicate_sources = []
+    all_highlights = []
+    for (matched_doc, score), blocks in zip(matches, source_blocks):
+        spans = [(i, i + size) for i, _, size in blocks]
+        matched_percent = round(coverage(spans) * 100 / text_length, 2)
+        all_highlights.extend((start, end, matched_doc.id, matched_percent) for start, end in spans)
+        duplicate_sources.append({
+            "source_id": matched_doc.id,
+            "source_title": matched_doc.title,
+            "matched_percent": matched_percent,
+            "similarity": round(score * 100, 2)
+        })
+
+    # Mỗi khoảng gộp mang màu của nguồn có matched_percent cao nhất phủ lên nó
+    highlights = merge_highlights(all_highlights, len(text))
+    plagiarism_percentage = round(coverage((start, end) for start, end, _, _ in highlights) * 100 / text_length, 2)
+    plagiarism_check = PlagiarismCheck.objects.create(
+        document=document,
+        plagiarism_percentage=plagiarism_percentage,
+        duplicate_sources=duplicate_sources,
+        highlight_spans=pack_spans(all_highlights),
+        text_hash=text_hash(text),
+    )
+
+    return {
+        "document_id": document.id,
+        "plagiarism_check_id": plagiarism_check.id,
+        "plagiarism_percentage": plagiarism_check.plagiarism_percentage,
+        "html_content": "".join(iter_highlight_html(text, highlights)),
+        "highlights": highlight_ranges(highlights)
+    }
+
+
+def check_document(document: Document, text: str, tokens: list[str] = None, report_progress=_no_progress) -> dict:
+    """
+    Chạy các bước index → search → align cho một Document đã lưu,
+    tạo PlagiarismCheck và trả về kết quả dạng dict cho API.
+    Việc căn chỉnh với các nguồn chạy song song trong process pool.
+    report_progress(stage) được gọi khi bắt đầu mỗi bước.
+    """
+    matches = find_sources(document, text, tokens=tokens, report_progress=report_progress)
+
+    report_progress(CheckJob.STAGE_ALIGN)
+    with get_executor(len(matches)) as executor:
+        source_blocks = [future.result() for future in submit_alignments(executor, text, matches)]
+    return save_check(document, text, matches, source_blocks)
+
+
+def _prepare_upload(name: str, path: str = None, data: bytes = None) -> tuple[str, list[str]]:
+    """
+    Chạy trong process con: trích xuất text và tách từ cho một file upload.
+    """
+    file = File(open(path, 'rb'), name=name) if path else ContentFile(data, name=name)
+    with file:
+        return preprocess_stream(iter_extract_text(file))
+
+
+def _upload_payload(uploaded_file) -> tuple[str, str | None, bytes | None]:
+    """
+    File lớn đã được Django ghi ra đĩa thì chỉ gửi đường dẫn sang process con,
+    file nhỏ trong bộ nhớ thì gửi bytes.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return uploaded_file.name, uploaded_file.temporary_file_path(), None
+    data = uploaded_file.read()
+    uploaded_file.seek(0)
+    return uploaded_file.name, None, data
+
+
+def _submit_prepare(executor, uploaded_file):
+    """
+    Gửi việc extract + preprocess của một file upload vào executor, trả về (future, pdf_pages).
+    PDF nhiều trang không giao cả file cho một process con (trong đó không tạo pool lồng nhau được)
+    mà chia theo lô trang ngay từ process chính (pdf_pages, future là None); text được ghép
+    và tách từ ở process chính khi lấy kết quả (_prepared_result).
+    """
+    name, path, data = _upload_payload(uploaded_file)
+    if not isinstance(executor, InlineExecutor):
+        page_count = pdf_page_count(name, path, data)
+        if page_count >= PDF_PARALLEL_MIN_PAGES:
+            return None, submit_pdf_pages(executor, path or data, page_count)
+    return executor.submit(_prepare_upload, name, path, data), None
+
+
+def _prepared_result(future, pdf_pages) -> tuple[str, list[str]]:
+    if pdf_pages is not None:
+        return preprocess_stream(iter_pdf_pages(pdf_pages))
+    return future.result()
+
+
+def check_uploaded_files(uploaded_files, user=None, max_workers: int = None) -> list[dict]:
+    """
+    Kiểm tra nhiều file cùng lúc:
+    - extract + preprocess và alignment với từng nguồn chạy song song trong process pool,
+      PDF nhiều trang được chia lô trang cho cả pool,
+    - mọi thao tác ghi database (Document, index, PlagiarismCheck) chạy ở process chính.
+    - file trùng nội dung (SHA-256) với file đã kiểm tra thì trả lại kết quả cũ,
+      không tạo Document mới và không index lại (DF trong inverted index giữ nguyên).
+    - nhiều file trùng nội dung trong cùng lần upload chỉ được kiểm tra một lần (file đầu tiên),
+      các file sau nhận lại kết quả của file đó (không bị báo là đạo văn lẫn nhau).
+    Lỗi của từng file được ghi vào kết quả của file đó, không ảnh hưởng file khác.
+    """
+    executor = get_executor(max_workers or len(uploaded_files) * TOP_SOURCES)
+
+    results = [None] * len(uploaded_files)
+    first_with_hash, duplicates = {}, []
+    with executor:
+        prepared = []
+        for index, file in enumerate(uploaded_files):
+            try:
+                content_hash = file_sha256(file)
+                if content_hash in first_with_hash:
+                    duplicates.append((index, first_with_hash[content_hash]))
+                    continue
+                first_with_hash[content_hash] = index
+                previous_check = find_latest_check(content_hash)
+                # Document cũ đã bị sửa content thì kết quả cũ không còn khớp file: kiểm tra lại
+                if previous_check is not None and not check_is_stale(previous_check):
+                    results[index] = {"file_name": file.name, **result_from_check(previous_check)}
+                    continue
+
+                cached = cached_extraction(content_hash)
+                if cached is not None:
+                    future, pdf_pages = completed_future(cached), None
+                else:
+                    future, pdf_pages = _submit_prepare(executor, file)
+                prepared.append((index, file, content_hash, future, pdf_pages))
+            except Exception as e:
+                results[index] = {"file_name": file.name, "error": str(e)}
+
+        aligning = []
+        for index, file, content_hash, future, pdf_pages in prepared:
+            try:
+                text, tokens = _prepared_result(future, pdf_pages)
+                cache_extraction(content_hash, text, tokens)
+                document = Document.objects.create(
+                    title=file.name,
+                    file=file,
+                    content=text,
+                    content_hash=content_hash,
+                    user=user,
+                    doc_length=len(text),
+                    original_filename=file.name,
+                    file_extension=file.name.split('.')[-1],
+                )
+                matches = find_sources(document, text, tokens=tokens)
+                alignments = submit_alignments(executor, text, matches)
+                aligning.append((index, file, content_hash, document, text, matches, alignments))
+            except Exception as e:
+                results[index] = {"file_name": file.name, "error": str(e)}
+
+        for index, file, content_hash, document, text, matches, alignments in aligning:
+            try:
+                source_blocks = [future.result() for future in alignments]
+                result = save_check(document, text, matches, source_blocks)
+                cache_latest_check(content_hash, result["plagiarism_check_id"])
+                results[index] = {"file_name": file.name, **result}
+            except Exception as e:
+                results[index] = {"file_name": file.name, "error": str(e)}
+
+    for index, first in duplicates:
+        results[index] = {**results[first], "file_name": uploaded_files[index].name}
+    return results
+
+
+def submit_check_jobs(uploaded_files, user=None) -> list[CheckJob]:
+    """
+    Lưu file upload thành Document (chưa có content) và đưa vào hàng đợi,
+    mỗi file một CheckJob. Worker sẽ làm các bước extract → index → search → align.
+    File trùng nội dung với file đã kiểm tra thì tạo luôn job đã xong với kết quả cũ;
+    file trùng nội dung với một file trước đó trong cùng lần upload dùng chung job của file đó.
+    """
+    jobs = []
+    job_for_hash = {}
+    for file in uploaded_files:
+        content_hash = file_sha256(file)
+        if content_hash in job_for_hash:
+            jobs.append(job_for_hash[content_hash])
+            continue
+        previous_check = find_latest_check(content_hash)
+        # Document cũ đã bị sửa content thì kết quả cũ không còn khớp file: kiểm tra lại
+        if previous_check is not None and not check_is_stale(previous_check):
+            job = CheckJob.objects.create(
+                user=user,
+                document=previous_check.document,
+                file_name=file.name,
+                status=CheckJob.STATUS_DONE,
+                progress=100,
+                result={"file_name": file.name, **result_from_check(previous_check)},
+                finished_at=timezone.now(),
+            )
+        else:
+            with transaction.atomic():
+                document = Document.objects.create(
+                    title=file.name,
+                    file=file,
+                    content_hash=content_hash,
+                    user=user,
+                    original_filename=file.name,
+                    file_extension=file.name.split('.')[-1],
+                )
+                job = CheckJob.objects.create(user=user, document=document, file_name=file.name)
+        jobs.append(job)
+        job_for_hash[content_hash] = job
+    return jobs
+
+
+def claim_next_job() -> CheckJob | None:
+    """
+    Lấy job pending cũ nhất và đánh dấu running.
+    SKIP LOCKED giúp nhiều worker chạy song song mà không lấy trùng job.
+    """
+    with transaction.atomic():
+        job = (
+            CheckJob.objects.select_for_update(skip_locked=True)
+            .filter(status=CheckJob.STATUS_PENDING)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = CheckJob.STATUS_RUNNING
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+        return job
+
+
+def requeue_stale_jobs(stale_after: timedelta) -> int:
+    """
+    Đưa các job running mà worker không báo tiến độ (heartbeat_at) quá stale_after
+    (worker bị tắt giữa chừng) về lại pending. Job chạy lâu nhưng vẫn đang sang bước mới
+    thì không bị chạy lại.
+    """
+    return CheckJob.objects.filter(
+        status=CheckJob.STATUS_RUNNING,
+        heartbeat_at__lt=timezone.now() - stale_after,
+    ).update(status=CheckJob.STATUS_PENDING, stage=None, progress=0, started_at=None, heartbeat_at=None)
+
+
+def _run_check(job: CheckJob) -> dict:
+    """
+    Các bước extract → index → search → align của một CheckJob kiểm tra đạo văn.
+    """
+    def report_progress(stage):
+        CheckJob.objects.filter(pk=job.pk).update(
+            stage=stage,
+            progress=CheckJob.STAGES.index(stage) * 100 // len(CheckJob.STAGES),
+            heartbeat_at=timezone.now(),
+        )
+
+    document = job.document
+    report_progress(CheckJob.STAGE_EXTRACT)
+    cached = cached_extraction(document.content_hash) if document.content_hash else None
+    if cached is not None:
+        text, tokens = cached
+    else:
+        with document.file.open('rb') as file:
+            text, tokens = preprocess_stream(iter_extract_text(file))
+    document.content = text
+    document.save(update_fields=['content'])
+
+    result = check_document(document, text, tokens=tokens, report_progress=report_progress)
+    if document.content_hash:
+        cache_extraction(document.content_hash, text, tokens)
+        cache_latest_check(document.content_hash, result["plagiarism_check_id"])
+    return {"file_name": job.file_name, **result}
+
+
+def run_job(job: CheckJob):
+    """
+    Thực hiện một CheckJob (kiểm tra đạo văn hoặc xuất PDF), ghi tiến độ và kết quả/lỗi vào job.
+    """
+    try:
+        result = run_export_job(job) if job.kind == CheckJob.KIND_EXPORT else _run_check(job)
+    except Exception as e:
+        CheckJob.objects.filter(pk=job.pk).update(
+            status=CheckJob.STATUS_FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+        )
+        return
+
+    CheckJob.objects.filter(pk=job.pk).update(
+        status=CheckJob.STATUS_DONE,
+        progress=100,
+        result=result,
+        finished_at=timezone.now(),
+    )
@@ -1,8 +1,16 @@
 import math
 import re
 from collections import Counter
+from django.db import connection, transaction
+from django.db.models import F
 from pyvi import ViTokenizer
-from .models import Document, Term, Posting
+from .models import CorpusVersion, Document, Term, Posting
+from .engine import get_engine
+from .fingerprint import KGRAM_SIZE, find_candidate_sources, index_fingerprints
+from .idf import idf_cache, idf_value
+from .segments import segment_index, segments_enabled
+from .terms import term_dictionary
+from .tokens import decode_tokens, encode_tokens
 
 
 # Danh sách stopword tiếng Việt (có thể mở rộng thêm)
@@ -12,6 +20,12 @@ VIETNAMESE_STOPWORDS = {
     "vì", "nên", "vậy", "những", "rằng", "nữa", "vẫn", "ra", "vào",
 }
 
+# Số bản ghi tối đa trong một câu lệnh INSERT khi bulk_create
+BULK_BATCH_SIZE = 2000
+
+# Số ứng viên TF–IDF lấy ra (tính theo bội của top_n) trước khi lọc bằng fingerprint
+CANDIDATE_POOL = 4
+
 
 def preprocess(text: str) -> list[str]:
     """
@@ -43,129 +57,275 @@ def preprocess(text: str) -> list[str]:
     return tokens
 
 
-def index_document(document: Document):
+def preprocess_stream(fragments) -> tuple[str, list[str]]:
+    """
+    Tách từ dần theo từng phần văn bản (vd. từng trang PDF từ utils.iter_extract_text)
+    ngay khi phần đó được trích xuất, không chờ đọc hết file.
+    Trả về (toàn bộ text, danh sách token).
+    """
+    parts = []
+    tokens = []
+    for fragment in fragments:
+        parts.append(fragment)
+        tokens.extend(preprocess(fragment))
+    return "".join(parts), tokens
+
+
+def document_tokens(document: Document) -> list[str]:
     """
-    Xây dựng inverted index cho Document (tính TF và cập nhật DF cho Term).
+    Token của document: đọc từ Document.token_stream đã lưu, chưa có thì chạy
+    preprocess (ViTokenizer) trên content một lần rồi lưu lại.
     """
-    tokens = preprocess(document.content)
+    if document.token_stream:
+        return decode_tokens(document.token_stream)
+
+    tokens = preprocess(document.content or "")
+    document.token_stream = encode_tokens(tokens)
+    if document.pk:
+        Document.objects.filter(pk=document.pk).update(token_stream=document.token_stream)
+    return tokens
+
+
+@transaction.atomic
+def index_document(document: Document, tokens: list[str] = None):
+    """
+    Xây dựng (hoặc cập nhật) inverted index cho Document: TF trong Posting, DF trong Term.
+    tokens: kết quả preprocess(document.content) nếu đã có sẵn (tránh chạy ViTokenizer lại),
+    được lưu vào Document.token_stream; không truyền thì đọc từ token_stream (xem document_tokens).
+    So sánh TF mới với các Posting đang có của document và chỉ ghi phần thay đổi,
+    theo lô trong một transaction:
+    1. Lấy id của các Term (term_dictionary), upsert Term còn thiếu (INSERT ... ON CONFLICT DO NOTHING).
+    2. Term không còn trong document: xoá Posting, giảm doc_freq (một câu DELETE, một câu UPDATE).
+       Term mới: tăng doc_freq (một câu UPDATE).
+    3. Term mới hoặc đổi TF: ghi Posting kèm trọng số TF–IDF (INSERT ... ON CONFLICT DO UPDATE).
+       Term giữ nguyên TF: chỉ co giãn trọng số theo độ dài document mới (một câu UPDATE).
+    4. Lưu độ dài vector (vector_norm) của document.
+    5. Ghi fingerprint winnowing của document (xem fingerprint.py).
+    """
+    if tokens is None:
+        tokens = document_tokens(document)
+    else:
+        document.token_stream = encode_tokens(tokens)
     term_frequencies = Counter(tokens)
     doc_len = len(tokens)
-    document.doc_length = doc_len
-    document.save(update_fields=['doc_length'])
-
-    seen_terms = set()
-    for term_text, freq in term_frequencies.items():
-        term_obj, created = Term.objects.get_or_create(text=term_text)
-        if term_text not in seen_terms:
-            term_obj.doc_freq += 1
-            term_obj.save(update_fields=['doc_freq'])
-            seen_terms.add(term_text)
-
-        # Tạo hoặc cập nhật Posting
-        Posting.objects.update_or_create(
-            term=term_obj,
-            document=document,
-            defaults={'term_freq': freq}
+
+    index_fingerprints(document, tokens)
+
+    # Sắp xếp để các transaction song song luôn khoá row Term theo cùng thứ tự
+    terms = sorted(term_frequencies)
+    term_ids = term_dictionary.lookup(terms, create=True) if terms else {}
+    new_frequencies = {term_ids[term_text]: term_frequencies[term_text] for term_text in terms}
+
+    # Posting hiện có của document; tổng TF chính là số token lúc index trước
+    old_postings = {
+        term_id: (term_freq, weight)
+        for term_id, term_freq, weight in Posting.objects.filter(document=document)
+        .values_list('term_id', 'term_freq', 'weight')
+    }
+    old_len = sum(term_freq for term_freq, _ in old_postings.values())
+
+    added = sorted(term_id for term_id in new_frequencies if term_id not in old_postings)
+    removed = sorted(term_id for term_id in old_postings if term_id not in new_frequencies)
+    changed = sorted(
+        term_id for term_id, term_freq in new_frequencies.items()
+        if term_id in old_postings and old_postings[term_id][0] != term_freq
+    )
+
+    if removed:
+        Posting.objects.filter(document=document, term_id__in=removed).delete()
+        Term.objects.filter(id__in=removed).update(doc_freq=F('doc_freq') - 1)
+    if added:
+        Term.objects.filter(id__in=added).update(doc_freq=F('doc_freq') + 1)
+
+    # Term giữ nguyên TF: trọng số tf/doc_len*idf chỉ đổi theo doc_len
+    weights = {}
+    scale = old_len / doc_len if doc_len else 0.0
+    for term_id, term_freq in new_frequencies.items():
+        if term_id in old_postings and old_postings[term_id][0] == term_freq:
+            weights[term_id] = old_postings[term_id][1] * scale
+    if weights and scale != 1:
+        Posting.objects.filter(document=document).update(weight=F('weight') * scale)
+
+    # Trọng số tính theo IDF tại thời điểm index; reweight_index sẽ làm mới khi IDF thay đổi
+    upserted = added + changed
+    if upserted:
+        total_docs = Document.objects.count()
+        doc_freqs = dict(Term.objects.filter(id__in=upserted).values_list('id', 'doc_freq'))
+        for term_id in upserted:
+            weights[term_id] = new_frequencies[term_id] / doc_len * idf_value(total_docs, doc_freqs[term_id])
+
+        Posting.objects.bulk_create(
+            [
+                Posting(
+                    term_id=term_id,
+                    document=document,
+                    term_freq=new_frequencies[term_id],
+                    weight=weights[term_id],
+                )
+                for term_id in upserted
+            ],
+            update_conflicts=True,
+            unique_fields=['term', 'document'],
+            update_fields=['term_freq', 'weight'],
+            batch_size=BULK_BATCH_SIZE,
         )
 
+    document.doc_length = doc_len
+    document.vector_norm = math.sqrt(sum(w * w for w in weights.values()))
+    if not (added or removed or changed or doc_len != old_len):
+        document.save(update_fields=['doc_length', 'vector_norm', 'token_stream'])
+        return
+
+    # Báo cho mọi worker biết N/DF đã đổi; worker hiện tại làm mới ngay sau commit.
+    # index_version cho TfidfEngine biết chỉ cần nạp lại Posting của document này.
+    document.index_version = CorpusVersion.bump()
+    document.save(update_fields=['doc_length', 'vector_norm', 'token_stream', 'index_version'])
+    transaction.on_commit(idf_cache.expire)
+    if segments_enabled():
+        transaction.on_commit(lambda: segment_index.add_documents([document.id]))
+
+
+@transaction.atomic
+def reweight_index():
+    """
+    Tính lại trọng số TF–IDF của mọi Posting và vector_norm của mọi Document
+    theo N, DF hiện tại (hai câu UPDATE set-based). Chạy định kỳ để bù IDF bị lệch
+    khi corpus lớn dần.
+    """
+    posting_table = Posting._meta.db_table
+    document_table = Document._meta.db_table
+    term_table = Term._meta.db_table
+
+    # Mọi document đều đổi trọng số: engine của các worker sẽ dựng lại toàn bộ
+    version = CorpusVersion.bump()
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {posting_table} AS p
+            SET weight = (p.term_freq::double precision / d.doc_length)
+                * LN(c.total_docs / (1 + t.doc_freq) + 1e-9) / LN(10)
+            FROM {document_table} AS d,
+                 {term_table} AS t,
+                 (SELECT COUNT(*)::double precision AS total_docs FROM {document_table}) AS c
+            WHERE p.document_id = d.id
+              AND p.term_id = t.id
+              AND d.doc_length > 0
+        """)
+        cursor.execute(f"""
+            UPDATE {document_table} AS d
+            SET vector_norm = COALESCE(s.norm, 0), index_version = %s
+            FROM (
+                SELECT document_id, SQRT(SUM(weight * weight)) AS norm
+                FROM {posting_table}
+                GROUP BY document_id
+            ) AS s
+            WHERE d.id = s.document_id
+        """, [version])
+
+    transaction.on_commit(idf_cache.expire)
+    # Trọng số trong segment đã cũ hết: ghi lại toàn bộ
+    if segments_enabled() and segment_index.exists():
+        transaction.on_commit(segment_index.rebuild)
+
 
 def compute_idf(term_text: str) -> float:
     """
     IDF = log10( N / (1 + df(term) ) )
+    N và df được lấy từ idf_cache, không query lại database mỗi lần gọi.
     """
-    total_docs = Document.objects.count()
-    try:
-        term_obj = Term.objects.get(text=term_text)
-        df = term_obj.doc_freq
-    except Term.DoesNotExist:
-        df = 0
-    # +1 để tránh chia cho 0
-    return math.log((total_docs / (1 + df) + 1e-9), 10)
+    return idf_cache.idf(term_text)
 
 
 def get_doc_tfidf_vector(doc_id: int) -> dict[str, float]:
     """
-    Tính vector TF–IDF cho document với doc_id.
+    Vector TF–IDF của document với doc_id, đọc từ trọng số đã lưu trong Posting.
     """
-    try:
-        document = Document.objects.get(id=doc_id)
-    except Document.DoesNotExist:
-        return {}
-
-    postings = Posting.objects.filter(document=document).select_related('term')
-    if document.doc_length == 0:
-        return {}
-
-    tfidf_vector: dict[str, float] = {}
-    for post in postings:
-        term_text = post.term.text
-        tf = post.term_freq / document.doc_length
-        idf_val = compute_idf(term_text)
-        tfidf_vector[term_text] = tf * idf_val
-    return tfidf_vector
+    postings = Posting.objects.filter(document_id=doc_id, document__doc_length__gt=0)
+    return dict(postings.values_list('term__text', 'weight'))
 
 
-def cosine_similarity(vec1: dict[str, float], vec2: dict[str, float]) -> float:
+def cosine_similarity(
+    vec1: dict[str, float],
+    vec2: dict[str, float],
+    mag1: float = None,
+    mag2: float = None,
+) -> float:
     """
     Tính cosine similarity giữa hai vector TF–IDF (dạng dict term→weight).
+    Có thể truyền sẵn độ dài vector (vd. Document.vector_norm) để chỉ còn tính tích vô hướng.
     """
+    if len(vec2) < len(vec1):
+        vec1, vec2, mag1, mag2 = vec2, vec1, mag2, mag1
+
     dot = 0.0
     for term, w1 in vec1.items():
         w2 = vec2.get(term, 0.0)
         dot += w1 * w2
 
-    mag1 = math.sqrt(sum(w * w for w in vec1.values()))
-    mag2 = math.sqrt(sum(w * w for w in vec2.values()))
+    if mag1 is None:
+        mag1 = math.sqrt(sum(w * w for w in vec1.values()))
+    if mag2 is None:
+        mag2 = math.sqrt(sum(w * w for w in vec2.values()))
     if mag1 == 0 or mag2 == 0:
         return 0.0
     return dot / (mag1 * mag2)
 
 
-def search_corpus(text: str, top_n: int = 5, exclude_doc_id: int = None) -> list[tuple[Document, float]]:
+def search_corpus(
+    text: str,
+    top_n: int = 5,
+    exclude_doc_id: int = None,
+    strategy: str = None,
+    tokens: list[str] = None,
+) -> list[tuple[Document, float]]:
     """
     Kiểm tra đạo văn: 
     - Tiền xử lý text bằng preprocess (tiếng Việt).
     - Tính TF–IDF cho query.
-    - Lấy tập các document đã lưu trong database (có ít nhất một term chung).
-    - Tính cosine similarity giữa vector query và mỗi document, trả về top_n kết quả.
+    - Tính cosine similarity giữa vector query và corpus (xem engine.TfidfEngine), trả về top_n kết quả.
+      strategy='maxscore' (mặc định) duyệt posting list theo IDF giảm dần và dừng sớm,
+      strategy='exhaustive' nhân ma trận trên toàn bộ posting list của query.
+      Với PLAGIARISM_INDEX_BACKEND='segments' thì search trên segment mmap (segments.py),
+      chỉ có strategy='exhaustive' (mặc định).
     - Có thể loại document có id == exclude_doc_id.
+    - tokens: kết quả preprocess(text) nếu đã có sẵn.
     """
-    tokens = preprocess(text)
+    if tokens is None:
+        tokens = preprocess(text)
     if not tokens:
         return []
 
-    # Tạo vector TF–IDF của query
-    q_tf = Counter(tokens)
-    q_len = len(tokens)
-    query_vec: dict[str, float] = {}
-    for term_text, freq in q_tf.items():
-        tf = freq / q_len
-        idf_val = compute_idf(term_text)
-        query_vec[term_text] = tf * idf_val
-
-    # Lấy candidate document IDs
-    candidate_ids = set()
-    for term_text in set(tokens):
-        try:
-            term_obj = Term.objects.get(text=term_text)
-            postings = Posting.objects.filter(
-                term=term_obj).values_list('document_id', flat=True)
-            candidate_ids.update(postings)
-        except Term.DoesNotExist:
-            continue
-
-    # Tính similarity cho mỗi document
-    scored: list[tuple[Document, float]] = []
-    for doc_id in candidate_ids:
-        if exclude_doc_id is not None and doc_id == exclude_doc_id:
-            continue  # Bỏ chính document hiện tại
-
-        doc_vec = get_doc_tfidf_vector(doc_id)
-        score = cosine_similarity(query_vec, doc_vec)
-        if score > 0:
-            doc = Document.objects.get(id=doc_id)
-            scored.append((doc, score))
-
-    # Sắp xếp giảm dần theo score
-    scored.sort(key=lambda x: x[1], reverse=True)
-    return scored[:top_n]
+    index = segment_index if segments_enabled() and segment_index.exists() else get_engine()
+    options = {'strategy': strategy} if strategy else {}
+    ranked = index.search(tokens, top_n=top_n, exclude_doc_id=exclude_doc_id, **options)
+    documents = Document.objects.in_bulk([doc_id for doc_id, _ in ranked])
+    return [(documents[doc_id], score) for doc_id, score in ranked if doc_id in documents]
+
+
+def search_copied_sources(
+    text: str,
+    top_n: int = 5,
+    exclude_doc_id: int = None,
+    tokens: list[str] = None,
+) -> list[tuple[Document, float]]:
+    """
+    Nguồn cần căn chỉnh (alignment) cho text, dạng (Document, cosine) như search_corpus:
+    lấy CANDIDATE_POOL × top_n document giống nhất theo TF–IDF, chỉ giữ các document có chung
+    ít nhất một fingerprint winnowing với text (có đoạn chép nguyên văn từ
+    WINDOW_SIZE + KGRAM_SIZE - 1 token trở lên), rồi lấy top_n theo cosine.
+    Document chỉ giống về chủ đề thì không phải chạy alignment.
+    Text quá ngắn để có fingerprint thì trả về top_n của search_corpus.
+    """
+    if tokens is None:
+        tokens = preprocess(text)
+    if len(tokens) < KGRAM_SIZE:
+        return search_corpus(text, top_n=top_n, exclude_doc_id=exclude_doc_id, tokens=tokens)
+
+    ranked = search_corpus(text, top_n=top_n * CANDIDATE_POOL, exclude_doc_id=exclude_doc_id, tokens=tokens)
+    copied = find_candidate_sources(
+        tokens,
+        top_n=len(ranked),
+        exclude_doc_id=exclude_doc_id,
+        doc_ids=[document.id for document, _ in ranked],
+    )
+    copied_ids = {doc_id for doc_id, _ in copied}
+    return [(document, score) for document, score in ranked if document.id in copied_ids][:top_n]
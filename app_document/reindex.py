@@ -0,0 +1,395 @@
+import io
+import math
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .executors import get_executor
+from .fingerprint import fingerprint_tokens
+from .idf import idf_cache, idf_value
+from .models import CorpusVersion, Document, Fingerprint, Posting, Term
+from .plagiarism import preprocess
+from .segments import segment_index, segments_enabled
+from .tokens import decode_tokens, encode_tokens
+
+
+# Số document mỗi việc tách từ gửi vào process pool / mỗi lần COPY
+BATCH_SIZE = 200
+
+PHASE_TOKENS = 'tokens'
+PHASE_POSTINGS = 'postings'
+
+CHECKPOINT_TABLE = 'app_document_reindex_checkpoint'
+NORMS_TABLE = 'app_document_reindex_norms'
+# Bảng được dựng lại qua bảng bóng (shadow) rồi đổi tên, theo thứ tự xoá được khi có FK
+SWAPPED_MODELS = [Posting, Fingerprint, Term]
+
+
+def _shadow(model) -> str:
+    return f"{model._meta.db_table}_reindex"
+
+
+def _tokenize_batch(batch: list[tuple[int, str]]) -> list[tuple[int, bytes]]:
+    """
+    Chạy trong process con: tách từ một lô document, trả về token đã mã hoá (tokens.py).
+    """
+    return [(doc_id, encode_tokens(preprocess(content or ""))) for doc_id, content in batch]
+
+
+def _copy(cursor, table: str, columns: list[str], rows):
+    """
+    Nạp rows vào table bằng COPY ... FROM STDIN (định dạng text, phân tách bằng tab).
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+class Reindexer:
+    """
+    Dựng lại Term/Posting/Fingerprint từ Document.content (vd. sau khi đổi stopword hoặc tokenizer):
+    1. Pha tokens: tách từ mọi document trong process pool, ghi lại Document.token_stream,
+       đếm DF trong bộ nhớ. Kết thúc pha: ghi bảng Term bóng (giữ id cũ của term đã có).
+    2. Pha postings: tính TF–IDF, norm và fingerprint từ token_stream, nạp vào các bảng bóng
+       bằng COPY theo lô.
+    3. Đổi bảng: trong một transaction, khoá bảng thật, đưa Term và document mới tạo trong lúc
+       reindex vào bảng bóng, đổi tên bảng bóng thành bảng thật, cập nhật doc_length/vector_norm.
+    Mỗi lô ghi cùng transaction với checkpoint (bảng app_document_reindex_checkpoint)
+    nên chạy lại lệnh sẽ tiếp tục từ lô cuối cùng đã xong.
+    """
+
+    def __init__(self, workers: int = None, batch_size: int = BATCH_SIZE, log=print):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.log = log
+
+    # Checkpoint
+
+    def _checkpoint(self) -> dict | None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [CHECKPOINT_TABLE])
+            if cursor.fetchone()[0] is None:
+                return None
+            cursor.execute(f"SELECT phase, last_doc_id, max_doc_id FROM {CHECKPOINT_TABLE}")
+            row = cursor.fetchone()
+        return dict(zip(['phase', 'last_doc_id', 'max_doc_id'], row)) if row else None
+
+    def _save_checkpoint(self, cursor, phase: str, last_doc_id: int):
+        cursor.execute(f"UPDATE {CHECKPOINT_TABLE} SET phase = %s, last_doc_id = %s", [phase, last_doc_id])
+
+    def discard(self):
+        """
+        Bỏ mọi bảng bóng và checkpoint của lần reindex dở dang.
+        """
+        tables = [_shadow(model) for model in SWAPPED_MODELS] + [NORMS_TABLE, CHECKPOINT_TABLE]
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    @transaction.atomic
+    def _start(self) -> dict:
+        self.discard()
+        max_doc_id = Document.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        with connection.cursor() as cursor:
+            for model in SWAPPED_MODELS:
+                cursor.execute(
+                    f"CREATE TABLE {_shadow(model)} (LIKE {model._meta.db_table} INCLUDING ALL)"
+                )
+            cursor.execute(
+                f"CREATE TABLE {NORMS_TABLE} "
+                "(document_id bigint PRIMARY KEY, doc_length integer, vector_norm double precision)"
+            )
+            cursor.execute(
+                f"CREATE TABLE {CHECKPOINT_TABLE} (phase varchar(20), last_doc_id bigint, max_doc_id bigint)"
+            )
+            cursor.execute(
+                f"INSERT INTO {CHECKPOINT_TABLE} VALUES (%s, 0, %s)", [PHASE_TOKENS, max_doc_id]
+            )
+        return {'phase': PHASE_TOKENS, 'last_doc_id': 0, 'max_doc_id': max_doc_id}
+
+    def _documents(self, after_id: int, max_doc_id: int):
+        return Document.objects.filter(id__gt=after_id, id__lte=max_doc_id).order_by('id')
+
+    def _batches(self, queryset, fields):
+        batch = []
+        for row in queryset.values_list(*fields).iterator(chunk_size=self.batch_size * 5):
+            batch.append(row)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Pha 1
+
+    def _tokenize(self, checkpoint: dict) -> dict[str, int]:
+        """
+        Tách từ các document chưa xử lý, trả về DF của toàn corpus.
+        Document đã tách từ ở lần chạy trước (<= last_doc_id) chỉ cần giải mã token_stream.
+        """
+        doc_freqs = Counter()
+        done = Document.objects.filter(id__lte=checkpoint['last_doc_id'])
+        for token_stream in done.values_list('token_stream', flat=True).iterator(chunk_size=1000):
+            if token_stream:
+                doc_freqs.update(set(decode_tokens(token_stream)))
+
+        started = time.perf_counter()
+        processed = 0
+        pending = deque()
+        remaining = self._documents(checkpoint['last_doc_id'], checkpoint['max_doc_id'])
+        workers = self.workers or getattr(settings, 'PLAGIARISM_WORKERS', 1)
+        with get_executor(workers) as executor:
+            batches = self._batches(remaining, ['id', 'content'])
+            while True:
+                # Giữ tối đa hai lô mỗi process để không nạp hết content vào bộ nhớ
+                while len(pending) < 2 * workers:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    pending.append(executor.submit(_tokenize_batch, batch))
+                if not pending:
+                    break
+
+                results = pending.popleft().result()
+                with transaction.atomic():
+                    Document.objects.bulk_update(
+                        [Document(id=doc_id, token_stream=stream) for doc_id, stream in results],
+                        ['token_stream'],
+                    )
+                    with connection.cursor() as cursor:
+                        self._save_checkpoint(cursor, PHASE_TOKENS, results[-1][0])
+                for _, stream in results:
+                    doc_freqs.update(set(decode_tokens(stream)))
+
+                processed += len(results)
+                elapsed = time.perf_counter() - started
+                self.log(f"tokens: {processed} documents ({processed / elapsed:.1f} docs/s)")
+        return doc_freqs
+
+    @transaction.atomic
+    def _write_terms(self, doc_freqs: dict[str, int]):
+        """
+        Ghi bảng Term bóng: giữ nguyên id của mọi term đã có (kể cả term không còn dùng, df = 0)
+        để id đang được cache trong các process (terms.TermDictionary) vẫn đúng.
+        Term mới lấy id từ sequence của bảng Term thật nên không trùng với id của term
+        được upload tạo ra trong lúc reindex.
+        """
+        term_ids = dict(Term.objects.values_list('text', 'id'))
+        new_terms = sorted(term_text for term_text in doc_freqs if term_text not in term_ids)
+
+        with connection.cursor() as cursor:
+            if new_terms:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    [Term._meta.db_table, len(new_terms)]
+                )
+                term_ids.update(zip(new_terms, (row[0] for row in cursor.fetchall())))
+            _copy(
+                cursor, _shadow(Term), ['id', 'text', 'doc_freq'],
+                ((term_id, term_text, doc_freqs.get(term_text, 0)) for term_text, term_id in term_ids.items()),
+            )
+            self._save_checkpoint(cursor, PHASE_POSTINGS, 0)
+
+    # Pha 2
+
+    def _load_postings(self, checkpoint: dict):
+        """
+        Tính Posting (TF–IDF), norm và fingerprint của từng document từ token_stream
+        và nạp vào bảng bóng bằng COPY.
+        """
+        with connection.cursor() as cursor:
+            # Lô đã COPY nhưng chưa kịp ghi checkpoint không thể xảy ra (cùng transaction),
+            # xoá cho chắc khi chạy lại
+            for table in [_shadow(Posting), _shadow(Fingerprint), NORMS_TABLE]:
+                cursor.execute(f"DELETE FROM {table} WHERE document_id > %s", [checkpoint['last_doc_id']])
+            cursor.execute(f"SELECT text, id, doc_freq FROM {_shadow(Term)}")
+            terms = {term_text: (term_id, doc_freq) for term_text, term_id, doc_freq in cursor.fetchall()}
+
+        total_docs = Document.objects.count()
+        started = time.perf_counter()
+        processed = 0
+        remaining = self._documents(checkpoint['last_doc_id'], checkpoint['max_doc_id'])
+        for batch in self._batches(remaining, ['id', 'token_stream']):
+            postings, fingerprints, norms = [], [], []
+            for doc_id, token_stream in batch:
+                tokens = decode_tokens(token_stream) if token_stream else []
+                doc_len = len(tokens)
+                norm_sq = 0.0
+                for term_text, term_freq in Counter(tokens).items():
+                    term_id, doc_freq = terms[term_text]
+                    weight = term_freq / doc_len * idf_value(total_docs, doc_freq)
+                    norm_sq += weight * weight
+                    postings.append((term_id, doc_id, term_freq, repr(weight)))
+                fingerprints.extend(
+                    (fingerprint_hash, doc_id, position) for fingerprint_hash, position in fingerprint_tokens(tokens)
+                )
+                norms.append((doc_id, doc_len, repr(math.sqrt(norm_sq))))
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                _copy(cursor, _shadow(Posting), ['term_id', 'document_id', 'term_freq', 'weight'], postings)
+                _copy(cursor, _shadow(Fingerprint), ['hash', 'document_id', 'position'], fingerprints)
+                _copy(cursor, NORMS_TABLE, ['document_id', 'doc_length', 'vector_norm'], norms)
+                self._save_checkpoint(cursor, PHASE_POSTINGS, batch[-1][0])
+
+            processed += len(batch)
+            elapsed = time.perf_counter() - started
+            self.log(f"postings: {processed} documents ({processed / elapsed:.1f} docs/s)")
+
+    # Pha 3
+
+    def _constraints(self, cursor, table: str) -> dict:
+        return connection.introspection.get_constraints(cursor, table)
+
+    @staticmethod
+    def _constraint_key(info: dict) -> tuple:
+        return (tuple(info['columns']), info['primary_key'], info['unique'], info['foreign_key'], info['index'])
+
+    def _merge_live_changes(self, cursor, max_doc_id: int):
+        """
+        Chạy khi đã khoá bảng thật: đưa các thay đổi xảy ra trong lúc reindex vào bảng bóng.
+        - Term được tạo sau khi ghi bảng Term bóng: thêm vào với đúng id đang dùng. Nếu cùng text
+          với một term mới của bảng bóng thì bảng bóng lấy id của term thật (posting bóng được đổi theo).
+        - Document upload sau khi bắt đầu (id > max_doc_id): đã được index vào bảng thật,
+          chép posting/fingerprint của chúng sang bảng bóng và cộng DF tương ứng.
+        """
+        term_table, shadow_term = Term._meta.db_table, _shadow(Term)
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE reindex_term_remap ON COMMIT DROP AS
+            SELECT s.id AS old_id, t.id AS new_id
+            FROM {shadow_term} AS s
+            JOIN {term_table} AS t ON t.text = s.text
+            WHERE t.id <> s.id
+        """)
+        cursor.execute(f"""
+            UPDATE {_shadow(Posting)} AS p SET term_id = r.new_id
+            FROM reindex_term_remap AS r WHERE p.term_id = r.old_id
+        """)
+        cursor.execute(f"""
+            UPDATE {shadow_term} AS s SET id = r.new_id
+            FROM reindex_term_remap AS r WHERE s.id = r.old_id
+        """)
+        cursor.execute(f"""
+            INSERT INTO {shadow_term} (id, text, doc_freq)
+            SELECT t.id, t.text, 0 FROM {term_table} AS t
+            WHERE NOT EXISTS (SELECT 1 FROM {shadow_term} AS s WHERE s.text = t.text)
+        """)
+
+        cursor.execute(f"""
+            INSERT INTO {_shadow(Posting)} (term_id, document_id, term_freq, weight)
+            SELECT term_id, document_id, term_freq, weight FROM {Posting._meta.db_table}
+            WHERE document_id > %s
+        """, [max_doc_id])
+        cursor.execute(f"""
+            UPDATE {shadow_term} AS s SET doc_freq = s.doc_freq + c.added
+            FROM (
+                SELECT term_id, COUNT(*) AS added FROM {Posting._meta.db_table}
+                WHERE document_id > %s GROUP BY term_id
+            ) AS c
+            WHERE s.id = c.term_id
+        """, [max_doc_id])
+        cursor.execute(f"""
+            INSERT INTO {_shadow(Fingerprint)} (hash, document_id, position)
+            SELECT hash, document_id, position FROM {Fingerprint._meta.db_table}
+            WHERE document_id > %s
+        """, [max_doc_id])
+
+    @transaction.atomic
+    def _swap(self, max_doc_id: int):
+        """
+        Đổi bảng bóng thành bảng thật trong một transaction. Tên index/constraint của bảng cũ
+        được đặt lại cho bảng mới để các migration sau vẫn tìm thấy chúng.
+        """
+        tables = [model._meta.db_table for model in SWAPPED_MODELS]
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {', '.join(tables)} IN ACCESS EXCLUSIVE MODE")
+            self._merge_live_changes(cursor, max_doc_id)
+
+            # Document bị xoá trong lúc reindex: bỏ posting/fingerprint và trừ lại DF
+            cursor.execute(f"""
+                WITH gone AS (
+                    DELETE FROM {_shadow(Posting)} AS p
+                    WHERE NOT EXISTS (SELECT 1 FROM {Document._meta.db_table} AS d WHERE d.id = p.document_id)
+                    RETURNING p.term_id
+                )
+                UPDATE {_shadow(Term)} AS t
+                SET doc_freq = t.doc_freq - g.removed
+                FROM (SELECT term_id, COUNT(*) AS removed FROM gone GROUP BY term_id) AS g
+                WHERE t.id = g.term_id
+            """)
+            cursor.execute(f"""
+                DELETE FROM {_shadow(Fingerprint)} AS f
+                WHERE NOT EXISTS (SELECT 1 FROM {Document._meta.db_table} AS d WHERE d.id = f.document_id)
+            """)
+
+            old_constraints = {table: self._constraints(cursor, table) for table in tables}
+            for table in tables:
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+                cursor.execute(f"ALTER TABLE {table}_reindex RENAME TO {table}")
+            for table in tables:
+                cursor.execute(f"DROP TABLE {table}_old")
+
+            for table in tables:
+                new_constraints = self._constraints(cursor, table)
+                by_key = {}
+                for name, info in new_constraints.items():
+                    by_key.setdefault(self._constraint_key(info), []).append(name)
+                for old_name, info in old_constraints[table].items():
+                    if info['foreign_key']:
+                        (column,), (target_table, target_column) = info['columns'], info['foreign_key']
+                        cursor.execute(
+                            f"ALTER TABLE {table} ADD CONSTRAINT {old_name} FOREIGN KEY ({column}) "
+                            f"REFERENCES {target_table} ({target_column}) DEFERRABLE INITIALLY DEFERRED"
+                        )
+                        continue
+                    matches = by_key.get(self._constraint_key(info), [])
+                    if len(matches) != 1 or matches[0] == old_name:
+                        continue
+                    if info['primary_key'] or info['unique']:
+                        cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {matches[0]} TO {old_name}")
+                    else:
+                        cursor.execute(f"ALTER INDEX {matches[0]} RENAME TO {old_name}")
+
+                cursor.execute(f"""
+                    SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false)
+                    FROM {table}
+                """)
+
+            cursor.execute(f"""
+                UPDATE {Document._meta.db_table} AS d
+                SET doc_length = n.doc_length, vector_norm = n.vector_norm
+                FROM {NORMS_TABLE} AS n
+                WHERE d.id = n.document_id
+            """)
+            cursor.execute(f"DROP TABLE {NORMS_TABLE}")
+            cursor.execute(f"DROP TABLE {CHECKPOINT_TABLE}")
+
+        # term_generation: mọi process bỏ map text → id của bảng Term cũ
+        CorpusVersion.bump(terms=True)
+        transaction.on_commit(idf_cache.expire)
+        if segments_enabled() and segment_index.exists():
+            transaction.on_commit(segment_index.rebuild)
+
+    def run(self, restart: bool = False):
+        started = time.perf_counter()
+        checkpoint = None if restart else self._checkpoint()
+        if checkpoint is None:
+            checkpoint = self._start()
+        else:
+            self.log(f"Resuming {checkpoint['phase']} phase after document {checkpoint['last_doc_id']}")
+
+        if checkpoint['phase'] == PHASE_TOKENS:
+            doc_freqs = self._tokenize(checkpoint)
+            self._write_terms(doc_freqs)
+            checkpoint = self._checkpoint()
+
+        self._load_postings(checkpoint)
+        self._swap(checkpoint['max_doc_id'])
+
+        total = self._documents(0, checkpoint['max_doc_id']).count()
+        elapsed = time.perf_counter() - started
+        return total, elapsed
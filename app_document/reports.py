@@ -0,0 +1,70 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PlagiarismCheck
+
+
+# Thời gian giữ báo cáo đã render trong cache (giây)
+REPORT_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _key(kind: str, document_id: int, check_id: int) -> str:
+    return f"plagiarism:report:{kind}:{document_id}:{check_id}"
+
+
+def report_etag(document_id: int, check_id: int) -> str | None:
+    """
+    ETag của báo cáo đã cache (không đọc nội dung báo cáo), None nếu chưa có.
+    """
+    return cache.get(_key('etag', document_id, check_id))
+
+
+def cached_report(document_id: int, check_id: int) -> bytes | None:
+    return cache.get(_key('body', document_id, check_id))
+
+
+def cache_report(document_id: int, check_id: int, body: bytes) -> str:
+    """
+    Lưu báo cáo đã render (JSON bytes) của một PlagiarismCheck, trả về ETag của nó.
+    Khoá có cả document_id nên cache hit không cần query kiểm tra check thuộc document nào.
+    """
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    cache.set_many({
+        _key('etag', document_id, check_id): etag,
+        _key('body', document_id, check_id): body,
+    }, REPORT_CACHE_TIMEOUT)
+    return etag
+
+
+def expire_reports(document_id: int, check_ids):
+    cache.delete_many([
+        _key(kind, document_id, check_id)
+        for check_id in check_ids
+        for kind in ('etag', 'body')
+    ])
+
+
+def expire_document_reports(document):
+    """
+    Nội dung document thay đổi thì offset highlight của mọi lần kiểm tra cũ phải render lại.
+    """
+    document_id = document.id
+    check_ids = list(document.checks.values_list('id', flat=True))
+    transaction.on_commit(lambda: expire_reports(document_id, check_ids))
+
+
+@receiver(post_save, sender=PlagiarismCheck)
+def expire_report_on_check_save(sender, instance, created, **kwargs):
+    if not created:
+        document_id, check_id = instance.document_id, instance.id
+        transaction.on_commit(lambda: expire_reports(document_id, [check_id]))
+
+
+@receiver(post_delete, sender=PlagiarismCheck)
+def expire_report_on_check_delete(sender, instance, **kwargs):
+    document_id, check_id = instance.document_id, instance.id
+    transaction.on_commit(lambda: expire_reports(document_id, [check_id]))
@@ -0,0 +1,658 @@
+import fcntl
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Collate
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .idf import idf_cache
+from .models import Document, Posting
+
+
+# Thư mục chứa segment (tương đối với MEDIA_ROOT)
+SEGMENT_DIR = 'index_segments'
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+
+# Merge theo tầng: segment có n document thuộc tầng floor(log_MERGE_FACTOR(n)); khi cuối manifest
+# có từ MERGE_FACTOR segment liên tiếp cùng tầng thì merge() gộp chúng thành một (có thể kéo theo
+# merge ở tầng trên). add_documents tự merge, trừ các tầng từ MAX_AUTO_MERGE_DOCS document trở lên
+# (để cho run_check_worker / manage.py merge_segments, không làm chậm request)
+MERGE_FACTOR = 8
+MAX_AUTO_MERGE_DOCS = 1000
+MERGE_LOCK_NAME = '.merge.lock'
+# Số lần đọc lại manifest khi segment vừa bị merge xoá trước lúc kịp mở
+OPEN_RETRIES = 5
+
+# Số posting đọc từ Postgres / ghi ra file mỗi lần khi rebuild()
+REBUILD_CHUNK = 100000
+
+SEGMENT_MAGIC = b'PLSG'
+SEGMENT_VERSION = 1
+# magic, version, số term, số document, số posting
+_HEADER = struct.Struct('<4sB3xQQQ')
+
+
+def segments_enabled() -> bool:
+    return getattr(settings, 'PLAGIARISM_INDEX_BACKEND', 'database') == 'segments'
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def encode_varints(values: np.ndarray) -> tuple[bytes, np.ndarray]:
+    """
+    Mã hoá mảng số nguyên không âm thành varint (7 bit mỗi byte, bit cao = còn byte tiếp).
+    Trả về (bytes, số byte của từng giá trị).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    starts = np.cumsum(sizes) - sizes
+    rest = values.copy()
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        active = np.flatnonzero(sizes > k)
+        low_bits = (rest[active] & np.uint64(0x7F)).astype(np.uint8)
+        more = (sizes[active] > k + 1).astype(np.uint8) << 7
+        out[starts[active] + k] = low_bits | more
+        rest >>= np.uint64(7)
+    return out.tobytes(), sizes
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """
+    Ngược lại của encode_varints, data là mảng uint8 (có thể là view trên mmap).
+    """
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    parts = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(parts, starts).astype(np.int64)
+
+
+class SegmentWriter:
+    """
+    Ghi một segment bất biến theo từng khối posting (không giữ cả segment trong bộ nhớ):
+    - doc_ids (int64, tăng dần) và doc_norms (float64) của các document trong segment,
+    - từ điển term sắp xếp (offset uint64 + chuỗi UTF-8 liền nhau),
+    - posting list từng term: cột document tăng dần, lưu hiệu (delta) dạng varint,
+      trọng số float64 đi kèm.
+    add() nhận posting đã sắp theo (term theo thứ tự byte UTF-8, doc id); trọng số, chuỗi term và
+    varint được ghi ra file tạm, close() ghép header và các phần thành file segment.
+    """
+
+    def __init__(self, path: Path, doc_ids, doc_norms):
+        self.path = Path(path)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        order = np.argsort(doc_ids)
+        self.doc_ids = doc_ids[order]
+        self.doc_norms = np.asarray(doc_norms, dtype=np.float64)[order]
+
+        self._weights = tempfile.TemporaryFile(dir=self.path.parent)
+        self._terms = tempfile.TemporaryFile(dir=self.path.parent)
+        self._postings = tempfile.TemporaryFile(dir=self.path.parent)
+        # Vị trí bắt đầu của từng term trong các phần trên
+        self._term_offsets, self._posting_offsets, self._weight_starts = [], [], []
+        self._term_bytes = self._posting_bytes = self._posting_count = 0
+        self._last_term, self._last_col = None, 0
+
+    def add(self, terms, docs, weights):
+        """
+        Thêm một khối posting; posting của document không có trong doc_ids bị bỏ qua.
+        """
+        docs = np.asarray(docs, dtype=np.int64)
+        cols = np.minimum(np.searchsorted(self.doc_ids, docs), max(len(self.doc_ids) - 1, 0))
+        keep = np.flatnonzero(self.doc_ids[cols] == docs) if len(self.doc_ids) else np.empty(0, dtype=np.int64)
+        if not len(keep):
+            return
+        terms = [terms[i] for i in keep]
+        cols = cols[keep]
+        weights = np.asarray(weights, dtype=np.float64)[keep]
+
+        new_term = np.fromiter(
+            (term != previous for term, previous in zip(terms, [self._last_term] + terms[:-1])),
+            dtype=bool, count=len(terms),
+        )
+        deltas = cols.copy()
+        deltas[1:] -= cols[:-1]
+        deltas[0] -= self._last_col
+        deltas[new_term] = cols[new_term]
+        blob, sizes = encode_varints(deltas)
+        byte_starts = self._posting_bytes + np.cumsum(sizes) - sizes
+
+        for i in np.flatnonzero(new_term):
+            encoded = terms[i].encode('utf-8')
+            self._term_offsets.append(self._term_bytes)
+            self._posting_offsets.append(int(byte_starts[i]))
+            self._weight_starts.append(self._posting_count + int(i))
+            self._terms.write(encoded)
+            self._term_bytes += len(encoded)
+
+        self._postings.write(blob)
+        self._weights.write(weights.tobytes())
+        self._posting_bytes += len(blob)
+        self._posting_count += len(weights)
+        self._last_term, self._last_col = terms[-1], int(cols[-1])
+
+    def close(self):
+        def offsets(starts, total):
+            return np.asarray(starts + [total], dtype=np.uint64).tobytes()
+
+        sections = [
+            self.doc_ids.tobytes(),
+            self.doc_norms.tobytes(),
+            offsets(self._term_offsets, self._term_bytes),
+            offsets(self._posting_offsets, self._posting_bytes),
+            offsets(self._weight_starts, self._posting_count),
+            self._weights,
+            self._terms,
+            self._postings,
+        ]
+        with open(self.path, 'wb') as f:
+            f.write(_HEADER.pack(
+                SEGMENT_MAGIC, SEGMENT_VERSION, len(self._term_offsets), len(self.doc_ids), self._posting_count
+            ))
+            for section in sections:
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                if isinstance(section, bytes):
+                    f.write(section)
+                else:
+                    section.seek(0)
+                    shutil.copyfileobj(section, f)
+                    section.close()
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for section in (self._weights, self._terms, self._postings):
+                section.close()
+
+
+def write_segment(path: Path, doc_ids, doc_norms, posting_terms, posting_docs, posting_weights):
+    """
+    Ghi một segment từ các posting (term text, doc id, weight) chưa sắp xếp, đã có sẵn trong bộ nhớ
+    (segment của vài document, hoặc khi merge).
+    """
+    terms, rows = np.unique(np.asarray(posting_terms, dtype=str), return_inverse=True)
+    docs = np.asarray(posting_docs, dtype=np.int64)
+    order = np.lexsort((docs, rows))
+    with SegmentWriter(path, doc_ids, doc_norms) as writer:
+        writer.add(terms[rows[order]].tolist(), docs[order], np.asarray(posting_weights, dtype=np.float64)[order])
+
+
+def segment_doc_count(path: Path) -> int:
+    """
+    Số document của segment, chỉ đọc header.
+    """
+    with open(path, 'rb') as f:
+        return _HEADER.unpack(f.read(_HEADER.size))[3]
+
+
+def segment_tier(doc_count: int) -> int:
+    tier = 0
+    while doc_count >= MERGE_FACTOR:
+        doc_count //= MERGE_FACTOR
+        tier += 1
+    return tier
+
+
+class Segment:
+    """
+    Segment đã mở bằng mmap, các mảng là view numpy trên vùng nhớ map (không copy).
+    """
+
+    def __init__(self, path: Path):
+        self.name = path.name
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, term_count, doc_count, posting_count = _HEADER.unpack_from(self._mmap)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            raise ValueError(f"Invalid index segment: {path}")
+
+        offset = _HEADER.size
+
+        def section(dtype, count):
+            nonlocal offset
+            offset = _align(offset)
+            array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self.doc_ids = section(np.int64, doc_count)
+        self.doc_norms = section(np.float64, doc_count)
+        self.term_offsets = section(np.uint64, term_count + 1)
+        self.posting_offsets = section(np.uint64, term_count + 1)
+        self.weight_starts = section(np.uint64, term_count + 1)
+        self.weights = section(np.float64, posting_count)
+        self.terms_blob = section(np.uint8, int(self.term_offsets[-1]))
+        self.postings_blob = section(np.uint8, int(self.posting_offsets[-1]))
+
+        with np.errstate(divide='ignore'):
+            self.inverse_norms = np.where(self.doc_norms > 0, 1.0 / self.doc_norms, 0.0)
+
+    @property
+    def term_count(self) -> int:
+        return len(self.term_offsets) - 1
+
+    def term_at(self, index: int) -> bytes:
+        return self.terms_blob[int(self.term_offsets[index]):int(self.term_offsets[index + 1])].tobytes()
+
+    def find(self, term: str) -> int:
+        """
+        Vị trí của term trong từ điển (tìm nhị phân), -1 nếu không có.
+        """
+        key = term.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            mid = (low + high) // 2
+            if self.term_at(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low if low < self.term_count and self.term_at(low) == key else -1
+
+    def postings(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (cột document, trọng số) của term thứ index.
+        """
+        start, end = int(self.posting_offsets[index]), int(self.posting_offsets[index + 1])
+        cols = np.cumsum(decode_varints(self.postings_blob[start:end]))
+        return cols, self.weights[int(self.weight_starts[index]):int(self.weight_starts[index + 1])]
+
+    def all_postings(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Toàn bộ posting dạng (chỉ số term, cột document, trọng số), dùng khi merge.
+        """
+        # Mỗi term có ít nhất một posting; cộng dồn delta trên cả blob rồi trừ phần
+        # cộng dồn của các term đứng trước để được cột document của từng term
+        counts = np.diff(self.weight_starts.astype(np.int64))
+        rows = np.repeat(np.arange(self.term_count), counts)
+        totals = np.cumsum(decode_varints(self.postings_blob))
+        carried = np.zeros(self.term_count, dtype=np.int64)
+        carried[1:] = totals[self.weight_starts[1:-1].astype(np.int64) - 1]
+        return rows, totals - carried[rows], self.weights
+
+    def terms(self) -> np.ndarray:
+        return np.asarray(
+            [self.term_at(index).decode('utf-8') for index in range(self.term_count)],
+            dtype=str,
+        )
+
+
+def _documents_from_database(doc_ids=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (id, vector_norm) của các document đã index, doc_ids=None: toàn bộ corpus.
+    """
+    documents = Document.objects.filter(doc_length__gt=0)
+    if doc_ids is not None:
+        documents = documents.filter(id__in=doc_ids)
+    ids, norms = [], []
+    for doc_id, vector_norm in documents.values_list('id', 'vector_norm').iterator(chunk_size=10000):
+        ids.append(doc_id)
+        norms.append(vector_norm)
+    return np.asarray(ids, dtype=np.int64), np.asarray(norms, dtype=np.float64)
+
+
+def _postings_from_database(doc_ids):
+    """
+    Đọc document (id, vector_norm) và posting (term text, doc id, weight) của doc_ids từ Postgres.
+    """
+    ids, norms = _documents_from_database(doc_ids)
+    terms, docs, weights = [], [], []
+    rows = Posting.objects.filter(document_id__in=ids.tolist()).values_list('term__text', 'document_id', 'weight')
+    for term_text, doc_id, weight in rows.iterator(chunk_size=10000):
+        terms.append(term_text)
+        docs.append(doc_id)
+        weights.append(weight)
+    return ids, norms, terms, docs, weights
+
+
+class SegmentIndex:
+    """
+    Inverted index dạng segment trên đĩa (MEDIA_ROOT/index_segments), bật bằng
+    PLAGIARISM_INDEX_BACKEND = 'segments'. Bảng Term/Posting trong Postgres vẫn là nguồn
+    dữ liệu gốc, segment chỉ là bản sao để search nhanh và ít tốn bộ nhớ:
+    - manifest.json: danh sách segment từ cũ đến mới và id các document đã xoá.
+    - Mỗi document index xong được ghi thành một segment nhỏ; document có ở segment mới hơn
+      thì bản ở segment cũ bị bỏ qua, document đã xoá bị bỏ qua ở mọi segment.
+    - Số segment được giữ ở mức O(MERGE_FACTOR × log N) bằng merge theo tầng (merge(), gọi từ
+      add_documents, run_check_worker và manage.py merge_segments); rebuild() ghi lại toàn bộ
+      từ Postgres theo từng khối.
+    Ghi manifest được khoá bằng flock nên nhiều process có thể cùng cập nhật.
+    """
+
+    def __init__(self, directory: Path = None):
+        self._directory = directory
+        self._segments: list[Segment] = []
+        self._live: list[np.ndarray] = []
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> Path:
+        return Path(self._directory or Path(settings.MEDIA_ROOT) / SEGMENT_DIR)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    @contextmanager
+    def _locked(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / LOCK_NAME, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'generation': 0, 'segments': [], 'deleted': []}
+
+    def _write_manifest(self, manifest: dict):
+        temporary = self.directory / f"{MANIFEST_NAME}.{uuid.uuid4().hex}"
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, self.manifest_path)
+
+    def _temporary_path(self) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory / f"tmp-{uuid.uuid4().hex}.seg"
+
+    def _write_temporary(self, doc_ids, doc_norms, posting_terms, posting_docs, posting_weights) -> Path:
+        path = self._temporary_path()
+        write_segment(path, doc_ids, doc_norms, posting_terms, posting_docs, posting_weights)
+        return path
+
+    def _publish(self, manifest: dict, temporary: Path) -> str:
+        """
+        Đổi tên segment tạm thành segment-<generation>.seg (gọi khi đang giữ khoá).
+        """
+        manifest['generation'] += 1
+        name = f"segment-{manifest['generation']:08d}.seg"
+        os.replace(temporary, self.directory / name)
+        return name
+
+    def _replace(self, replaced: list[str], temporary: Path | None, cleared: set[int]):
+        """
+        Thay các segment replaced (một đoạn liên tiếp trong manifest) bằng segment mới
+        ở đúng vị trí đó; segment được thêm trong lúc merge vẫn đứng sau nên vẫn mới hơn.
+        """
+        with self._locked():
+            manifest = self.read_manifest()
+            segments = manifest['segments']
+            position = segments.index(replaced[0]) if replaced and replaced[0] in segments else 0
+            segments = [name for name in segments if name not in replaced]
+            if temporary is not None:
+                segments.insert(position, self._publish(manifest, temporary))
+            manifest['segments'] = segments
+            manifest['deleted'] = sorted(set(manifest['deleted']) - cleared)
+            self._write_manifest(manifest)
+
+        for name in replaced:
+            # Process khác đang map file cũ vẫn đọc được cho tới khi mở lại manifest
+            (self.directory / name).unlink(missing_ok=True)
+
+    def add_documents(self, doc_ids):
+        """
+        Ghi các document vừa index thành một segment mới rồi merge các tầng nhỏ đã đầy.
+        Chưa rebuild() lần nào thì bỏ qua.
+        """
+        if not self.exists():
+            return
+        doc_ids = set(doc_ids)
+        ids, norms, terms, docs, weights = _postings_from_database(doc_ids)
+        temporary = self._write_temporary(ids, norms, terms, docs, weights) if len(ids) else None
+        ids = set(ids.tolist())
+
+        with self._locked():
+            manifest = self.read_manifest()
+            if temporary is not None:
+                manifest['segments'].append(self._publish(manifest, temporary))
+            # Document không còn term nào (content rỗng) coi như đã xoá khỏi index
+            deleted = (set(manifest['deleted']) - ids) | (doc_ids - ids)
+            manifest['deleted'] = sorted(deleted)
+            self._write_manifest(manifest)
+        self.merge(max_docs=MAX_AUTO_MERGE_DOCS)
+
+    def delete_documents(self, doc_ids):
+        if not self.exists():
+            return
+        with self._locked():
+            manifest = self.read_manifest()
+            manifest['deleted'] = sorted(set(manifest['deleted']) | set(doc_ids))
+            self._write_manifest(manifest)
+
+    def rebuild(self):
+        """
+        Ghi toàn bộ corpus từ Postgres thành một segment duy nhất. Posting được đọc bằng
+        server-side cursor theo thứ tự (term, document) và ghi ra từng khối REBUILD_CHUNK posting.
+        """
+        manifest = self.read_manifest()
+        ids, norms = _documents_from_database()
+        # Collation "C": thứ tự byte UTF-8, giống thứ tự tìm nhị phân trong Segment.find
+        postings = (
+            Posting.objects.filter(document__doc_length__gt=0)
+            .order_by(Collate('term__text', 'C'), 'document_id')
+            .values_list('term__text', 'document_id', 'weight')
+            .iterator(chunk_size=10000)
+        )
+        temporary = self._temporary_path()
+        # Document index sau khi đã đọc danh sách document bị writer bỏ qua, segment riêng
+        # của nó (add_documents) vẫn nằm sau segment này trong manifest
+        with SegmentWriter(temporary, ids, norms) as writer:
+            while chunk := list(islice(postings, REBUILD_CHUNK)):
+                terms, docs, weights = zip(*chunk)
+                writer.add(list(terms), docs, weights)
+        # Segment/đánh dấu xoá phát sinh sau khi bắt đầu đọc Postgres được giữ lại
+        self._replace(manifest['segments'], temporary, set(manifest['deleted']))
+
+    @contextmanager
+    def _merging(self):
+        """
+        Chỉ một process merge tại một thời điểm; process khác đang merge thì trả về False.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / MERGE_LOCK_NAME, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _full_tier(self, names: list[str], max_docs: int = None) -> list[str]:
+        """
+        Các segment liên tiếp cùng tầng ở cuối manifest nếu đủ MERGE_FACTOR segment, ngược lại [].
+        """
+        run, tier = [], None
+        for name in reversed(names):
+            doc_count = segment_doc_count(self.directory / name)
+            if max_docs is not None and doc_count >= max_docs:
+                break
+            if tier is not None and segment_tier(doc_count) != tier:
+                break
+            tier = segment_tier(doc_count)
+            run.insert(0, name)
+        return run if len(run) >= MERGE_FACTOR else []
+
+    def merge(self, full: bool = False, max_docs: int = None) -> int:
+        """
+        Gộp theo tầng: lặp lại việc gộp MERGE_FACTOR segment liên tiếp cùng tầng ở cuối manifest
+        (bỏ qua segment từ max_docs document trở lên), hoặc gộp mọi segment nếu full=True.
+        Trả về số segment đã gộp (0 nếu process khác đang merge).
+        """
+        merged = 0
+        with self._merging() as acquired:
+            while acquired:
+                manifest = self.read_manifest()
+                names = manifest['segments'] if full else self._full_tier(manifest['segments'], max_docs)
+                if not names:
+                    break
+                self._merge_segments(manifest, names, full)
+                merged += len(names)
+                if full:
+                    break
+        return merged
+
+    def _merge_segments(self, manifest: dict, names: list[str], full: bool):
+        """
+        Gộp các segment names thành một, bỏ các bản cũ của document có ở segment mới hơn
+        và các document đã xoá.
+        """
+        deleted = np.asarray(manifest['deleted'], dtype=np.int64)
+        seen = deleted
+        ids, norms, terms, docs, weights = [], [], [], [], []
+        for name in reversed(names):
+            segment = Segment(self.directory / name)
+            live = ~np.isin(segment.doc_ids, seen)
+            seen = np.concatenate([seen, segment.doc_ids])
+            rows, cols, segment_weights = segment.all_postings()
+            keep = live[cols]
+            ids.append(segment.doc_ids[live])
+            norms.append(segment.doc_norms[live])
+            terms.append(segment.terms()[rows[keep]])
+            docs.append(segment.doc_ids[cols[keep]])
+            weights.append(segment_weights[keep])
+
+        merged_ids = np.concatenate(ids)
+        temporary = None
+        if len(merged_ids):
+            temporary = self._write_temporary(
+                merged_ids, np.concatenate(norms), np.concatenate(terms),
+                np.concatenate(docs), np.concatenate(weights),
+            )
+        # Chỉ bỏ được đánh dấu xoá khi mọi segment đều đã được gộp
+        self._replace(names, temporary, set(manifest['deleted']) if full else set())
+
+    def _manifest_mtime_ns(self):
+        try:
+            return self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _open(self):
+        """
+        Mở lại các segment khi manifest thay đổi; tính trước mặt nạ document còn hiệu lực.
+        Merge chạy song song có thể xoá segment cũ sau khi đọc manifest mà chưa kịp mở:
+        đọc lại manifest (đã trỏ sang segment mới) và thử lại.
+        """
+        mtime = self._manifest_mtime_ns()
+        with self._lock:
+            if mtime == self._manifest_mtime:
+                return self._segments, self._live
+            for attempt in range(OPEN_RETRIES):
+                manifest = self.read_manifest()
+                try:
+                    segments = [Segment(self.directory / name) for name in manifest['segments']]
+                    break
+                except FileNotFoundError:
+                    if attempt == OPEN_RETRIES - 1:
+                        raise
+                    mtime = self._manifest_mtime_ns()
+            live = []
+            seen = np.asarray(manifest['deleted'], dtype=np.int64)
+            for segment in reversed(segments):
+                live.insert(0, ~np.isin(segment.doc_ids, seen))
+                seen = np.concatenate([seen, segment.doc_ids])
+            self._segments, self._live, self._manifest_mtime = segments, live, mtime
+            return segments, live
+
+    def search(
+        self,
+        tokens: list[str],
+        top_n: int = 5,
+        exclude_doc_id: int = None,
+        strategy: str = 'exhaustive',
+    ) -> list[tuple[int, float]]:
+        """
+        Cosine similarity giữa query và corpus, cùng kết quả với TfidfEngine.search.
+        Với mỗi segment chỉ giải mã posting list của các term trong query (term-at-a-time)
+        và tính đủ score của mọi document: chỉ có strategy='exhaustive'.
+        """
+        if strategy != 'exhaustive':
+            raise ValueError(f"Unknown search strategy for segments: {strategy}")
+        if not tokens or top_n <= 0:
+            return []
+        q_tf = Counter(tokens)
+        q_len = len(tokens)
+        idf = idf_cache.bulk_idf(q_tf)
+        query = {term_text: freq / q_len * idf[term_text] for term_text, freq in q_tf.items()}
+        q_norm = math.sqrt(sum(weight * weight for weight in query.values()))
+        if q_norm == 0:
+            return []
+
+        found_ids, found_scores = [], []
+        segments, live = self._open()
+        for segment, segment_live in zip(segments, live):
+            scores = np.zeros(len(segment.doc_ids))
+            for term_text, q_weight in query.items():
+                index = segment.find(term_text)
+                if index >= 0:
+                    cols, weights = segment.postings(index)
+                    scores[cols] += weights * q_weight
+            scores *= segment.inverse_norms / q_norm
+            scores[~segment_live] = 0.0
+            if exclude_doc_id is not None:
+                scores[segment.doc_ids == exclude_doc_id] = 0.0
+            positive = np.flatnonzero(scores > 0)
+            found_ids.append(segment.doc_ids[positive])
+            found_scores.append(scores[positive])
+
+        if not found_ids:
+            return []
+        doc_ids, scores = np.concatenate(found_ids), np.concatenate(found_scores)
+        order = np.lexsort((doc_ids, -scores))[:top_n]
+        return [(int(doc_ids[i]), float(scores[i])) for i in order]
+
+
+segment_index = SegmentIndex()
+
+
+@receiver(post_delete, sender=Document)
+def delete_document_from_segments(sender, instance, **kwargs):
+    if segments_enabled():
+        doc_id = instance.id
+        transaction.on_commit(lambda: segment_index.delete_documents([doc_id]))
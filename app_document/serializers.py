@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from .dedup import file_sha256
 from .models import (
     Catalog,
+    CheckJob,
     DocumentType,
     Document,
     PlagiarismCheck
@@ -70,16 +72,13 @@ class DocumentSerializer(serializers.ModelSerializer):
                             'file_extension', 'uploaded_at']
 
     def get_plagiarism_percentage(self, obj):
-        latest_check = obj.checks.order_by('-checked_at').first()
-        if latest_check:
-            return latest_check.plagiarism_percentage
-        return None
-    
+        # Document.latest_check được cập nhật mỗi khi có PlagiarismCheck mới (xem models.py)
+        if obj.latest_check_id is None:
+            return None
+        return obj.latest_plagiarism_percentage
+
     def get_plagiarism_check_id(self, obj):
-        latest_check = obj.checks.order_by('-checked_at').first()
-        if latest_check:
-            return latest_check.id
-        return None
+        return obj.latest_check_id
 
     def create(self, validated_data):
         """
@@ -92,6 +91,7 @@ class DocumentSerializer(serializers.ModelSerializer):
             name, ext = os.path.splitext(filename)
             validated_data['original_filename'] = filename
             validated_data['file_extension'] = ext.lower()
+            validated_data['content_hash'] = file_sha256(uploaded_file)
 
         # Nếu bạn muốn tự tính doc_length dựa vào content (hãy chắc content đã được set sẵn)
         content = validated_data.get('content', '')
@@ -110,15 +110,27 @@ class DocumentSerializer(serializers.ModelSerializer):
             name, ext = os.path.splitext(filename)
             validated_data['original_filename'] = filename
             validated_data['file_extension'] = ext.lower()
+            validated_data['content_hash'] = file_sha256(uploaded_file)
 
-        # Cập nhật doc_length nếu content thay đổi
+        # Cập nhật doc_length nếu content thay đổi, token đã lưu không còn đúng
         if 'content' in validated_data:
             validated_data['doc_length'] = len(
                 validated_data.get('content', ''))
+            validated_data['token_stream'] = None
 
         return super().update(instance, validated_data)
 
 
+class DocumentListSerializer(DocumentSerializer):
+    """
+    Dùng cho danh sách document: không trả về content (có thể rất dài).
+    """
+
+    class Meta(DocumentSerializer.Meta):
+        fields = [field for field in DocumentSerializer.Meta.fields if field != 'content']
+        read_only_fields = fields
+
+
 class DocumentUploadSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
 
@@ -129,7 +141,7 @@ class DocumentUploadSerializer(serializers.ModelSerializer):
 class PlagiarismCheckSerializer(serializers.ModelSerializer):
     document_title = serializers.CharField(
         source='document.title', read_only=True)
-    matched_percent = serializers.SerializerMethodField()
+    matched_percent = serializers.FloatField(source='max_matched_percent', read_only=True)
 
     class Meta:
         model = PlagiarismCheck
@@ -142,10 +154,25 @@ class PlagiarismCheckSerializer(serializers.ModelSerializer):
             'matched_percent',
         ]
 
-    def get_matched_percent(self, obj):
-        if not obj.duplicate_sources:
-            return 0.0
-        try:
-            return max(src.get('matched_percent', 0) for src in obj.duplicate_sources)
-        except Exception:
-            return 0.0
+
+class CheckJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+
+    class Meta:
+        model = CheckJob
+        fields = [
+            'job_id',
+            'document_id',
+            'file_name',
+            'kind',
+            'status',
+            'stage',
+            'progress',
+            'result',
+            'error',
+            'created_at',
+            'started_at',
+            'heartbeat_at',
+            'finished_at',
+        ]
+        read_only_fields = fields
@@ -0,0 +1,70 @@
+import threading
+
+from django.db import transaction
+
+from .models import CorpusVersion, Term
+
+
+# Số bản ghi tối đa trong một câu lệnh INSERT khi bulk_create
+BULK_BATCH_SIZE = 2000
+
+
+class TermDictionary:
+    """
+    Cache text → Term.id trong bộ nhớ của worker process.
+    Term không bị xoá nên id của một term chỉ có thể đổi khi bảng Term được dựng lại
+    (manage.py reindex tăng CorpusVersion.term_generation): mỗi lần lookup so generation
+    với database và bỏ toàn bộ cache nếu đã khác. Id mới chỉ được đưa vào cache khi
+    transaction tạo ra nó đã commit (transaction bị rollback thì id đó không tồn tại).
+    """
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.generation = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.ids = {}
+
+    def sync(self):
+        generation = CorpusVersion.current_term_generation()
+        if generation != self.generation:
+            with self._lock:
+                self.ids = {}
+                self.generation = generation
+
+    def _remember(self, found: dict[str, int]):
+        with self._lock:
+            self.ids.update(found)
+
+    def lookup(self, terms, create: bool = False) -> dict[str, int]:
+        """
+        Id của các term. Term chưa có trong database bị bỏ qua,
+        hoặc được tạo mới (INSERT ... ON CONFLICT DO NOTHING) nếu create=True.
+        """
+        self.sync()
+        ids = self.ids
+        result = {}
+        missing = []
+        for term_text in terms:
+            term_id = ids.get(term_text)
+            if term_id is None:
+                missing.append(term_text)
+            else:
+                result[term_text] = term_id
+
+        if missing:
+            if create:
+                Term.objects.bulk_create(
+                    [Term(text=term_text) for term_text in missing],
+                    ignore_conflicts=True,
+                    batch_size=BULK_BATCH_SIZE,
+                )
+            found = dict(Term.objects.filter(text__in=missing).values_list('text', 'id'))
+            result.update(found)
+            transaction.on_commit(lambda: self._remember(found))
+        return result
+
+
+term_dictionary = TermDictionary()
@@ -1,3 +1,697 @@
-from django.test import TestCase
+import io
+import multiprocessing
+import random
+import signal
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from reportlab.pdfgen.canvas import Canvas
+from rest_framework.test import APIClient
+
+from . import export, utils
+from .alignment import coverage, difflib_matching_blocks, get_matching_blocks, seed_matching_blocks
+from .engine import TfidfEngine
+from .executors import terminate_executor
+from .fingerprint import KGRAM_SIZE, winnow
+from .highlight import check_highlights, iter_highlight_html, merge_highlights, pack_spans, text_hash, unpack_spans
+from .idf import IdfCache
+from .management.commands.benchmark import generate_text
+from .dedup import file_sha256
+from .models import CheckJob, CorpusVersion, Document, PlagiarismCheck
+from .pipeline import (
+    _prepared_result, _submit_prepare, check_uploaded_files, claim_next_job, find_sources, requeue_stale_jobs,
+    submit_check_jobs,
+)
+from .plagiarism import index_document, preprocess, reweight_index
+from .segments import Segment, SegmentIndex, decode_varints, encode_varints, write_segment
+from .tokens import decode_tokens, encode_tokens
+from .utils import PDF_PARALLEL_MIN_PAGES, extract_text_from_file, iter_extract_text
+
+
+class TokenStreamTests(SimpleTestCase):
+
+    def test_roundtrip(self):
+        tokens = ["học_sinh", "đi", "học", "đi", "về", "học_sinh", "."]
+        self.assertEqual(decode_tokens(encode_tokens(tokens)), tokens)
+        self.assertEqual(decode_tokens(encode_tokens([])), [])
+
+    def test_large_vocabulary_uses_wide_ids(self):
+        tokens = [f"t{i}" for i in range(70000)] + ["t5", "t69999"]
+        self.assertEqual(decode_tokens(encode_tokens(tokens)), tokens)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            decode_tokens(b"\x09" + encode_tokens(["a"])[1:])
+
+
+class TxtExtractionTests(SimpleTestCase):
+    """
+    Kết quả phải giống giải mã cả file một lần: UTF-8, lỗi thì latin-1 cho toàn bộ file.
+    """
+
+    @staticmethod
+    def whole_file(data: bytes) -> str:
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return data.decode('latin-1', errors='ignore')
+
+    def extract(self, data: bytes, chunk_size: int = 64 * 1024) -> list[str]:
+        uploaded = File(io.BytesIO(data), name="a.txt")
+        uploaded.DEFAULT_CHUNK_SIZE = chunk_size
+        return list(iter_extract_text(uploaded))
+
+    def test_valid_utf8_split_across_chunks(self):
+        data = "Tiếng Việt có dấu.\n".encode('utf-8') * 500
+        parts = self.extract(data, chunk_size=7)
+        self.assertGreater(len(parts), 1)
+        self.assertEqual("".join(parts), self.whole_file(data))
+
+    def test_invalid_byte_after_first_chunk(self):
+        data = "Dòng đầu hợp lệ.\n".encode('utf-8') * 100 + b"\xff cu\xe1\xbb\x91i\n"
+        self.assertEqual("".join(self.extract(data, chunk_size=64)), self.whole_file(data))
+
+    def test_long_line_is_flushed_at_whitespace(self):
+        data = " ".join(["từ"] * 5000).encode('utf-8') + "x".encode('utf-8') * 3000
+        with mock.patch('app_document.utils.TXT_MAX_PENDING_CHARS', 1000):
+            parts = self.extract(data, chunk_size=256)
+        self.assertEqual("".join(parts), self.whole_file(data))
+        self.assertLessEqual(max(len(part) for part in parts), 1000 + 256)
+        # Cắt ở khoảng trắng, không cắt đôi từ; phần không có khoảng trắng cắt tại ngưỡng
+        words = [part for part in parts if "x" not in part]
+        self.assertGreater(len(words), 1)
+        self.assertTrue(all(part.endswith(" ") for part in words))
+
+    def test_truncated_multibyte_sequence_at_end(self):
+        self.assertEqual(extract_text_from_file(SimpleUploadedFile("a.txt", b"abc\xe1\xbb")), 'abcá»')
+
+
+class PdfUploadTests(SimpleTestCase):
+    """
+    PDF nhiều trang upload lên được chia lô trang cho pool từ process chính.
+    """
+
+    @staticmethod
+    def make_pdf(page_count: int) -> bytes:
+        output = io.BytesIO()
+        canvas = Canvas(output)
+        for number in range(page_count):
+            canvas.drawString(72, 720, f"page{number}")
+            canvas.showPage()
+        canvas.save()
+        return output.getvalue()
+
+    def test_large_pdf_is_split_into_page_batches(self):
+        page_count = PDF_PARALLEL_MIN_PAGES + 5
+        uploaded = SimpleUploadedFile("a.pdf", self.make_pdf(page_count))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            future, pdf_pages = _submit_prepare(executor, uploaded)
+            self.assertIsNone(future)
+            self.assertGreater(len(pdf_pages), 1)
+            text, tokens = _prepared_result(future, pdf_pages)
+        self.assertEqual(text.split(), [f"page{number}" for number in range(page_count)])
+        self.assertTrue(tokens)
+
+    def test_small_pdf_is_extracted_whole(self):
+        uploaded = SimpleUploadedFile("a.pdf", self.make_pdf(3))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            future, pdf_pages = _submit_prepare(executor, uploaded)
+            self.assertIsNone(pdf_pages)
+            text, _ = _prepared_result(future, pdf_pages)
+        self.assertEqual(text.split(), ["page0", "page1", "page2"])
+
+
+class PdfPageTimeoutTests(SimpleTestCase):
+
+    def test_alarm_just_before_cancel_only_loses_the_page(self):
+        page = mock.Mock()
+        page.extract_text.return_value = "trang"
+        real_setitimer = signal.setitimer
+
+        def setitimer(which, seconds):
+            real_setitimer(which, seconds)
+            if seconds == 0 and not setitimer.fired:
+                setitimer.fired = True
+                raise utils._PageTimeout()
+
+        setitimer.fired = False
+        with mock.patch('app_document.utils.signal.setitimer', setitimer):
+            self.assertEqual(utils._extract_page(page, timeout=5), "")
+        self.assertEqual(signal.getsignal(signal.SIGALRM), signal.SIG_DFL)
+
+    def test_terminate_stuck_workers(self):
+        executor = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('fork'))
+        futures = [executor.submit(time.sleep, 60) for _ in range(3)]
+        while not any(future.running() for future in futures):
+            time.sleep(0.01)
+        processes = list(executor._processes.values())
+        started = time.monotonic()
+        terminate_executor(executor)
+        for process in processes:
+            process.join(5)
+            self.assertFalse(process.is_alive())
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class WinnowTests(SimpleTestCase):
+
+    @staticmethod
+    def brute_force(hashes, window):
+        """
+        Định nghĩa gốc: minimum bên phải nhất của từng cửa sổ, bỏ lần chọn trùng liên tiếp.
+        """
+        if len(hashes) <= window:
+            windows = [range(len(hashes))] if hashes else []
+        else:
+            windows = [range(start, start + window) for start in range(len(hashes) - window + 1)]
+        fingerprints = []
+        for positions in windows:
+            position = min(positions, key=lambda i: (hashes[i], -i))
+            if not fingerprints or fingerprints[-1][1] != position:
+                fingerprints.append((hashes[position], position))
+        return fingerprints
+
+    def test_matches_brute_force(self):
+        rng = random.Random(5)
+        for _ in range(300):
+            hashes = [rng.randint(-5, 5) for _ in range(rng.randint(0, 40))]
+            window = rng.randint(1, 6)
+            self.assertEqual(winnow(hashes, window), self.brute_force(hashes, window), (hashes, window))
+
+
+class AlignmentTests(SimpleTestCase):
+
+    def test_seed_blocks_are_exact_and_cover_like_difflib(self):
+        for seed in range(5):
+            rng = random.Random(seed)
+            source = generate_text(400, 300, seed=seed)
+            words = source.split()
+            # Chép lại vài đoạn của nguồn xen với văn bản khác
+            parts = []
+            for k in range(6):
+                start = rng.randrange(len(words) - 30)
+                parts.append(" ".join(words[start:start + rng.randint(10, 30)]))
+                parts.append(generate_text(20, 300, seed=100 + seed * 10 + k))
+            text = " ".join(parts)
+
+            seed_blocks = seed_matching_blocks(text, source, threshold=10)
+            difflib_blocks = difflib_matching_blocks(text, source, threshold=10)
+            for i, j, size in seed_blocks:
+                self.assertEqual(text[i:i + size], source[j:j + size])
+            self.assertEqual(seed_blocks, sorted(seed_blocks))
+            self.assertTrue(all(
+                a[0] + a[2] <= b[0] for a, b in zip(seed_blocks, seed_blocks[1:])
+            ))
+            seed_coverage = coverage((i, i + size) for i, _, size in seed_blocks)
+            difflib_coverage = coverage((i, i + size) for i, _, size in difflib_blocks)
+            self.assertGreaterEqual(seed_coverage, difflib_coverage)
+
+    def test_short_texts(self):
+        self.assertEqual(seed_matching_blocks("một hai", "một hai"), [])
+
+    def test_method_from_settings(self):
+        text = generate_text(200, 300, seed=1)
+        source = generate_text(100, 300, seed=2) + " " + text[:400]
+        with override_settings(PLAGIARISM_ALIGNMENT_METHOD='difflib'):
+            self.assertEqual(get_matching_blocks(text, source), difflib_matching_blocks(text, source))
+        with override_settings(PLAGIARISM_ALIGNMENT_METHOD='seed'):
+            self.assertEqual(get_matching_blocks(text, source), seed_matching_blocks(text, source))
+        with override_settings(PLAGIARISM_ALIGNMENT_METHOD='other'):
+            with self.assertRaises(ValueError):
+                get_matching_blocks(text, source)
+
+
+class HighlightTests(SimpleTestCase):
+
+    def test_pack_unpack_spans(self):
+        highlights = [(30, 40, 7, 55.0), (0, 10, None, 10.0), (2 ** 32 - 2, 2 ** 32 - 1, 2 ** 31, 0)]
+        self.assertEqual(
+            unpack_spans(pack_spans(highlights)),
+            [(0, 10, None), (30, 40, 7), (2 ** 32 - 2, 2 ** 32 - 1, 2 ** 31)],
+        )
+        self.assertEqual(unpack_spans(pack_spans([])), [])
+        self.assertEqual(unpack_spans(None), [])
+
+    def test_merge_highlights(self):
+        merged = merge_highlights([(5, 12, 2, 60), (0, 6, 1, 20), (20, 25, 3, 10), (24, 40, 4, 5)], 30)
+        self.assertEqual(merged, [(0, 12, 2, 60), (20, 30, 3, 10)])
+
+    def test_iter_highlight_html_escapes_text(self):
+        text = 'a < b & "c" <script>alert(1)</script> d'
+        start = text.index('<script>')
+        highlights = merge_highlights([(start, start + 8, 3, 90)], len(text))
+        html = "".join(iter_highlight_html(text, highlights))
+        self.assertNotIn('<script>', html)
+        self.assertIn('a &lt; b &amp; "c" ', html)
+        self.assertIn('data-source="3">&lt;script&gt;</span>', html)
+        self.assertTrue(html.endswith('alert(1)&lt;/script&gt; d'))
+
+
+class SegmentFormatTests(SimpleTestCase):
+
+    def test_varint_roundtrip(self):
+        values = np.array([0, 1, 127, 128, 255, 300, 16383, 16384, 2 ** 32, 2 ** 56 - 1, 5], dtype=np.int64)
+        blob, sizes = encode_varints(values)
+        self.assertEqual(len(blob), int(sizes.sum()))
+        self.assertEqual(decode_varints(np.frombuffer(blob, dtype=np.uint8)).tolist(), values.tolist())
+        self.assertEqual(len(decode_varints(np.empty(0, dtype=np.uint8))), 0)
+
+    def test_segment_roundtrip(self):
+        rng = random.Random(3)
+        doc_ids = [40, 3, 17, 8]
+        postings = {
+            (term, doc_id): rng.random()
+            for term in ["b", "a", "ạ", "học", "z"]
+            for doc_id in doc_ids
+            if rng.random() < 0.6
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "test.seg"
+            write_segment(
+                path, doc_ids, [1.0, 2.0, 3.0, 4.0],
+                [term for term, _ in postings], [doc_id for _, doc_id in postings], list(postings.values()),
+            )
+            segment = Segment(path)
+            self.assertEqual(segment.doc_ids.tolist(), sorted(doc_ids))
+            self.assertEqual(segment.doc_norms.tolist(), [2.0, 4.0, 3.0, 1.0])
+            found = {}
+            for term in {term for term, _ in postings}:
+                index = segment.find(term)
+                self.assertGreaterEqual(index, 0)
+                cols, weights = segment.postings(index)
+                found.update({(term, int(segment.doc_ids[col])): weight for col, weight in zip(cols, weights)})
+            self.assertEqual(found, postings)
+            self.assertEqual(segment.find("không có"), -1)
+            del segment
+
+    def test_open_retries_when_merge_removes_a_segment(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = SegmentIndex(Path(directory))
+            write_segment(Path(directory) / "segment-00000002.seg", [5], [1.0], ["a"], [5], [1.0])
+            current = {'generation': 2, 'segments': ["segment-00000002.seg"], 'deleted': []}
+            index._write_manifest(current)
+            # Lần đọc đầu thấy manifest cũ, segment trong đó đã bị merge xoá
+            manifests = iter([{'generation': 1, 'segments': ["segment-00000001.seg"], 'deleted': []}])
+            with mock.patch.object(index, 'read_manifest', side_effect=lambda: next(manifests, current)):
+                segments, _ = index._open()
+            self.assertEqual([segment.doc_ids.tolist() for segment in segments], [[5]])
+            del segments
+            index._segments = []
+
+    def test_unsupported_strategy(self):
+        with self.assertRaises(ValueError):
+            SegmentIndex(Path("/không/có")).search(["a"], strategy='maxscore')
+
+
+class TfidfEngineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(30):
+            document = Document.objects.create(
+                title=f"doc {i}",
+                file=f"documents/doc{i}.txt",
+                content=generate_text(150 + 10 * i, 400, seed=i % 4) + " " + generate_text(50, 400, seed=i),
+            )
+            index_document(document, preprocess(document.content))
+        # Trọng số của các document đầu được tính khi N còn nhỏ
+        reweight_index()
+
+    def setUp(self):
+        patcher = mock.patch('app_document.engine.idf_cache', IdfCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = TfidfEngine.build(CorpusVersion.current(), CorpusVersion.current_term_generation())
+
+    def test_maxscore_matches_exhaustive(self):
+        for seed in range(8):
+            tokens = preprocess(generate_text(80, 400, seed=seed))
+            for top_n in (1, 5, 50):
+                exhaustive = self.engine.search(tokens, top_n=top_n, strategy='exhaustive')
+                maxscore = self.engine.search(tokens, top_n=top_n, strategy='maxscore')
+                self.assertEqual(len(maxscore), len(exhaustive))
+                np.testing.assert_allclose([score for _, score in maxscore], [score for _, score in exhaustive])
+                self.assertEqual(
+                    {doc_id for doc_id, _ in maxscore}, {doc_id for doc_id, _ in exhaustive}
+                )
+
+    def test_exclude_document(self):
+        document = Document.objects.order_by('id').first()
+        tokens = preprocess(document.content)
+        self.assertIn(document.id, [doc_id for doc_id, _ in self.engine.search(tokens, top_n=50)])
+        for strategy in ('exhaustive', 'maxscore'):
+            results = self.engine.search(tokens, top_n=50, exclude_doc_id=document.id, strategy=strategy)
+            self.assertNotIn(document.id, [doc_id for doc_id, _ in results])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            self.engine.search(preprocess(generate_text(20, 400, seed=1)), strategy='other')
+
+    def test_zero_top_n(self):
+        tokens = preprocess(generate_text(80, 400, seed=1))
+        for strategy in ('exhaustive', 'maxscore'):
+            self.assertEqual(self.engine.search(tokens, top_n=0, strategy=strategy), [])
+
+
+class TfidfEngineNegativeIdfTests(TestCase):
+    """
+    Term có trong mọi document có IDF âm; trọng số lưu lúc N còn nhỏ có thể khác dấu với IDF
+    hiện tại nên term đó làm giảm score. MaxScore vẫn phải cho cùng kết quả với exhaustive.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('app_document.engine.idf_cache', IdfCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self, corpus):
+        for i, tokens in enumerate(corpus):
+            document = Document.objects.create(title=f"doc {i}", file=f"documents/doc{i}.txt", content=" ".join(tokens))
+            index_document(document, tokens)
+        return TfidfEngine.build(CorpusVersion.current(), CorpusVersion.current_term_generation())
+
+    def test_maxscore_matches_exhaustive(self):
+        # "chung" có trong mọi document lúc index 3 document đầu (trọng số âm), sau đó thì không
+        engine = self.build(
+            [["chung", "một"], ["chung", "hai"], ["chung"] * 3 + ["hiếm"] * 2]
+            + [[f"khác{i}"] for i in range(7)]
+            + [["chung"] * 3]
+        )
+        for tokens in (["hiếm", "chung"], ["hiếm", "chung", "chung"], ["hiếm"] + ["chung"] * 4):
+            for top_n in range(1, 4):
+                exhaustive = engine.search(tokens, top_n=top_n, strategy='exhaustive')
+                maxscore = engine.search(tokens, top_n=top_n, strategy='maxscore')
+                self.assertEqual(
+                    sorted(doc_id for doc_id, _ in maxscore), sorted(doc_id for doc_id, _ in exhaustive)
+                )
+                np.testing.assert_allclose([score for _, score in maxscore], [score for _, score in exhaustive])
+
+    def test_term_in_every_document(self):
+        engine = self.build([["chung", f"riêng{i}"] + ["chung"] * i for i in range(5)])
+        for top_n in range(1, 6):
+            self.assertEqual(
+                engine.search(["chung", "riêng0", "riêng4"], top_n=top_n, strategy='maxscore'),
+                engine.search(["chung", "riêng0", "riêng4"], top_n=top_n, strategy='exhaustive'),
+            )
+
+
+class CandidateSourceTests(TestCase):
+    """
+    Chỉ căn chỉnh với nguồn có chung đoạn chép nguyên văn (fingerprint), không chỉ giống chủ đề.
+    """
+
+    def setUp(self):
+        for target, value in (('app_document.engine.idf_cache', IdfCache()), ('app_document.engine._engine', None)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.source_tokens = preprocess(generate_text(200, 400, seed=1))
+        shuffled_tokens = list(self.source_tokens)
+        random.Random(0).shuffle(shuffled_tokens)
+        self.copied = self.create("nguồn", self.source_tokens)
+        # Cùng TF với nguồn nên cùng cosine với query, nhưng không có đoạn nào trùng nguyên văn
+        self.topical = self.create("cùng chủ đề", shuffled_tokens)
+        for seed in range(2, 8):
+            self.create(f"khác {seed}", preprocess(generate_text(200, 400, seed=seed)))
+        reweight_index()
+
+    def create(self, title, tokens):
+        content = " ".join(tokens)
+        document = Document.objects.create(title=title, file="documents/doc.txt", content=content, doc_length=len(content))
+        index_document(document, tokens)
+        return document
+
+    def find(self, tokens):
+        content = " ".join(tokens)
+        document = Document.objects.create(title="query", file="documents/query.txt", content=content, doc_length=len(content))
+        return [source for source, _ in find_sources(document, document.content, tokens=tokens)]
+
+    def test_topical_source_is_pruned(self):
+        sources = self.find(self.source_tokens[50:100] + preprocess(generate_text(100, 400, seed=9)))
+        self.assertIn(self.copied, sources)
+        self.assertNotIn(self.topical, sources)
+
+    def test_short_query_keeps_tfidf_sources(self):
+        sources = self.find(self.source_tokens[:KGRAM_SIZE - 1])
+        self.assertIn(self.copied, sources)
+        self.assertIn(self.topical, sources)
+
+
+class DocumentCursorPaginationTests(TestCase):
+    """
+    Phân trang theo cột có rất nhiều giá trị trùng (nhiều hơn offset_cutoff = 1000 của DRF).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Document.objects.bulk_create([
+            Document(
+                title=f"doc {i}",
+                file=f"documents/doc{i}.txt",
+                publication_year=None if i % 3 == 0 else 2000 + i % 7,
+            )
+            for i in range(1250)
+        ])
+        cls.ids = set(Document.objects.values_list('id', flat=True))
+
+    def _walk(self, url, link='next'):
+        client = APIClient()
+        seen = []
+        while url and len(seen) <= len(self.ids):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data[link]
+        return seen
+
+    def test_ties_page_forward_without_repeats(self):
+        seen = self._walk('/api/documents/?ordering=latest_plagiarism_percentage&page_size=100')
+        self.assertEqual(len(seen), len(self.ids))
+        self.assertEqual(set(seen), self.ids)
+        self.assertEqual(seen, sorted(seen))
+
+    def _walk_back(self, url):
+        """
+        Đi hết các trang tới trang cuối rồi theo link previous về trang đầu.
+        """
+        client = APIClient()
+        data, pages = client.get(url).data, 1
+        while data['next'] and pages <= len(self.ids) // 100:
+            data, pages = client.get(data['next']).data, pages + 1
+        seen = [item['id'] for item in data['results']]
+        while data['previous'] and len(seen) < len(self.ids):
+            data = client.get(data['previous']).data
+            seen = [item['id'] for item in data['results']] + seen
+        return seen
+
+    def test_ties_page_backward(self):
+        url = '/api/documents/?ordering=-latest_plagiarism_percentage&page_size=100'
+        self.assertEqual(self._walk_back(url), self._walk(url))
+
+    def test_nullable_ordering_field(self):
+        for ordering in ('publication_year', '-publication_year'):
+            expected = list(
+                Document.objects.order_by(ordering, ordering.replace('publication_year', 'id'))
+                .values_list('id', flat=True)
+            )
+            url = f'/api/documents/?ordering={ordering}&page_size=100'
+            self.assertEqual(self._walk(url), expected)
+            self.assertEqual(self._walk_back(url), expected)
+
+    def test_invalid_cursor(self):
+        response = APIClient().get('/api/documents/?cursor=cD1ub3QtanNvbg%3D%3D')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StaleCheckTests(TestCase):
+    """
+    Offset highlight của một lần kiểm tra không còn dùng được khi content bị sửa sau đó.
+    """
+
+    def setUp(self):
+        text = "Đoạn đầu giống nguồn.\nĐoạn sau thì không."
+        self.document = Document.objects.create(title="doc", file="documents/doc.txt", content=text)
+        self.check = PlagiarismCheck.objects.create(
+            document=self.document,
+            plagiarism_percentage=50,
+            duplicate_sources=[{"source_id": 7, "matched_percent": 50}],
+            highlight_spans=pack_spans([(0, 21, 7)]),
+            text_hash=text_hash(text),
+        )
+        self.detail_url = f'/documents/{self.document.id}/check/{self.check.id}/detail/'
+        self.report_url = f'/documents/{self.document.id}/check/{self.check.id}/report/'
+
+    def test_fresh_check(self):
+        self.assertEqual(check_highlights(self.check), [(0, 21, 7, 50)])
+        data = APIClient().get(self.detail_url).json()
+        self.assertFalse(data['stale'])
+        self.assertEqual(data['highlights'], [{"start": 0, "end": 21}])
+
+    def test_edited_content_marks_check_stale(self):
+        Document.objects.filter(id=self.document.id).update(content="Nội dung đã viết lại hoàn toàn.")
+        self.check.refresh_from_db()
+        self.assertEqual(check_highlights(self.check), [])
+
+        data = APIClient().get(self.detail_url).json()
+        self.assertTrue(data['stale'])
+        self.assertEqual(data['highlights'], [])
+        self.assertNotIn('<span', data['html_content'])
+
+        response = APIClient().get(self.report_url)
+        self.assertEqual(response['X-Check-Stale'], '1')
+        self.assertNotIn('<span', b"".join(response.streaming_content).decode())
+
+    def test_reupload_after_stale_check_queues_new_job(self):
+        data = "Đoạn đầu giống nguồn.".encode('utf-8')
+        content_hash = file_sha256(SimpleUploadedFile("a.txt", data))
+        Document.objects.filter(id=self.document.id).update(content_hash=content_hash)
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            [job] = submit_check_jobs([SimpleUploadedFile("a.txt", data)])
+            self.assertEqual(job.status, CheckJob.STATUS_DONE)
+            self.assertEqual(job.document_id, self.document.id)
+
+            Document.objects.filter(id=self.document.id).update(content="Nội dung đã viết lại hoàn toàn.")
+            [job] = submit_check_jobs([SimpleUploadedFile("a.txt", data)])
+            self.assertEqual(job.status, CheckJob.STATUS_PENDING)
+            self.assertNotEqual(job.document_id, self.document.id)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UploadBatchDuplicateTests(TestCase):
+    """
+    File trùng nội dung trong cùng một lần upload chỉ được kiểm tra một lần.
+    """
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media_root.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.data = generate_text(200, 400, seed=5).encode('utf-8')
+
+    def test_check_uploaded_files(self):
+        results = check_uploaded_files([
+            SimpleUploadedFile("a.txt", self.data),
+            SimpleUploadedFile("b.txt", generate_text(200, 400, seed=6).encode('utf-8')),
+            SimpleUploadedFile("a-copy.txt", self.data),
+        ], max_workers=1)
+        self.assertEqual([result["file_name"] for result in results], ["a.txt", "b.txt", "a-copy.txt"])
+        self.assertNotIn("error", results[0])
+        self.assertEqual(results[2]["plagiarism_check_id"], results[0]["plagiarism_check_id"])
+        self.assertEqual(Document.objects.count(), 2)
+        self.assertEqual(PlagiarismCheck.objects.count(), 2)
+
+    def test_submit_check_jobs(self):
+        jobs = submit_check_jobs([SimpleUploadedFile("a.txt", self.data), SimpleUploadedFile("a-copy.txt", self.data)])
+        self.assertEqual(jobs[0].id, jobs[1].id)
+        self.assertEqual(CheckJob.objects.count(), 1)
+        self.assertEqual(Document.objects.count(), 1)
+
+
+class CheckJobQueueTests(TestCase):
+
+    def setUp(self):
+        self.document = Document.objects.create(title="doc", file="documents/doc.txt")
+
+    def test_claim_sets_heartbeat(self):
+        CheckJob.objects.create(document=self.document, file_name="doc.txt")
+        job = claim_next_job()
+        self.assertEqual(job.status, CheckJob.STATUS_RUNNING)
+        self.assertEqual(job.heartbeat_at, job.started_at)
+
+    def test_requeue_by_heartbeat_not_start_time(self):
+        now = timezone.now()
+        long_running = CheckJob.objects.create(
+            document=self.document, file_name="a.txt", status=CheckJob.STATUS_RUNNING,
+            started_at=now - timedelta(hours=2), heartbeat_at=now - timedelta(minutes=1),
+        )
+        silent = CheckJob.objects.create(
+            document=self.document, file_name="b.txt", status=CheckJob.STATUS_RUNNING,
+            started_at=now - timedelta(hours=2), heartbeat_at=now - timedelta(hours=1),
+        )
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=30)), 1)
+        long_running.refresh_from_db()
+        silent.refresh_from_db()
+        self.assertEqual(long_running.status, CheckJob.STATUS_RUNNING)
+        self.assertEqual(silent.status, CheckJob.STATUS_PENDING)
+        self.assertIsNone(silent.heartbeat_at)
+
+
+class ExportTests(TestCase):
+
+    def test_missing_configured_font(self):
+        with mock.patch.object(export, '_font_name', None), \
+                override_settings(PDF_EXPORT_FONT='/không/có/font.ttf'):
+            with self.assertRaises(ImproperlyConfigured):
+                export.export_font()
+
+    def test_warns_without_unicode_font(self):
+        with mock.patch.object(export, '_font_name', None), \
+                mock.patch.object(export, 'FONT_CANDIDATES', ['/không/có/font.ttf']), \
+                override_settings(PDF_EXPORT_FONT=''):
+            with self.assertLogs('app_document.export', 'WARNING'):
+                self.assertEqual(export.export_font(), export.FALLBACK_FONT_NAME)
+
+    def test_pdf_is_written_atomically(self):
+        document = Document.objects.create(title="doc", file="documents/doc.txt", content="Đoạn một.\nĐoạn hai.")
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            name = export.write_document_pdf(document)
+            directory = Path(media_root) / export.EXPORT_DIR / str(document.id)
+            self.assertEqual(sorted(path.name for path in directory.iterdir()), ["0.pdf"])
+            with export.exported_pdf(document) as pdf:
+                self.assertTrue(pdf.read().startswith(b"%PDF"))
+            self.assertEqual(name, export.export_name(document.id, None))
+
+            with mock.patch.object(export, 'build_document_pdf', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    export.write_document_pdf(document)
+            # File cũ còn nguyên, file tạm đã được dọn
+            self.assertEqual(sorted(path.name for path in directory.iterdir()), ["0.pdf"])
+
+    def test_streamed_build_gives_same_pdf(self):
+        content = "\n".join(generate_text(60, 400, seed=i) for i in range(300))
+        document = Document.objects.create(title="doc", file="documents/doc.txt", content=content)
+        outputs = {}
+        with mock.patch('reportlab.rl_config.invariant', 1):
+            for name, flowables, canvas in (
+                ('list', list, Canvas),
+                ('lazy', export.LazyFlowables, export.CompressingCanvas),
+            ):
+                output = io.BytesIO()
+                with mock.patch.object(export, 'LazyFlowables', flowables), \
+                        mock.patch.object(export, 'CompressingCanvas', canvas):
+                    export.build_document_pdf(document, None, output)
+                outputs[name] = output.getvalue()
+        self.assertEqual(outputs['lazy'], outputs['list'])
+
+    def test_lazy_flowables_buffer(self):
+        pulled = []
+
+        def source():
+            for i in range(1000):
+                pulled.append(i)
+                yield i
+
+        flowables = export.LazyFlowables(source(), buffer_size=10)
+        self.assertEqual(len(flowables), 10)
+        self.assertEqual(len(pulled), 10)
+        drained = []
+        while len(flowables):
+            self.assertLessEqual(list.__len__(flowables), 10)
+            drained.append(flowables[0])
+            del flowables[0]
+        self.assertEqual(drained, list(range(1000)))
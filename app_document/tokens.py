@@ -0,0 +1,51 @@
+import struct
+import sys
+from array import array
+
+
+# Byte đầu tiên của Document.token_stream cho biết định dạng mã hoá:
+# 1 = từ điển riêng của document + mảng chỉ số vào từ điển đó
+FORMAT_LOCAL_VOCABULARY = 1
+
+_HEADER = struct.Struct('<BcI')  # format, kiểu phần tử của mảng id, số byte của từ điển
+
+
+def _id_typecode(vocabulary_size: int) -> str:
+    return 'H' if vocabulary_size <= 0xFFFF else 'I'
+
+
+def encode_tokens(tokens: list[str]) -> bytes:
+    """
+    Mã hoá danh sách token (kết quả preprocess) thành bytes gọn để lưu vào database:
+    từ điển các token phân biệt (UTF-8, phân tách bằng "\\n" vì token không chứa khoảng trắng)
+    và mảng chỉ số 2 hoặc 4 byte little-endian theo đúng thứ tự token.
+    """
+    ids = {}
+    for token in tokens:
+        ids.setdefault(token, len(ids))
+    vocabulary = "\n".join(ids).encode('utf-8')
+
+    typecode = _id_typecode(len(ids))
+    stream = array(typecode, [ids[token] for token in tokens])
+    if sys.byteorder == 'big':
+        stream.byteswap()
+    return _HEADER.pack(FORMAT_LOCAL_VOCABULARY, typecode.encode(), len(vocabulary)) + vocabulary + stream.tobytes()
+
+
+def decode_tokens(data: bytes) -> list[str]:
+    """
+    Ngược lại của encode_tokens.
+    """
+    data = bytes(data)
+    token_format, typecode, vocabulary_length = _HEADER.unpack_from(data)
+    if token_format != FORMAT_LOCAL_VOCABULARY:
+        raise ValueError(f"Unknown token stream format: {token_format}")
+
+    offset = _HEADER.size
+    vocabulary = data[offset:offset + vocabulary_length].decode('utf-8').split("\n")
+    stream = array(typecode.decode())
+    stream.frombytes(data[offset + vocabulary_length:])
+    if sys.byteorder == 'big':
+        stream.byteswap()
+    return [vocabulary[token_id] for token_id in stream]
+
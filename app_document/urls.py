@@ -7,9 +7,12 @@ from .views import (
     DocumentTypeViewSet,
     DocumentViewSet,
     PlagiarismCheckAPIView,
+    CheckJobAPIView,
+    CheckJobDetailAPIView,
     DashboardView,
     PlagiarismCheckDetailAPIView,
     PlagiarismCheckListAPIView,
+    PlagiarismCheckReportAPIView,
     DocumentExportPDFView
 )
 
@@ -44,6 +47,11 @@ urlpatterns = [
         PlagiarismCheckDetailAPIView.as_view(),
         name='plagiarism-check-detail'
     ),
+    path(
+        'documents/<int:pk>/check/<int:check_id>/report/',
+        PlagiarismCheckReportAPIView.as_view(),
+        name='plagiarism-check-report'
+    ),
 
     path(
         'dashboard/overview/',
@@ -57,6 +65,12 @@ urlpatterns = [
     ),
 
     path('upload/', PlagiarismCheckAPIView.as_view(), name='pdf-upload'),
+    path('check-jobs/', CheckJobAPIView.as_view(), name='check-job-submit'),
+    path(
+        'check-jobs/<int:job_id>/',
+        CheckJobDetailAPIView.as_view(),
+        name='check-job-detail'
+    ),
     path(
         'api/documents/<int:pk>/download_pdf/',
         DocumentExportPDFView.as_view(),
@@ -4,11 +4,29 @@
 # import pdfplumber
 # from pdfminer.high_level import extract_text_to_fp
 from difflib import SequenceMatcher
-import os
-import tempfile
+import codecs
+import io
+import math
+import mmap
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Iterator
 from django.core.files.uploadedfile import UploadedFile
 from pypdf import PdfReader
 from docx import Document as DocxDocument
+from .alignment import get_matching_blocks
+from .executors import get_executor, in_worker_process, terminate_executor
+
+
+# Thời gian tối đa (giây) để trích xuất một trang PDF, quá thì coi trang đó rỗng
+PDF_PAGE_TIMEOUT = 10
+# PDF từ số trang này trở lên được chia cho nhiều process, mỗi việc PDF_PAGES_PER_TASK trang
+PDF_PARALLEL_MIN_PAGES = 40
+PDF_PAGES_PER_TASK = 20
+# Dòng TXT dài hơn ngưỡng này (ký tự) được cắt ở khoảng trắng cuối cùng (hoặc ngay tại ngưỡng)
+TXT_MAX_PENDING_CHARS = 1024 * 1024
+_TXT_SPACES = " \t\r\x0b\x0c"
 
 
 def extract_text_from_file(uploaded_file: UploadedFile) -> str:
@@ -19,75 +37,229 @@ def extract_text_from_file(uploaded_file: UploadedFile) -> str:
     # file_path = document.file.path
     # ext = os.path.splitext(file_path)[1].lower()
 
+    return "".join(iter_extract_text(uploaded_file))
+
+
+def iter_extract_text(uploaded_file: UploadedFile) -> Iterator[str]:
+    """
+    Trích xuất text theo từng phần (từng trang PDF, từng đoạn DOCX, từng khối dòng TXT)
+    ngay từ stream upload, không ghi ra file tạm.
+    Nối các phần lại ("".join) được đúng nội dung của extract_text_from_file.
+    """
     name = uploaded_file.name.lower()
     if name.endswith('.txt'):
-        return _extract_txt(uploaded_file)
+        return _iter_txt(uploaded_file)
     elif name.endswith('.pdf'):
-        return _extract_pdf(uploaded_file)
+        return _iter_pdf(uploaded_file)
     elif name.endswith('.docx'):
-        return _extract_docx(uploaded_file)
+        return _iter_docx(uploaded_file)
     else:
         raise ValueError("Unsupported file type. Use .txt, .pdf, or .docx")
 
 
-def _extract_txt(uploaded_file: UploadedFile) -> str:
-    data = uploaded_file.read()
+@contextmanager
+def _open_stream(uploaded_file: UploadedFile):
+    """
+    Stream nhị phân để đọc file upload:
+    - file nằm trên đĩa (TemporaryUploadedFile, FieldFile đã mở) thì memory-map file đó,
+    - file trong bộ nhớ thì đọc trực tiếp (đưa con trỏ về đầu).
+    """
+    uploaded_file.seek(0)
+    try:
+        mapped = mmap.mmap(uploaded_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):  # không có fileno, hoặc file rỗng
+        yield uploaded_file
+        return
+    with mapped:
+        yield mapped
+
+
+def _txt_encoding(uploaded_file: UploadedFile) -> str:
+    """
+    'utf-8' nếu cả file là UTF-8 hợp lệ (kể cả phần cuối file), ngược lại 'latin-1'.
+    Chỉ kiểm tra từng chunk, không giữ lại text đã giải mã.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
     try:
-        return data.decode('utf-8')
+        for chunk in uploaded_file.chunks():
+            decoder.decode(chunk)
+        decoder.decode(b"", final=True)
     except UnicodeDecodeError:
-        return data.decode('latin-1', errors='ignore')
+        return 'latin-1'
+    return 'utf-8'
 
 
-def _extract_pdf(uploaded_file: UploadedFile) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-        for chunk in uploaded_file.chunks():
-            tmp.write(chunk)
-        tmp_path = tmp.name
+def _iter_txt(uploaded_file: UploadedFile) -> Iterator[str]:
+    """
+    Giải mã theo từng chunk, chỉ trả về phần kết thúc bằng xuống dòng
+    để không cắt đôi một từ. Giống như giải mã cả file một lần: file có byte không
+    hợp lệ ở bất kỳ đâu thì cả file được đọc lại từ đầu bằng latin-1 (_txt_encoding).
+    File không xuống dòng (vd. dump một dòng) thì phần chờ không vượt quá
+    TXT_MAX_PENDING_CHARS: cắt ở khoảng trắng cuối cùng, không có thì cắt ngay tại ngưỡng.
+    """
+    decoder = codecs.getincrementaldecoder(_txt_encoding(uploaded_file))(errors='ignore')
+    pending = ""
+    for chunk in uploaded_file.chunks():
+        pending += decoder.decode(chunk)
+        cut = pending.rfind("\n") + 1
+        if not cut and len(pending) > TXT_MAX_PENDING_CHARS:
+            cut = max(pending.rfind(space) for space in _TXT_SPACES) + 1 or TXT_MAX_PENDING_CHARS
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+class _PageTimeout(Exception):
+    pass
+
 
-   
-    text = ""
+def _raise_page_timeout(signum, frame):
+    raise _PageTimeout()
+
+
+def _extract_page(page, timeout: float = PDF_PAGE_TIMEOUT) -> str:
+    """
+    page.extract_text() với giới hạn thời gian (SIGALRM, chỉ dùng được ở main thread).
+    Trang lỗi hoặc quá thời gian trả về chuỗi rỗng để không làm hỏng cả file.
+    Giới hạn chỉ có hiệu lực trong process con của pool và run_check_worker; khi trích xuất ngay
+    trong thread xử lý request (InlineExecutor, PLAGIARISM_WORKERS = 1) thì không có timeout.
+    """
+    use_alarm = timeout and threading.current_thread() is threading.main_thread() and hasattr(signal, 'setitimer')
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_page_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
     try:
-        reader = PdfReader(tmp_path)
-        for page in reader.pages:
-            page_text = page.extract_text() or ""
-            text += page_text + "\n"
-    finally:
         try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
-
+            text = page.extract_text() or ""
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except Exception:  # kể cả _PageTimeout đến ngay trước khi kịp huỷ alarm
+        text = ""
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous)
     return text
 
 
-def _extract_docx(uploaded_file: UploadedFile) -> str:
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp:
-        for chunk in uploaded_file.chunks():
-            tmp.write(chunk)
-        tmp_path = tmp.name
+def _extract_pdf_pages(source, start: int, stop: int, timeout: float) -> list[str]:
+    """
+    Chạy trong process con: trích xuất các trang [start, stop) của PDF.
+    source là đường dẫn file hoặc bytes.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            reader = PdfReader(mapped)
+            return [_extract_page(reader.pages[n], timeout) for n in range(start, stop)]
+    reader = PdfReader(io.BytesIO(source))
+    return [_extract_page(reader.pages[n], timeout) for n in range(start, stop)]
+
 
-    text = ""
+def _pdf_source(uploaded_file: UploadedFile):
+    """
+    Đường dẫn file trên đĩa nếu có (process con tự mở), ngược lại là bytes của file.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return uploaded_file.temporary_file_path()
     try:
-        doc = DocxDocument(tmp_path)
-        paragraphs = [para.text for para in doc.paragraphs]
-        text = "\n".join(paragraphs)
-    finally:
+        return uploaded_file.path
+    except (AttributeError, NotImplementedError, ValueError):
+        uploaded_file.seek(0)
+        return uploaded_file.read()
+
+
+def _iter_pdf(uploaded_file: UploadedFile, page_timeout: float = PDF_PAGE_TIMEOUT) -> Iterator[str]:
+    with _open_stream(uploaded_file) as stream:
+        reader = PdfReader(stream)
+        page_count = len(reader.pages)
+        # Trong process con của pool (không tạo pool lồng nhau) thì trích xuất tuần tự;
+        # check_uploaded_files tự chia trang PDF lớn cho pool (submit_pdf_pages)
+        if page_count >= PDF_PARALLEL_MIN_PAGES and not in_worker_process():
+            yield from _iter_pdf_parallel(uploaded_file, page_count, page_timeout)
+            return
+
+        for page in reader.pages:
+            yield _extract_page(page, page_timeout) + "\n"
+
+
+def pdf_page_count(name: str, path: str = None, data: bytes = None) -> int:
+    """
+    Số trang của file PDF (đường dẫn hoặc bytes), 0 nếu không phải PDF hoặc không đọc được.
+    """
+    if not name.lower().endswith('.pdf'):
+        return 0
+    try:
+        if path:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return len(PdfReader(mapped).pages)
+        return len(PdfReader(io.BytesIO(data)).pages)
+    except Exception:
+        return 0
+
+
+def submit_pdf_pages(executor, source, page_count: int, page_timeout: float = PDF_PAGE_TIMEOUT) -> list:
+    """
+    Gửi các lô PDF_PAGES_PER_TASK trang của PDF vào executor, trả về [(start, stop, future)].
+    source là đường dẫn file hoặc bytes (process con tự mở).
+    """
+    ranges = [
+        (start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    return [
+        (start, stop, executor.submit(_extract_pdf_pages, source, start, stop, page_timeout))
+        for start, stop in ranges
+    ]
+
+
+def iter_pdf_pages(tasks, page_timeout: float = PDF_PAGE_TIMEOUT) -> Iterator[str]:
+    """
+    Text từng trang theo đúng thứ tự từ kết quả của submit_pdf_pages.
+    Cả lô quá hạn (process con bị treo) hoặc lỗi thì các trang của lô đó coi là rỗng.
+    """
+    for start, stop, future in tasks:
         try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+            pages = future.result(timeout=page_timeout * (stop - start) + 30)
+        except Exception:
+            pages = [""] * (stop - start)
+        for page_text in pages:
+            yield page_text + "\n"
 
-    return text
+
+def _iter_pdf_parallel(uploaded_file: UploadedFile, page_count: int, page_timeout: float) -> Iterator[str]:
+    """
+    Trích xuất song song các trang trong process pool riêng (vd. CheckJob trong run_check_worker),
+    trả về đúng thứ tự trang. Mỗi trang có timeout riêng trong process con; lô nào quá hạn
+    hoặc lỗi thì các process con (có thể đang bị treo) bị kill khi kết thúc.
+    """
+    executor = get_executor(math.ceil(page_count / PDF_PAGES_PER_TASK))
+    tasks = []
+    try:
+        tasks = submit_pdf_pages(executor, _pdf_source(uploaded_file), page_count, page_timeout)
+        yield from iter_pdf_pages(tasks, page_timeout)
+    finally:
+        if all(future.done() and not future.cancelled() and future.exception() is None for _, _, future in tasks):
+            executor.shutdown(wait=False)
+        else:
+            terminate_executor(executor)
+
+
+def _iter_docx(uploaded_file: UploadedFile) -> Iterator[str]:
+    with _open_stream(uploaded_file) as stream:
+        doc = DocxDocument(stream)
+        for i, para in enumerate(doc.paragraphs):
+            yield ("\n" if i else "") + para.text
 
 
-def find_matches(input_text, db_text):
-    matcher = SequenceMatcher(None, input_text, db_text)
+def find_matches(input_text, db_text, method=None):
     matches = []
-    for block in matcher.get_matching_blocks():
-        i, j, size = block
-        if size > 20:  # chỉ highlight đoạn trùng lớn hơn 20 ký tự
-            matched = db_text[j:j+size]
-            matches.append(matched)
+    # chỉ highlight đoạn trùng lớn hơn 20 ký tự
+    for i, j, size in get_matching_blocks(input_text, db_text, threshold=21, method=method):
+        matched = db_text[j:j+size]
+        matches.append(matched)
     return matches
 
 
@@ -97,14 +269,15 @@ def calculate_similarity(text1, text2):
     return round(ratio * 100, 2)  # % trùng lặp
 
 
-def extract_matching_blocks(text1, text2, threshold=10):
-    matcher = SequenceMatcher(None, text1, text2)
+def extract_matching_blocks(text1, text2, threshold=10, method=None):
+    """
+    Các đoạn của text1 trùng với text2 (dài ít nhất threshold ký tự).
+    method='seed' (mặc định, xem alignment.py) hoặc 'difflib' (SequenceMatcher như trước).
+    """
     matches = []
-    for block in matcher.get_matching_blocks():
-        i, j, size = block
-        if size >= threshold:
-            matched = text1[i:i+size]
-            matches.append(matched)
+    for i, j, size in get_matching_blocks(text1, text2, threshold=threshold, method=method):
+        matched = text1[i:i+size]
+        matches.append(matched)
     return matches
 
 
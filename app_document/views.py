@@ -1,14 +1,16 @@
-from django.http import FileResponse, Http404
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.views import View
 from django.urls import reverse
 # from User.is_authenticate import is_not_authenticated
 
+from django.db import transaction
+from django.db.models.functions import Length
+from django.utils.cache import get_conditional_response
 from rest_framework import viewsets, permissions, filters, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -16,18 +18,39 @@ from .serializers import (
     CatalogSerializer,
     DocumentTypeSerializer,
     DocumentSerializer,
+    DocumentListSerializer,
     DocumentUploadSerializer,
     PlagiarismCheckSerializer,
+    CheckJobSerializer,
 )
 
-from .utils import extract_text_from_file, extract_matching_blocks
 from .models import (
     Catalog,
+    CheckJob,
     DocumentType,
     Document,
     PlagiarismCheck
 )
-from .plagiarism import search_corpus, index_document
+from .highlight import (
+    check_highlights,
+    check_is_stale,
+    count_paragraphs,
+    highlight_ranges,
+    iter_chunks,
+    iter_highlight_html,
+    iter_paragraph_html,
+)
+from .export import (
+    EXPORT_INLINE_MAX_CHARS,
+    expire_document_exports,
+    export_document_pdf,
+    exported_pdf,
+    submit_export_job,
+)
+from .pagination import DocumentCursorPagination
+from .pipeline import check_uploaded_files, submit_check_jobs
+from .plagiarism import index_document
+from .reports import cache_report, cached_report, expire_document_reports, report_etag
 from app_auth.permissions import IsAdminOrReadOnly
 
 
@@ -72,10 +95,46 @@ class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     parser_classes = (MultiPartParser, FormParser)  # để hỗ trợ upload file
+    pagination_class = DocumentCursorPagination
 
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'author', 'catalog__name', 'document_type__name']
-    ordering_fields = ['uploaded_at', 'publication_year']
+    ordering_fields = ['uploaded_at', 'publication_year', 'latest_plagiarism_percentage', 'id']
+    ordering = ['-uploaded_at', '-id']
+
+    def get_queryset(self):
+        """
+        Lấy catalog/document_type bằng JOIN, lần kiểm tra mới nhất đọc từ cột
+        latest_check/latest_plagiarism_percentage của Document. Danh sách không tải content.
+        Lọc theo mức đạo văn: ?min_plagiarism=30&max_plagiarism=80 (chỉ document đã kiểm tra).
+        """
+        queryset = Document.objects.select_related('catalog', 'document_type').defer('token_stream')
+        if self.action == 'list':
+            queryset = queryset.defer('content', 'token_stream')
+
+        min_plagiarism = self._percentage_param('min_plagiarism')
+        max_plagiarism = self._percentage_param('max_plagiarism')
+        if min_plagiarism is not None or max_plagiarism is not None:
+            queryset = queryset.filter(latest_check__isnull=False)
+        if min_plagiarism is not None:
+            queryset = queryset.filter(latest_plagiarism_percentage__gte=min_plagiarism)
+        if max_plagiarism is not None:
+            queryset = queryset.filter(latest_plagiarism_percentage__lte=max_plagiarism)
+        return queryset
+
+    def _percentage_param(self, name):
+        value = self.request.query_params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            raise ValidationError({name: "Must be a number."})
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DocumentListSerializer
+        return DocumentSerializer
 
     def perform_create(self, serializer):
         """
@@ -86,6 +145,27 @@ class DocumentViewSet(viewsets.ModelViewSet):
         user = self.request.user if self.request.user.is_authenticated else None
         serializer.save(user=user)
 
+    @transaction.atomic
+    def perform_update(self, serializer):
+        """
+        Sửa content thì cập nhật inverted index của document (chỉ phần TF/DF thay đổi)
+        trong cùng transaction với lệnh UPDATE, và bỏ các báo cáo đã cache của document.
+        PDF đã xuất có cả tiêu đề nên bị bỏ sau mọi lần sửa.
+        """
+        document = serializer.save()
+        if 'content' in serializer.validated_data:
+            index_document(document)
+            expire_document_reports(document)
+        expire_document_exports(document)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        """
+        Xoá document: doc_freq của các term được giảm tương ứng (signal pre_delete)
+        trong cùng transaction với lệnh DELETE.
+        """
+        instance.delete()
+
 
 class PlagiarismCheckAPIView(APIView):
     parser_classes = (MultiPartParser, FormParser)
@@ -95,98 +175,38 @@ class PlagiarismCheckAPIView(APIView):
         if not uploaded_files:
             return Response({"detail": "No files provided."}, status=status.HTTP_400_BAD_REQUEST)
 
-        results = []
-        for file in uploaded_files:
-            try:
-                text = extract_text_from_file(file)
-
-                doc = Document.objects.create(
-                    title=file.name,
-                    file=file,
-                    content=text,
-                    user=request.user if request.user.is_authenticated else None,
-                    doc_length=len(text),
-                    original_filename=file.name,
-                    file_extension=file.name.split('.')[-1],
-                )
-
-                index_document(doc)
-
-                # Search corpus
-                matches = search_corpus(text, top_n=5, exclude_doc_id=doc.id)
-
-                if matches:
-                    matched_doc, score = matches[0]
-                    db_text = matched_doc.content
-
-                    matched_blocks = extract_matching_blocks(text, db_text)
-
-                    plagiarism_check = PlagiarismCheck.objects.create(
-                        document=doc,
-                        plagiarism_percentage=round(score * 100, 2),
-                        duplicate_sources=[{
-                            "source_id": matched_doc.id,
-                            "source_title": matched_doc.title,
-                            "matched_percent": round(score * 100, 2),
-                            "highlights": matched_blocks
-                        }],
-                        highlights=matched_blocks
-                    )
-
-                    # Render HTML highlight
-                    highlighted_ranges = []
-                    last_idx = 0
-                    for match in matched_blocks:
-                        start_idx = text.find(match, last_idx)
-                        if start_idx != -1:
-                            highlighted_ranges.append({
-                                "start": start_idx,
-                                "end": start_idx + len(match)
-                            })
-                            last_idx = start_idx + len(match)
-
-                    highlighted_ranges.sort(key=lambda x: x['start'])
-                    last_idx = 0
-                    html_content = ""
-                    for hl in highlighted_ranges:
-                        html_content += text[last_idx:hl['start']]
-                        html_content += f'<span style="background-color: yellow;">{text[hl["start"]:hl["end"]]}</span>'
-                        last_idx = hl['end']
-                    html_content += text[last_idx:]
-
-                    results.append({
-                        "file_name": file.name,
-                        "document_id": doc.id,
-                        "plagiarism_check_id": plagiarism_check.id,
-                        "plagiarism_percentage": plagiarism_check.plagiarism_percentage,
-                        "html_content": html_content,
-                        "highlights": highlighted_ranges
-                    })
-                else:
-                    plagiarism_check = PlagiarismCheck.objects.create(
-                        document=doc,
-                        plagiarism_percentage=0.0,
-                        duplicate_sources=[],
-                        highlights=[]
-                    )
-                    results.append({
-                        "file_name": file.name,
-                        "document_id": doc.id,
-                        "plagiarism_check_id": plagiarism_check.id,
-                        "plagiarism_percentage": 0.0,
-                        "html_content": text,
-                        "highlights": []
-                    })
-
-            except Exception as e:
-                results.append({
-                    "file_name": file.name,
-                    "error": str(e)
-                })
-
+        user = request.user if request.user.is_authenticated else None
+        results = check_uploaded_files(uploaded_files, user=user)
         return Response({"results": results})
 
 
+class CheckJobAPIView(APIView):
+    """
+    Gửi file kiểm tra đạo văn vào hàng đợi, trả về ngay danh sách job id.
+    Theo dõi tiến độ qua CheckJobDetailAPIView.
+    """
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, format=None):
+        uploaded_files = request.FILES.getlist('files')
+        if not uploaded_files:
+            return Response({"detail": "No files provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user if request.user.is_authenticated else None
+        jobs = submit_check_jobs(uploaded_files, user=user)
+        serializer = CheckJobSerializer(jobs, many=True)
+        return Response({"jobs": serializer.data}, status=status.HTTP_202_ACCEPTED)
+
+
+class CheckJobDetailAPIView(APIView):
+    def get(self, request, job_id):
+        try:
+            job = CheckJob.objects.get(id=job_id)
+        except CheckJob.DoesNotExist:
+            return Response({"detail": "CheckJob not found."}, status=404)
+        return Response(CheckJobSerializer(job).data)
+
+
 class DashboardView(APIView):
     def get(self, request):
         return Response({
@@ -195,111 +215,147 @@ class DashboardView(APIView):
 
 
 class PlagiarismCheckDetailAPIView(APIView):
+    """
+    Kết quả một lần kiểm tra kèm HTML highlight. PlagiarismCheck không đổi sau khi tạo nên
+    JSON đã render được cache theo check id (reports.py): lần xem lại chỉ đọc cache,
+    hoặc trả 304 nếu If-None-Match khớp ETag.
+    """
+
     def get(self, request, pk, check_id):
+        etag = report_etag(pk, check_id)
+        if etag is not None:
+            not_modified = self._not_modified(request, etag)
+            if not_modified is not None:
+                return not_modified
+            body = cached_report(pk, check_id)
+            if body is not None:
+                return self._json_response(body, etag)
+
         try:
-            check = PlagiarismCheck.objects.get(id=check_id, document_id=pk)
-            text = check.document.content
-
-            # Hàm tính màu dựa theo % matched
-            def get_highlight_color(percent):
-                percent = max(0, min(percent, 100))  # Clamp từ 0 → 100
-                if percent < 20:
-                    return '#ccffcc'  # xanh nhạt
-                elif percent < 50:
-                    return '#ffff99'  # vàng
-                elif percent < 80:
-                    return '#ff6666'  # đỏ
-                else:
-                    return 'yellow'  # cam
-
-            # Render lại html content từ highlights
-            highlighted_ranges = []
-            for match in check.highlights or []:
-                start_idx = text.find(match)
-                if start_idx != -1:
-                    highlighted_ranges.append({
-                        "start": start_idx,
-                        "end": start_idx + len(match)
-                    })
-
-            highlighted_ranges.sort(key=lambda x: x['start'])
-            last_idx = 0
-            html_content = ""
-
-            # Tính matched_percent cao nhất (nếu có)
-            matched_percent = 0.0
-            if check.duplicate_sources:
-                try:
-                    matched_percent = max(
-                        src.get('matched_percent', 0) for src in check.duplicate_sources
-                    )
-                except Exception:
-                    matched_percent = 0.0
+            check = PlagiarismCheck.objects.select_related('document').get(id=check_id, document_id=pk)
+        except PlagiarismCheck.DoesNotExist:
+            return Response({"detail": "PlagiarismCheck not found."}, status=404)
 
+        text = check.document.content or ""
+        # Offset đã lưu lúc kiểm tra: cắt thẳng text, không tìm lại chuỗi
+        # (không có highlight nếu content đã bị sửa sau lần kiểm tra)
+        highlights = check_highlights(check)
+
+        body = JSONRenderer().render({
+            "document_id": pk,
+            "plagiarism_check_id": check_id,
+            "plagiarism_percentage": check.plagiarism_percentage,
+            # matched_percent cao nhất, tính sẵn lúc lưu check
+            "matched_percent": check.max_matched_percent,
+            "html_content": "".join(iter_highlight_html(text, highlights)),
+            "highlights": highlight_ranges(highlights),
+            "doc_length": check.document.doc_length,
             # Tổng số văn bản đã so sánh (số document trong search_corpus lúc tạo check)
-            total_compared_docs = len(check.duplicate_sources or [])
-
-            # Render html content với màu
-            for hl in highlighted_ranges:
-                html_content += text[last_idx:hl['start']]
-                # hiện tại fallback % chung
-                color = get_highlight_color(matched_percent)
-                html_content += (
-                    f'<span style="background-color: {color};">'
-                    f'{text[hl["start"]:hl["end"]]}'
-                    f'</span>'
-                )
-                last_idx = hl['end']
-            html_content += text[last_idx:]
-
-            return Response({
-                "document_id": pk,
-                "plagiarism_check_id": check_id,
-                "plagiarism_percentage": check.plagiarism_percentage,
-                "matched_percent": matched_percent,
-                "html_content": html_content,
-                "highlights": highlighted_ranges,
-                "doc_length": check.document.doc_length,
-                "total_compared_docs": total_compared_docs
-            })
+            "total_compared_docs": len(check.duplicate_sources or []),
+            # Content đã sửa sau lần kiểm tra này: cần kiểm tra lại
+            "stale": check_is_stale(check),
+        })
+        etag = cache_report(pk, check_id, body)
+        return self._not_modified(request, etag) or self._json_response(body, etag)
 
+    def _not_modified(self, request, etag):
+        """
+        304 nếu If-None-Match khớp etag, ngược lại None.
+        """
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            response['ETag'] = etag
+        return response
+
+    def _json_response(self, body, etag):
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+
+class PlagiarismCheckReportAPIView(APIView):
+    """
+    Báo cáo highlight dạng HTML gửi dần từng đoạn (StreamingHttpResponse), frontend hiển thị
+    được màn hình đầu tiên mà không chờ cả văn bản.
+    - ?start=: chỉ số đoạn đầu tiên (mặc định 0)
+    - ?limit=: số đoạn tối đa (mặc định đến hết văn bản)
+    Header X-Total-Paragraphs cho biết tổng số đoạn để tải tiếp các phần sau;
+    X-Check-Stale = 1 khi content đã sửa sau lần kiểm tra (báo cáo không có highlight).
+    """
+
+    def get(self, request, pk, check_id):
+        try:
+            first = int(request.query_params.get('start', 0))
+            count = request.query_params.get('limit')
+            count = int(count) if count not in (None, '') else None
+        except ValueError:
+            return Response({"detail": "start and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if first < 0 or (count is not None and count < 0):
+            return Response({"detail": "start and limit must not be negative."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            check = PlagiarismCheck.objects.select_related('document').get(id=check_id, document_id=pk)
         except PlagiarismCheck.DoesNotExist:
             return Response({"detail": "PlagiarismCheck not found."}, status=404)
 
+        text = check.document.content or ""
+        highlights = check_highlights(check)
+        response = StreamingHttpResponse(
+            iter_chunks(iter_paragraph_html(text, highlights, first, count)),
+            content_type='text/html; charset=utf-8'
+        )
+        response['X-Total-Paragraphs'] = count_paragraphs(text)
+        response['X-Plagiarism-Percentage'] = check.plagiarism_percentage
+        response['X-Check-Stale'] = int(check_is_stale(check))
+        return response
+
 
 class PlagiarismCheckListAPIView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get(self, request):
-        queryset = PlagiarismCheck.objects.all().order_by('checked_at')
+        queryset = (
+            PlagiarismCheck.objects.select_related('document')
+            .only('id', 'document_id', 'document__title', 'checked_at',
+                  'plagiarism_percentage', 'max_matched_percent')
+            .order_by('checked_at')
+        )
         serializer = PlagiarismCheckSerializer(queryset, many=True)
         return Response(serializer.data)
 
 
 class DocumentExportPDFView(View):
+    """
+    Tải PDF của document kèm highlight của lần kiểm tra mới nhất (xem export.py).
+    PDF chưa có sẵn của document dài (EXPORT_INLINE_MAX_CHARS) được dựng trong run_check_worker:
+    trả 202 kèm job id, tải lại URL này khi job xong.
+    """
+
     def get(self, request, pk):
         try:
-            document = Document.objects.get(id=pk)
+            # content chỉ được tải khi PDF chưa có sẵn và phải dựng lại
+            document = (
+                Document.objects.select_related('latest_check')
+                .defer('content', 'token_stream')
+                .annotate(content_length=Length('content'))
+                .get(id=pk)
+            )
         except Document.DoesNotExist:
             raise Http404("Không tìm thấy tài liệu.")
 
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        p.setFont("Helvetica", 12)
-        lines = document.content.split('\n')
-
-        y = height - 50
-        for line in lines:
-            p.drawString(50, y, line)
-            y -= 20
-            if y < 50:
-                p.showPage()
-                p.setFont("Helvetica", 12)
-                y = height - 50
-
-        p.save()
-        buffer.seek(0)
-
-        return FileResponse(buffer, as_attachment=True, filename=f"{document.title or 'document'}.pdf", content_type='application/pdf')
\ No newline at end of file
+        pdf = exported_pdf(document)
+        if pdf is None and (document.content_length or 0) > EXPORT_INLINE_MAX_CHARS:
+            user = request.user if request.user.is_authenticated else None
+            job = submit_export_job(document, user=user)
+            return JsonResponse({
+                "detail": "PDF export queued.",
+                "job_id": job.id,
+                "status_url": reverse('check-job-detail', kwargs={'job_id': job.id}),
+            }, status=status.HTTP_202_ACCEPTED)
+
+        return FileResponse(
+            pdf or export_document_pdf(document),
+            as_attachment=True,
+            filename=f"{document.title or 'document'}.pdf",
+            content_type='application/pdf'
+        )
@@ -86,6 +86,8 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Header của báo cáo kiểm tra mà frontend cần đọc được (cache ETag, stream theo đoạn)
+CORS_EXPOSE_HEADERS = ['ETag', 'X-Total-Paragraphs', 'X-Plagiarism-Percentage', 'X-Check-Stale']
 # CORS_ALLOWED_ORIGINS = ["http://localhost:3000"]
 
 ROOT_URLCONF = 'main.urls'
@@ -123,6 +125,27 @@ DATABASES = {
     }
 }
 
+# Cache dùng chung giữa các worker process (báo cáo đã render + ETag, kết quả extract theo
+# content_hash): mặc định file trên disk, đặt REDIS_CACHE_URL để dùng Redis (cần package redis).
+# LocMemCache riêng từng process nên mỗi worker giữ một bản và ETag không khớp nhau.
+if os.getenv('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / 'cache')),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 20000)),
+            },
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -172,3 +195,17 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Số process dùng để extract / tách từ / alignment song song khi kiểm tra nhiều file
+PLAGIARISM_WORKERS = int(os.getenv('PLAGIARISM_WORKERS', os.cpu_count() or 1))
+
+# Index dùng cho search_corpus: 'database' (ma trận nạp từ bảng Posting) hoặc
+# 'segments' (segment mmap trong MEDIA_ROOT/index_segments, tạo bằng manage.py merge_segments --rebuild)
+PLAGIARISM_INDEX_BACKEND = os.getenv('PLAGIARISM_INDEX_BACKEND', 'database')
+
+# Cách tìm đoạn trùng giữa văn bản và nguồn: 'seed' (seed hash, tuyến tính) hoặc
+# 'difflib' (SequenceMatcher như trước, dùng khi cần đối chiếu với kết quả cũ)
+PLAGIARISM_ALIGNMENT_METHOD = os.getenv('PLAGIARISM_ALIGNMENT_METHOD', 'seed')
+
+# Font TTF (có dấu tiếng Việt) dùng khi xuất PDF; để trống thì tự tìm DejaVuSans/Arial trên máy
+PDF_EXPORT_FONT = os.getenv('PDF_EXPORT_FONT', '')